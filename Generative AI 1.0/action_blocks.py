@@ -0,0 +1,53 @@
+import re
+from typing import Dict, List
+
+CALENDAR_TAG = "CALENDAR_EVENT"
+NOTE_TAG = "NOTE_EVENT"
+
+# Ein Durchlauf für beide Blocktypen; \1 erzwingt das passende End-Tag
+BLOCK_RE = re.compile(r"\[(CALENDAR_EVENT|NOTE_EVENT)\](.*?)\[/\1\]", re.DOTALL)
+
+
+class ParsedReply:
+    """KI-Antwort, zerlegt in Anzeigetext und die enthaltenen Aktionsblöcke."""
+
+    def __init__(self, display: str, blocks: Dict[str, List[str]]):
+        self.display = display
+        self.blocks = blocks
+
+    @property
+    def calendar(self) -> List[str]:
+        return self.blocks[CALENDAR_TAG]
+
+    @property
+    def notes(self) -> List[str]:
+        return self.blocks[NOTE_TAG]
+
+
+def parse_reply(text: str) -> ParsedReply:
+    """Trennt Anzeigetext und Blöcke in einem einzigen Regex-Durchlauf."""
+    blocks = {CALENDAR_TAG: [], NOTE_TAG: []}
+    visible = []
+    pos = 0
+    for match in BLOCK_RE.finditer(text):
+        visible.append(text[pos:match.start()])
+        blocks[match.group(1)].append(match.group(2))
+        pos = match.end()
+    visible.append(text[pos:])
+    return ParsedReply("".join(visible).strip(), blocks)
+
+
+def find_blocks(text: str, tag: str) -> List[str]:
+    return [m.group(2) for m in BLOCK_RE.finditer(text) if m.group(1) == tag]
+
+
+def parse_fields(block: str) -> Dict[str, str]:
+    """'Key: Value'-Zeilen eines Blocks; Schlüssel in Kleinbuchstaben."""
+    data = {}
+    for line in block.strip().split("\n"):
+        line = line.strip()
+        if not line or ":" not in line:
+            continue
+        k, v = line.split(":", 1)
+        data[k.strip().lower()] = v.strip()
+    return data
@@ -3,7 +3,10 @@ import httpx
 import base64
 import datetime
 import asyncio
+import json
 import re
+import time
+from typing import AsyncIterator, List, Optional, Tuple
 from openai import AsyncOpenAI
 from google import genai
 from google.genai import types
@@ -14,7 +17,24 @@ from database import (
     save_calendar_context,
     save_info,
     get_all_notes,
+    get_table_version,
+    get_latest_message_id,
+    get_messages_since,
+    get_summary_watermark,
+    record_summary_run,
 )
+from context_budget import (
+    HISTORY_FETCH_LIMIT,
+    assemble_context,
+    count_tokens,
+    fit_notes,
+    truncate_to_tokens,
+)
+from images import PreparedImage, processor as image_processor
+from llm_dispatch import AllProvidersFailed, ProviderHealth, dispatch
+from memory_index import MEMORY_TOKEN_BUDGET, memory
+from tracing import span, traced
+from transcription import engine as transcription_engine
 
 O_KEY = os.getenv("OPENAI_API_KEY")
 G_KEY = os.getenv("GEMINI_API_KEY")
@@ -27,6 +47,17 @@ MODEL_OPENROUTER = "openrouter/free"
 client_openai = AsyncOpenAI(api_key=O_KEY) if O_KEY else None
 client_gemini = genai.Client(api_key=G_KEY) if G_KEY else None
 
+# "sequential": klassische Fallback-Kette, "hedged": nächster Anbieter startet parallel,
+# wenn der laufende langsamer als sein Latenz-Perzentil ist
+LLM_DISPATCH_MODE = os.getenv("LLM_DISPATCH_MODE", "sequential")
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+
+PROVIDER_HEALTH = {
+    "OpenAI": ProviderHealth("OpenAI", timeout=25),
+    "Gemini": ProviderHealth("Gemini", timeout=30),
+    "OpenRouter": ProviderHealth("OpenRouter", timeout=45),
+}
+
 # Globaler wiederverwendbarer HTTP-Client für schnellere API-Aufrufe (Keep-Alive)
 http_client = httpx.AsyncClient()
 
@@ -35,283 +66,625 @@ async def close_http_client():
     await http_client.aclose()
 
 
-async def build_system_instruction() -> str:
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    memories = await get_all_info()
-    cal_context = await get_latest_calendar_context()
-    notes = await get_all_notes()
+SYSTEM_RULES = (
+    "VERHALTENSREGELN:\n"
+    "1. Führe natürliche Unterhaltungen ohne ständige Erwähnung deiner Fähigkeiten.\n"
+    "2. FRAGE NIEMALS NACH BESTÄTIGUNG für Kalender- oder Notizblock-Aktionen. Handle SOFORT.\n"
+    "3. KONTEXT-VERSTÄNDNIS: Analysiere immer den bisherigen Chatverlauf und das KALENDER-GEDÄCHTNIS / NOTIZBLOCK-GEDÄCHTNIS!\n"
+    "4. INTELLIGENTE KLASSIFIZIERUNG (Entscheidung zwischen Kalender und Notizblock):\n"
+    "   - KALENDER: Feste Termine, Verabredungen oder Fristen mit einem konkreten Datum und/oder einer Uhrzeit (z. B. 'Meeting morgen um 14 Uhr', 'Zahnarzt am Freitag', 'Konzert am 15. Juni'). Erstelle hierfür einen [CALENDAR_EVENT] Block.\n"
+    "   - NOTIZBLOCK: Allgemeine Gedanken, Einkaufslisten, unstrukturierte Erinnerungen, Ideen oder To-Dos ohne festen Kalenderslot (z. B. 'Erinnere mich an Milch kaufen', 'Ich muss das Buch lesen', 'Klopapier holen', 'Coole Geschäftsidee aufschreiben'). Erstelle hierfür einen [NOTE_EVENT] Block.\n\n"
+    "KALENDER-FUNKTIONEN:\n"
+    "Du kannst Termine hinzufügen (add), löschen (delete), bearbeiten (edit) oder abrufen (list).\n"
+    "1. Bei 'list': Verwende bei 'Title' die Anzahl der Tage (z.B. '7' oder '-7') ODER ein exaktes Datum im Format 'YYYY-MM-DD', wenn nach einem ganz bestimmten Tag gefragt wird.\n"
+    "2. Bei 'delete' / 'edit': Verwende bei 'Title' ZWINGEND den echten Namen des Termins.\n"
+    "3. Block-Format:\n"
+    "[CALENDAR_EVENT]\n"
+    "Action: add\n"
+    "Title: Zahnarzt\n"
+    "Start: 2026-03-21T14:30:00Z\n"
+    "[/CALENDAR_EVENT]\n\n"
+    "NOTIZBLOCK-FUNKTIONEN:\n"
+    "Du kannst Notizen hinzufügen (add), löschen (delete) oder auflisten (list).\n"
+    "1. Bei 'add': Gib den gewünschten Text im Feld 'Content' an.\n"
+    "2. Bei 'delete': Gib die ID der zu löschenden Notiz im Feld 'Id' an (siehe NOTIZBLOCK-GEDÄCHTNIS oben), ODER den ungefähren Text im Feld 'Content'.\n"
+    "3. Bei 'list': Zeigt alle Notizen an.\n"
+    "4. Block-Format:\n"
+    "[NOTE_EVENT]\n"
+    "Action: add\n"
+    "Content: Milch und Äpfel kaufen\n"
+    "[/NOTE_EVENT]\n\n"
+    "Beispiel für 'delete' einer Notiz:\n"
+    "[NOTE_EVENT]\n"
+    "Action: delete\n"
+    "Id: 5\n"
+    "[/NOTE_EVENT]"
+)
 
-    memory_context = (
+# Prompt-Fragmente je Tabelle: {tabelle: (version, text)}
+_prompt_fragments: dict = {}
+
+
+SUMMARY_KEY = "Zusammenfassung"
+
+
+async def _memory_fragment() -> str:
+    memories = await get_all_info()
+    if memory.ready:
+        # Die Stichpunkte der Zusammenfassung kommen einzeln per Vektor-Suche (_recall_fragment)
+        memories = [(k, v) for k, v in memories if k != SUMMARY_KEY]
+    return (
         "Fakten über den Nutzer:\n" + "\n".join([f"- {k}: {v}" for k, v in memories])
         if memories
         else "Keine spezifischen Nutzerfakten vorhanden."
     )
 
-    notes_context = (
-        "NOTIZBLOCK-INHALT:\n" + "\n".join([f"- ID: {n['id']} | Inhalt: {n['content']}" for n in notes])
-        if notes
-        else "Der Notizblock ist leer."
-    )
+
+async def _notes_fragment() -> str:
+    notes = await get_all_notes()
+    if not notes:
+        return "Der Notizblock ist leer."
+    # Neueste zuerst, begrenzt auf das Notiz-Budget
+    lines, omitted = fit_notes([f"- ID: {n['id']} | Inhalt: {n['content']}" for n in notes])
+    if omitted:
+        lines.append(f"- ... {omitted} ältere Notizen nicht angezeigt (per 'list' abrufbar)")
+    return "NOTIZBLOCK-INHALT:\n" + "\n".join(lines)
+
+
+async def _recall_fragment(query: str) -> str:
+    hits = await memory.recall(query)
+    if not hits:
+        return ""
+    lines = [
+        f"- {h['content']}" if h["kind"] == "fact"
+        else f"- Gespräch vom {(h['created_at'] or '')[:10]}:\n{h['content']}"
+        for h in hits
+    ]
+    lines, _ = fit_notes(lines, MEMORY_TOKEN_BUDGET)
+    return "RELEVANTE ERINNERUNGEN (passend zur aktuellen Nachricht):\n" + "\n".join(lines) + "\n\n"
+
+
+async def init_memory() -> None:
+    """Öffnet das Vektor-Gedächtnis und gleicht es mit Zusammenfassung und Verlauf ab."""
+    await memory.open()
+    summary = dict(await get_all_info()).get(SUMMARY_KEY)
+    if summary:
+        await memory.set_facts(summary)
+    await memory.sync(force=True)
+
+
+async def _cached_fragment(table: str, loader, *depends) -> str:
+    # Version vor dem Laden lesen: ein paralleler Schreibzugriff invalidiert sofort wieder.
+    # `depends`: weiterer Zustand, von dem der Text abhängt (z.B. memory.ready)
+    version = (get_table_version(table), depends)
+    cached = _prompt_fragments.get(table)
+    if cached and cached[0] == version:
+        return cached[1]
+    text = await loader()
+    _prompt_fragments[table] = (version, text)
+    return text
+
+
+async def build_system_instruction(query: str = "") -> str:
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    memory_context = await _cached_fragment("user_info", _memory_fragment, memory.ready)
+    cal_context = await _cached_fragment("calendar_cache", get_latest_calendar_context)
+    notes_context = await _cached_fragment("notes", _notes_fragment)
+    recalled = await _recall_fragment(query)
 
     return (
         f"Du bist Lumina, ein privater KI-Assistent. Aktuelle Zeit in Frankfurt am Main: {now}.\n\n"
         f"{memory_context}\n\n"
+        f"{recalled}"
         f"KALENDER-GEDÄCHTNIS:\n{cal_context}\n\n"
         f"NOTIZBLOCK-GEDÄCHTNIS:\n{notes_context}\n\n"
-        "VERHALTENSREGELN:\n"
-        "1. Führe natürliche Unterhaltungen ohne ständige Erwähnung deiner Fähigkeiten.\n"
-        "2. FRAGE NIEMALS NACH BESTÄTIGUNG für Kalender- oder Notizblock-Aktionen. Handle SOFORT.\n"
-        "3. KONTEXT-VERSTÄNDNIS: Analysiere immer den bisherigen Chatverlauf und das KALENDER-GEDÄCHTNIS / NOTIZBLOCK-GEDÄCHTNIS!\n"
-        "4. INTELLIGENTE KLASSIFIZIERUNG (Entscheidung zwischen Kalender und Notizblock):\n"
-        "   - KALENDER: Feste Termine, Verabredungen oder Fristen mit einem konkreten Datum und/oder einer Uhrzeit (z. B. 'Meeting morgen um 14 Uhr', 'Zahnarzt am Freitag', 'Konzert am 15. Juni'). Erstelle hierfür einen [CALENDAR_EVENT] Block.\n"
-        "   - NOTIZBLOCK: Allgemeine Gedanken, Einkaufslisten, unstrukturierte Erinnerungen, Ideen oder To-Dos ohne festen Kalenderslot (z. B. 'Erinnere mich an Milch kaufen', 'Ich muss das Buch lesen', 'Klopapier holen', 'Coole Geschäftsidee aufschreiben'). Erstelle hierfür einen [NOTE_EVENT] Block.\n\n"
-        "KALENDER-FUNKTIONEN:\n"
-        "Du kannst Termine hinzufügen (add), löschen (delete), bearbeiten (edit) oder abrufen (list).\n"
-        "1. Bei 'list': Verwende bei 'Title' die Anzahl der Tage (z.B. '7' oder '-7') ODER ein exaktes Datum im Format 'YYYY-MM-DD', wenn nach einem ganz bestimmten Tag gefragt wird.\n"
-        "2. Bei 'delete' / 'edit': Verwende bei 'Title' ZWINGEND den echten Namen des Termins.\n"
-        "3. Block-Format:\n"
-        "[CALENDAR_EVENT]\n"
-        "Action: add\n"
-        "Title: Zahnarzt\n"
-        "Start: 2026-03-21T14:30:00Z\n"
-        "[/CALENDAR_EVENT]\n\n"
-        "NOTIZBLOCK-FUNKTIONEN:\n"
-        "Du kannst Notizen hinzufügen (add), löschen (delete) oder auflisten (list).\n"
-        "1. Bei 'add': Gib den gewünschten Text im Feld 'Content' an.\n"
-        "2. Bei 'delete': Gib die ID der zu löschenden Notiz im Feld 'Id' an (siehe NOTIZBLOCK-GEDÄCHTNIS oben), ODER den ungefähren Text im Feld 'Content'.\n"
-        "3. Bei 'list': Zeigt alle Notizen an.\n"
-        "4. Block-Format:\n"
-        "[NOTE_EVENT]\n"
-        "Action: add\n"
-        "Content: Milch und Äpfel kaufen\n"
-        "[/NOTE_EVENT]\n\n"
-        "Beispiel für 'delete' einer Notiz:\n"
-        "[NOTE_EVENT]\n"
-        "Action: delete\n"
-        "Id: 5\n"
-        "[/NOTE_EVENT]"
+        f"{SYSTEM_RULES}"
     )
 
 
-async def process_and_cache_calendar_actions(ai_msg: str):
-    matches = re.findall(
-        r"\[CALENDAR_EVENT\](.*?)\[/CALENDAR_EVENT\]", ai_msg, re.DOTALL
-    )
-    for match in matches:
-        title_match = re.search(r"Title:\s*(.+)", match, re.IGNORECASE)
-        action_match = re.search(r"Action:\s*(.+)", match, re.IGNORECASE)
+TITLE_RE = re.compile(r"Title:\s*(.+)", re.IGNORECASE)
+ACTION_RE = re.compile(r"Action:\s*(.+)", re.IGNORECASE)
+DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+async def cache_calendar_titles(blocks: List[str]):
+    for block in blocks:
+        title_match = TITLE_RE.search(block)
+        action_match = ACTION_RE.search(block)
         if title_match:
             title = title_match.group(1).strip()
             action = action_match.group(1).strip() if action_match else "add"
             # Ignoriere reine Zahlen und Datumsformate für 'list', speichere nur echte Terminnamen
-            if not title.lstrip("-").isdigit() and not re.match(
-                r"^\d{4}-\d{2}-\d{2}$", title
-            ):
+            if not title.lstrip("-").isdigit() and not DATE_RE.match(title):
                 await save_calendar_context(title, action)
 
 
-async def update_long_term_memory():
-    """Analysiert den Chatverlauf im Hintergrund und fasst neue Fakten zusammen."""
-    history = await get_chat_history(limit=40)
-    if len(history) < 5:
-        return
+# Zusammenfassung läuft nach so vielen neuen Nachrichten ...
+SUMMARY_MIN_MESSAGES = int(os.getenv("MEMORY_SUMMARY_MIN_MESSAGES", "20"))
+# ... oder nach dieser Gesprächspause (Sekunden), sofern mindestens SUMMARY_IDLE_MESSAGES neu sind
+SUMMARY_IDLE_SECONDS = float(os.getenv("MEMORY_SUMMARY_IDLE_SECONDS", "900"))
+SUMMARY_IDLE_MESSAGES = int(os.getenv("MEMORY_SUMMARY_IDLE_MESSAGES", "4"))
+# Höchstens so viele Nachrichten pro LLM-Aufruf; lange Einträge (z.B. PDFs) werden gekürzt
+SUMMARY_BATCH = 80
+SUMMARY_MESSAGE_TOKENS = 400
+
+
+def _model_price(name: str) -> Optional[Tuple[float, float]]:
+    """'0.25,2.00' -> (Eingabe, Ausgabe) in USD pro 1 Mio. Tokens; nicht gesetzt = Preis unbekannt."""
+    value = os.getenv(name, "").strip()
+    if not value:
+        return None
+    try:
+        price_in, price_out = (float(part) for part in value.split(","))
+    except ValueError:
+        print(f"⚠️ {name} ungültig (erwartet 'Eingabe,Ausgabe'), Kosten werden nicht geschätzt.")
+        return None
+    return price_in, price_out
+
+
+# Ohne Preis wird nur der Token-Verbrauch protokolliert (cost_usd bleibt NULL)
+MODEL_PRICES = {
+    MODEL_OPENAI: _model_price("LLM_PRICE_OPENAI"),
+    MODEL_GEMINI: _model_price("LLM_PRICE_GEMINI"),
+}
+
+
+async def _summary_watermark() -> int:
+    watermark = await get_summary_watermark()
+    if watermark is None:
+        # Erster Lauf (auch nach einem Update): nur den letzten Block statt des gesamten Verlaufs
+        watermark = max(0, await get_latest_message_id() - SUMMARY_BATCH)
+    return watermark
+
+
+async def pending_summary_messages() -> int:
+    return await get_latest_message_id() - await _summary_watermark()
+
+
+async def _summarize(prompt: str) -> Tuple[str, str, str, Optional[int], Optional[int]]:
+    """(text, anbieter, modell, eingabe_tokens, ausgabe_tokens)"""
+    if client_openai:
+        resp = await client_openai.chat.completions.create(
+            model=MODEL_OPENAI,
+            messages=[{"role": "user", "content": prompt}],
+            timeout=30,
+        )
+        usage = resp.usage
+        return (
+            resp.choices[0].message.content or "",
+            "OpenAI",
+            MODEL_OPENAI,
+            usage.prompt_tokens if usage else None,
+            usage.completion_tokens if usage else None,
+        )
+    resp = await asyncio.to_thread(
+        client_gemini.models.generate_content,
+        model=MODEL_GEMINI,
+        contents=prompt,
+    )
+    usage = resp.usage_metadata
+    return (
+        resp.text or "",
+        "Gemini",
+        MODEL_GEMINI,
+        usage.prompt_token_count if usage else None,
+        usage.candidates_token_count if usage else None,
+    )
+
+
+@traced("memory.summarize")
+async def update_long_term_memory() -> int:
+    """
+    Fasst nur die Nachrichten seit dem Wasserstand (letzte zusammengefasste
+    chat_history.id) in die bestehende Zusammenfassung ein. Jeder Lauf wird
+    mit Dauer, Tokens und (falls LLM_PRICE_* gesetzt) geschätzten Kosten in
+    summary_runs protokolliert;
+    liefert die Anzahl verarbeiteter Nachrichten.
+    """
+    if not (client_openai or client_gemini):
+        return 0
+    messages = await get_messages_since(await _summary_watermark(), limit=SUMMARY_BATCH)
+    if not messages:
+        return 0
 
     current_memories = await get_all_info()
     memory_text = "\n".join(
-        [f"- {k}: {v}" for k, v in current_memories if k == "Zusammenfassung"]
+        [f"- {k}: {v}" for k, v in current_memories if k == SUMMARY_KEY]
     )
     history_text = "\n".join(
-        [f"{msg['role'].upper()}: {msg['content']}" for msg in history]
+        [
+            f"{msg['role'].upper()}: {truncate_to_tokens(msg['content'], SUMMARY_MESSAGE_TOKENS)}"
+            for msg in messages
+        ]
     )
 
     prompt = (
         "Du bist der Hintergrund-Analyst für ein KI-System. Deine Aufgabe ist es, das Langzeitgedächtnis zu aktualisieren.\n"
         f"Bisherige Zusammenfassung des Nutzers:\n{memory_text}\n\n"
-        f"Hier sind die neuesten Chat-Nachrichten:\n{history_text}\n\n"
+        f"Hier sind die neuen Chat-Nachrichten seit der letzten Aktualisierung:\n{history_text}\n\n"
         "Aufgabe: Analysiere die Nachrichten auf dauerhaft relevante Fakten (Projekte, Vorlieben, wichtige Personen, wiederkehrende Themen). "
         "Erstelle eine einzige, kompakte Stichpunktliste, die das alte Wissen mit neuen Erkenntnissen kombiniert. "
         "Antworte AUSSCHLIESSLICH mit der neuen Stichpunktliste. Keine Einleitung."
     )
 
+    run = {
+        "started_at": time.time(),
+        "first_message_id": messages[0]["id"],
+        "last_message_id": messages[-1]["id"],
+        "messages": len(messages),
+    }
+    start = time.perf_counter()
     try:
-        if client_openai:
-            resp = await client_openai.chat.completions.create(
-                model=MODEL_OPENAI,
-                messages=[{"role": "user", "content": prompt}],
-                timeout=30,
+        new_summary, provider, model, prompt_tokens, completion_tokens = await _summarize(prompt)
+        new_summary = new_summary.strip()
+        # Ohne Usage-Angabe des Anbieters: lokale Schätzung
+        prompt_tokens = prompt_tokens if prompt_tokens is not None else count_tokens(prompt)
+        completion_tokens = completion_tokens if completion_tokens is not None else count_tokens(new_summary)
+        price = MODEL_PRICES.get(model)
+        run.update(
+            provider=provider,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost_usd=(prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000 if price else None,
+            # Leere Antwort: Wasserstand nicht verschieben, beim nächsten Mal erneut versuchen
+            status="ok" if new_summary else "empty",
+        )
+        if new_summary:
+            await save_info(SUMMARY_KEY, new_summary)
+            await memory.set_facts(new_summary)
+            cost = f"~${run['cost_usd']:.5f}" if price else f"{prompt_tokens + completion_tokens} Tokens"
+            print(
+                f"🧠 Langzeitgedächtnis ({provider}) um {len(messages)} Nachrichten aktualisiert "
+                f"({time.perf_counter() - start:.1f}s, {cost})."
             )
-            new_summary = resp.choices[0].message.content.strip()
-            if new_summary:
-                await save_info("Zusammenfassung", new_summary)
-                print("🧠 Langzeitgedächtnis (OpenAI) erfolgreich aktualisiert.")
-        elif client_gemini:
-            resp = await asyncio.to_thread(
-                client_gemini.models.generate_content,
-                model=MODEL_GEMINI,
-                contents=prompt,
-            )
-            new_summary = resp.text.strip()
-            if new_summary:
-                await save_info("Zusammenfassung", new_summary)
-                print("🧠 Langzeitgedächtnis (Gemini) erfolgreich aktualisiert.")
     except Exception as e:
+        run.update(status="error", error=f"{type(e).__name__}: {e}")
         print(f"⚠️ Fehler bei der Memory Summarization: {e}")
+    run["duration_ms"] = (time.perf_counter() - start) * 1000
+    await record_summary_run(run)
+    return len(messages) if run["status"] == "ok" else 0
+
+
+OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+FALLBACK_RESPONSE = "Entschuldigung, derzeit sind alle KI-Server überlastet."
+
+
+def _openai_messages(
+    system_instruction: str, history: list, message: str, image: Optional[PreparedImage] = None
+) -> list:
+    if image:
+        base64_image = base64.b64encode(image.data).decode("utf-8")
+        return [
+            {"role": "system", "content": system_instruction},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": message or "Bildanalyse."},
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:{image.mime};base64,{base64_image}"},
+                    },
+                ],
+            },
+        ]
+    return (
+        [{"role": "system", "content": system_instruction}]
+        + history
+        + [{"role": "user", "content": message}]
+    )
 
 
-async def fetch_llm_response(message: str, image_bytes: bytes = None) -> dict:
-    system_instruction = await build_system_instruction()
-    history = await get_chat_history(limit=30)
-    ai_response_text = "Entschuldigung, derzeit sind alle KI-Server überlastet."
-    source = "System Error"
-    reasoning = None
+def _gemini_contents(system_instruction: str, message: str, image: Optional[PreparedImage] = None):
+    prompt = f"{system_instruction}\n\nNutzer: {message or 'Bildanalyse'}"
+    if not image:
+        return prompt
+    return [
+        types.Content(
+            role="user",
+            parts=[
+                types.Part.from_text(text=prompt),
+                types.Part.from_bytes(data=image.data, mime_type=image.mime),
+            ],
+        )
+    ]
+
+
+def _openrouter_request(system_instruction: str, history: list, message: str) -> tuple:
+    headers = {
+        "Authorization": f"Bearer {OR_KEY}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "model": MODEL_OPENROUTER,
+        "messages": _openai_messages(system_instruction, history, message),
+        "reasoning": {"enabled": True},
+    }
+    return headers, payload
+
+
+async def _call_openai(system_instruction, history, message, image_bytes) -> tuple:
+    # Verkleinert auf die Auflösung des Anbieters, pro Bild-Hash gecacht
+    image = await image_processor.prepare(image_bytes, "OpenAI")
+    messages = _openai_messages(system_instruction, history, message, image)
+    resp = await client_openai.chat.completions.create(
+        model=MODEL_OPENAI, messages=messages, timeout=25
+    )
+    return resp.choices[0].message.content, None
 
-    if client_openai:
-        try:
-            if image_bytes:
-                base64_image = base64.b64encode(image_bytes).decode("utf-8")
-                messages = [
-                    {"role": "system", "content": system_instruction},
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": message or "Bildanalyse."},
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
-                                },
-                            },
-                        ],
-                    },
-                ]
-            else:
-                messages = (
-                    [{"role": "system", "content": system_instruction}]
-                    + history
-                    + [{"role": "user", "content": message}]
-                )
-            resp = await client_openai.chat.completions.create(
-                model=MODEL_OPENAI, messages=messages, timeout=25
-            )
-            ai_response_text = resp.choices[0].message.content
-            source = "OpenAI"
-        except Exception as e:
-            print(f"⚠️ OpenAI Fehler, wechsle zu Gemini: {e}")
 
-    if source == "System Error" and client_gemini:
-        try:
-            prompt = f"{system_instruction}\n\nNutzer: {message or 'Bildanalyse'}"
-            if image_bytes:
-                contents = [
-                    types.Content(
-                        role="user",
-                        parts=[
-                            types.Part.from_text(text=prompt),
-                            types.Part.from_bytes(
-                                data=image_bytes, mime_type="image/jpeg"
-                            ),
-                        ],
-                    )
-                ]
-            else:
-                contents = prompt
-            resp = await asyncio.to_thread(
-                client_gemini.models.generate_content,
-                model=MODEL_GEMINI,
-                contents=contents,
-            )
-            ai_response_text = resp.text
-            source = "Gemini"
-        except Exception as e:
-            print(f"⚠️ Gemini Fehler, wechsle zu OpenRouter: {e}")
+async def _call_gemini(system_instruction, history, message, image_bytes) -> tuple:
+    image = await image_processor.prepare(image_bytes, "Gemini")
+    # Native Async-API, damit ein verlorener Hedge-Aufruf wirklich abgebrochen wird
+    resp = await client_gemini.aio.models.generate_content(
+        model=MODEL_GEMINI,
+        contents=_gemini_contents(system_instruction, message, image),
+    )
+    return resp.text, None
 
-    if source == "System Error" and OR_KEY and not image_bytes:
-        try:
-            url = "https://openrouter.ai/api/v1/chat/completions"
-            headers = {
-                "Authorization": f"Bearer {OR_KEY}",
-                "Content-Type": "application/json",
-            }
-            payload_messages = (
-                [{"role": "system", "content": system_instruction}]
-                + history
-                + [{"role": "user", "content": message}]
-            )
-            payload = {
-                "model": MODEL_OPENROUTER,
-                "messages": payload_messages,
-                "reasoning": {"enabled": True},
-            }
-            resp = await http_client.post(url, headers=headers, json=payload, timeout=45)
-            resp.raise_for_status()
-            data = resp.json()
-            ai_response_text = data["choices"][0]["message"]["content"]
-            source = "OpenRouter"
-            reasoning = data["choices"][0]["message"].get("reasoning")
-        except Exception as e:
-            print(f"❌ OpenRouter Fehler: {e}")
 
-    await process_and_cache_calendar_actions(ai_response_text)
+async def _call_openrouter(system_instruction, history, message, image_bytes) -> tuple:
+    headers, payload = _openrouter_request(system_instruction, history, message)
+    resp = await http_client.post(OPENROUTER_URL, headers=headers, json=payload, timeout=45)
+    resp.raise_for_status()
+    data = resp.json()
+    return data["choices"][0]["message"]["content"], data["choices"][0]["message"].get("reasoning")
+
+
+def _provider_chain(image_bytes: bytes = None) -> list:
+    """Konfigurierte Anbieter in Prioritätsreihenfolge als (name, aufruf)."""
+    chain = []
+    if client_openai:
+        chain.append(("OpenAI", _call_openai))
+    if client_gemini:
+        chain.append(("Gemini", _call_gemini))
+    if OR_KEY and not image_bytes:
+        chain.append(("OpenRouter", _call_openrouter))
+    return chain
+
+
+async def build_context(history_limit: int = HISTORY_FETCH_LIMIT, query: str = "") -> Tuple[str, list]:
+    """System-Prompt (mit zur Nachricht passenden Erinnerungen) und Chatverlauf."""
+    # Beide lesen über eigene Leseverbindungen des Pools und laufen daher parallel
+    system_instruction, history = await asyncio.gather(
+        build_system_instruction(query), get_chat_history(limit=history_limit)
+    )
+    return system_instruction, history
+
+
+async def generate_response(
+    system_instruction: str, history: list, message: str, image_bytes: bytes = None
+) -> dict:
+    attempts = [
+        (
+            PROVIDER_HEALTH[name],
+            # Budget je Anbieter: der Kontext wird erst beim Aufruf zugeschnitten
+            lambda name=name, call=call: call(
+                *assemble_context(name, system_instruction, history, message), image_bytes
+            ),
+        )
+        for name, call in _provider_chain(image_bytes)
+    ]
+    try:
+        source, (ai_response_text, reasoning) = await dispatch(
+            attempts, mode=LLM_DISPATCH_MODE, percentile=LLM_HEDGE_PERCENTILE
+        )
+    except AllProvidersFailed:
+        print("❌ Kein KI-Anbieter hat geantwortet.")
+        ai_response_text, source, reasoning = FALLBACK_RESPONSE, "System Error", None
 
     return {"content": ai_response_text, "source": source, "reasoning": reasoning}
 
 
-async def fetch_gemini_vision(message: str, image_bytes: bytes) -> dict:
-    return await fetch_llm_response(message, image_bytes)
+class EventBlockFilter:
+    """
+    Inkrementeller Parser, der [CALENDAR_EVENT]- und [NOTE_EVENT]-Blöcke aus
+    einem Token-Stream entfernt. Text, der noch der Anfang eines Tags sein
+    könnte, wird zurückgehalten, bis er eindeutig ist.
+    """
 
+    TAGS = {"[CALENDAR_EVENT]": "[/CALENDAR_EVENT]", "[NOTE_EVENT]": "[/NOTE_EVENT]"}
+
+    def __init__(self):
+        self._buffer = ""
+        self._closing: Optional[str] = None
+
+    def feed(self, chunk: str) -> str:
+        self._buffer += chunk
+        visible = []
+        while self._buffer:
+            if self._closing:
+                end = self._buffer.find(self._closing)
+                if end == -1:
+                    # Nur einen möglichen Anfang des End-Tags behalten
+                    self._buffer = self._buffer[-(len(self._closing) - 1):]
+                    break
+                self._buffer = self._buffer[end + len(self._closing):]
+                self._closing = None
+                continue
+
+            start = self._buffer.find("[")
+            if start == -1:
+                visible.append(self._buffer)
+                self._buffer = ""
+                break
+            visible.append(self._buffer[:start])
+            self._buffer = self._buffer[start:]
+
+            opening = next((t for t in self.TAGS if self._buffer.startswith(t)), None)
+            if opening:
+                self._closing = self.TAGS[opening]
+                self._buffer = self._buffer[len(opening):]
+            elif any(t.startswith(self._buffer) for t in self.TAGS):
+                break  # Möglicher Tag-Anfang, auf weitere Tokens warten
+            else:
+                visible.append("[")
+                self._buffer = self._buffer[1:]
+        return "".join(visible)
+
+    def flush(self) -> str:
+        rest = "" if self._closing else self._buffer
+        self._buffer = ""
+        self._closing = None
+        return rest
+
+
+async def _stream_openai(system_instruction, history, message, image_bytes):
+    image = await image_processor.prepare(image_bytes, "OpenAI")
+    stream = await client_openai.chat.completions.create(
+        model=MODEL_OPENAI,
+        messages=_openai_messages(system_instruction, history, message, image),
+        timeout=25,
+        stream=True,
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield "content", chunk.choices[0].delta.content
 
-async def transcribe_audio(audio_bytes: bytes, filename: str = "voice.ogg") -> str:
+
+async def _stream_gemini(system_instruction, history, message, image_bytes):
+    image = await image_processor.prepare(image_bytes, "Gemini")
+    stream = await client_gemini.aio.models.generate_content_stream(
+        model=MODEL_GEMINI,
+        contents=_gemini_contents(system_instruction, message, image),
+    )
+    async for chunk in stream:
+        if chunk.text:
+            yield "content", chunk.text
+
+
+async def _stream_openrouter(system_instruction, history, message, image_bytes):
+    headers, payload = _openrouter_request(system_instruction, history, message)
+    payload["stream"] = True
+    async with http_client.stream(
+        "POST", OPENROUTER_URL, headers=headers, json=payload, timeout=45
+    ) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            # SSE-Kommentare (": OPENROUTER PROCESSING") und Leerzeilen überspringen
+            if not line.startswith("data: "):
+                continue
+            data = line[len("data: "):]
+            if data == "[DONE]":
+                break
+            choices = json.loads(data).get("choices") or [{}]
+            delta = choices[0].get("delta", {})
+            if delta.get("reasoning"):
+                yield "reasoning", delta["reasoning"]
+            if delta.get("content"):
+                yield "content", delta["content"]
+
+
+async def stream_response(
+    system_instruction: str, history: list, message: str, image_bytes: bytes = None
+) -> AsyncIterator[dict]:
+    """
+    Streaming-Variante von generate_response. Liefert {"delta": ...} mit bereits
+    bereinigtem Anzeigetext und zum Schluss {"done": True, "content": ...,
+    "source": ..., "reasoning": ...} mit der vollständigen Rohantwort.
+    """
+    stream_fns = {"OpenAI": _stream_openai, "Gemini": _stream_gemini, "OpenRouter": _stream_openrouter}
+    providers = [(name, stream_fns[name]) for name, _ in _provider_chain(image_bytes)]
+
+    event_filter = EventBlockFilter()
+    parts, reasoning_parts = [], []
+    source = "System Error"
+
+    for name, stream_fn in providers:
+        health = PROVIDER_HEALTH[name]
+        if not health.breaker.allow():
+            print(f"🔌 {name} übersprungen (Circuit Breaker offen).")
+            continue
+        try:
+            with span(f"llm.{name}.stream"):
+                context = assemble_context(name, system_instruction, history, message)
+                async for kind, text in stream_fn(*context, image_bytes):
+                    if kind == "reasoning":
+                        reasoning_parts.append(text)
+                        continue
+                    parts.append(text)
+                    visible = event_filter.feed(text)
+                    if visible:
+                        yield {"delta": visible}
+            health.breaker.record_success()
+            source = name
+            break
+        except (asyncio.CancelledError, GeneratorExit):
+            health.breaker.release()
+            raise
+        except Exception as e:
+            health.breaker.record_failure()
+            if parts:
+                # Bereits gesendete Tokens lassen sich nicht zurücknehmen
+                print(f"⚠️ {name} Stream abgebrochen: {e}")
+                source = name
+                break
+            print(f"⚠️ {name} Stream-Fehler, wechsle Anbieter: {e}")
+
+    if not parts:
+        parts.append(FALLBACK_RESPONSE)
+        yield {"delta": event_filter.feed(FALLBACK_RESPONSE)}
+    tail = event_filter.flush()
+    if tail:
+        yield {"delta": tail}
+
+    yield {
+        "done": True,
+        "content": "".join(parts),
+        "source": source,
+        "reasoning": "".join(reasoning_parts) or None,
+    }
+
+
+async def stream_transcription(
+    audio_bytes: bytes, filename: str = "voice.ogg"
+) -> AsyncIterator[str]:
     """
-    Transkribiert ogg/opus oder webm Audiodaten in Text.
+    Transkribiert ogg/opus oder webm Audiodaten vollständig im Speicher.
+    Liefert nach jedem erkannten Segment das bisherige Transkript; der letzte
+    Wert ist das endgültige Ergebnis (leer, falls nichts erkannt wurde).
     Primär: Lokale Offline-Transkription mit faster-whisper (kein API-Key nötig).
     Fallback: OpenAI Whisper API, dann Google Gemini.
     """
-    import io
-    import tempfile
-
     # ──────────────────────────────────────────────────────────
     # 1. PRIMÄR: Lokale Offline-Transkription mit faster-whisper
     # ──────────────────────────────────────────────────────────
     try:
-        # Stelle sicher, dass ffmpeg im PATH ist (via imageio-ffmpeg Bundle)
-        import imageio_ffmpeg
-        ffmpeg_dir = os.path.dirname(imageio_ffmpeg.get_ffmpeg_exe())
-        if ffmpeg_dir not in os.environ.get("PATH", ""):
-            os.environ["PATH"] = ffmpeg_dir + os.pathsep + os.environ.get("PATH", "")
-
-        from faster_whisper import WhisperModel
-
         print(f"🎙️ Lokale Transkription mit faster-whisper ({filename})...")
-
-        # Audio-Bytes in eine temporäre Datei schreiben
-        ext = os.path.splitext(filename)[1] or ".ogg"
-        with tempfile.NamedTemporaryFile(suffix=ext, delete=False) as tmp:
-            tmp.write(audio_bytes)
-            tmp_path = tmp.name
-
-        try:
-            # Modell laden (beim ersten Aufruf wird es heruntergeladen, ~75MB für "base")
-            model = WhisperModel("base", device="cpu", compute_type="int8")
-            segments, info = model.transcribe(tmp_path, language="de")
-            transcript = " ".join(seg.text.strip() for seg in segments).strip()
-
-            if transcript:
-                print(f"✅ Lokale Transkription erfolgreich: {transcript}")
-                return transcript
-            else:
-                print("⚠️ Lokale Transkription lieferte leeres Ergebnis.")
-        finally:
-            # Temporäre Datei aufräumen
-            try:
-                os.unlink(tmp_path)
-            except OSError:
-                pass
-
+        parts = []
+        # Bytes -> PCM via PyAV direkt im Worker, das Modell bleibt im Speicher
+        async for segment in transcription_engine.stream(audio_bytes, language="de"):
+            parts.append(segment)
+            yield " ".join(parts)
+
+        if parts:
+            print(f"✅ Lokale Transkription erfolgreich: {' '.join(parts)}")
+            return
+        print("⚠️ Lokale Transkription lieferte leeres Ergebnis.")
     except ImportError as e:
         print(f"⚠️ faster-whisper nicht installiert, überspringe lokale Transkription: {e}")
     except Exception as e:
         print(f"⚠️ Lokale Transkription fehlgeschlagen: {e}")
 
+    transcript = await _transcribe_via_api(audio_bytes, filename)
+    if transcript:
+        yield transcript
+
+
+@traced("transcribe_audio")
+async def transcribe_audio(audio_bytes: bytes, filename: str = "voice.ogg") -> str:
+    transcript = ""
+    async for transcript in stream_transcription(audio_bytes, filename):
+        pass
+    if not transcript:
+        print("❌ Keine Transkriptions-Engine konnte das Audio verarbeiten.")
+    return transcript
+
+
+@traced("transcription.api")
+async def _transcribe_via_api(audio_bytes: bytes, filename: str) -> str:
+    import io
+
     # ──────────────────────────────────────────────────────────
     # 2. FALLBACK: OpenAI Whisper API (falls konfiguriert)
     # ──────────────────────────────────────────────────────────
@@ -355,7 +728,6 @@ async def transcribe_audio(audio_bytes: bytes, filename: str = "voice.ogg") -> s
         except Exception as e:
             print(f"⚠️ Gemini Transkription Fehler: {e}")
 
-    print("❌ Keine Transkriptions-Engine konnte das Audio verarbeiten.")
     return ""
 
 
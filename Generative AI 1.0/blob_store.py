@@ -0,0 +1,177 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from contextlib import suppress
+from typing import Any, Dict, List, Optional
+
+from fastapi import UploadFile
+
+from database import (
+    delete_expired_blobs,
+    get_blob_stats,
+    get_expired_blobs,
+    next_blob_expiry,
+    register_blob,
+)
+from tracing import span
+
+# Unter /static ausgeliefert; die URLs stehen im Chatverlauf (FILE_/VOICE_CONFIRM)
+UPLOAD_DIR = "static/uploads"
+UPLOAD_URL = "/static/uploads"
+UPLOAD_TTL = float(os.getenv("UPLOAD_TTL", "86400"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_MB", "50")) * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+# Der Reaper schläft bis zur nächsten Frist, schaut aber spätestens so oft nach
+REAP_INTERVAL = 3600.0
+REAP_BATCH = 500
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class Blob:
+    def __init__(self, digest: str, ext: str, size: int, mime: Optional[str]):
+        self.digest = digest
+        self.ext = ext
+        self.size = size
+        self.mime = mime
+        # Zwei Ebenen à 256 Verzeichnisse, damit kein Ordner beliebig wächst
+        self.key = f"{digest[:2]}/{digest[2:4]}/{digest}.{ext}"
+        self.path = os.path.join(UPLOAD_DIR, self.key)
+        self.url = f"{UPLOAD_URL}/{self.key}"
+
+    def read_bytes(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def _append(f, digest, chunk: bytes) -> None:
+    digest.update(chunk)
+    f.write(chunk)
+
+
+class BlobStore:
+    """
+    Inhaltsadressierter Upload-Speicher: Dateien heißen nach ihrem SHA-256
+    und liegen in Unterverzeichnissen nach den ersten Hash-Zeichen. Identische
+    Uploads landen in derselben Datei und verlängern nur deren Frist. Die
+    Fristen stehen in SQLite, der Reaper löscht gezielt die abgelaufenen
+    Einträge statt das Verzeichnis zu durchsuchen.
+    """
+
+    def __init__(self, directory: str = UPLOAD_DIR, ttl: float = UPLOAD_TTL, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.tmp_dir = os.path.join(directory, ".tmp")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        # Ablegen und Löschen derselben Datei dürfen sich nicht überholen
+        self._lock = asyncio.Lock()
+        self.stored = 0
+        self.deduplicated = 0
+        self.reaped = 0
+
+    async def save(self, upload: UploadFile, ext: str) -> Blob:
+        """Kopiert den Upload blockweise auf Platte und hasht dabei mit."""
+        fd, tmp = tempfile.mkstemp(dir=self.tmp_dir)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with span("uploads.save"):
+                with os.fdopen(fd, "wb") as f:
+                    while chunk := await upload.read(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_bytes:
+                            raise UploadTooLarge(f"Datei größer als {self.max_bytes // (1024 * 1024)} MB")
+                        await asyncio.to_thread(_append, f, digest, chunk)
+                blob = Blob(digest.hexdigest(), ext, size, upload.content_type)
+                async with self._lock:
+                    await register_blob(blob.key, blob.digest, size, blob.mime, time.time() + self.ttl)
+                    if os.path.exists(blob.path):
+                        self.deduplicated += 1
+                    else:
+                        os.makedirs(os.path.dirname(blob.path), exist_ok=True)
+                        os.replace(tmp, blob.path)
+                        self.stored += 1
+            return blob
+        finally:
+            with suppress(FileNotFoundError):
+                os.remove(tmp)
+
+    async def read(self, blob: Blob) -> bytes:
+        return await asyncio.to_thread(blob.read_bytes)
+
+    async def reap(self) -> int:
+        """Löscht abgelaufene Dateien; liefert deren Anzahl."""
+        removed = 0
+        while True:
+            now = time.time()
+            keys = await get_expired_blobs(now, REAP_BATCH)
+            if not keys:
+                return removed
+            async with self._lock:
+                deleted = await delete_expired_blobs(keys, now)
+                await asyncio.to_thread(self._unlink, deleted)
+            removed += len(deleted)
+            self.reaped += len(deleted)
+            if len(keys) < REAP_BATCH:
+                return removed
+
+    def _unlink(self, keys: List[str]) -> None:
+        for key in keys:
+            with suppress(FileNotFoundError):
+                os.remove(os.path.join(self.directory, key))
+
+    async def adopt_legacy(self) -> int:
+        """
+        Übernimmt Dateien aus der Zeit vor dem Hash-Speicher (uuid-Namen direkt
+        in static/uploads) mit Frist ab ihrem Änderungsdatum. Betrifft nur die
+        oberste Ebene und leert sich mit deren Ablauf von selbst.
+        """
+
+        def scan():
+            with os.scandir(self.directory) as entries:
+                return [(e.name, e.stat()) for e in entries if e.is_file()]
+
+        legacy = await asyncio.to_thread(scan)
+        for name, st in legacy:
+            await register_blob(name, None, st.st_size, None, st.st_mtime + self.ttl)
+        return len(legacy)
+
+    def _clear_tmp(self) -> None:
+        # Reste abgebrochener Uploads aus dem letzten Lauf
+        for name in os.listdir(self.tmp_dir):
+            with suppress(OSError):
+                os.remove(os.path.join(self.tmp_dir, name))
+
+    async def reaper(self) -> None:
+        await asyncio.to_thread(self._clear_tmp)
+        adopted = await self.adopt_legacy()
+        if adopted:
+            print(f"📁 {adopted} ältere Uploads in den Upload-Speicher übernommen.")
+        while True:
+            try:
+                removed = await self.reap()
+                if removed:
+                    print(f"🧹 {removed} abgelaufene Uploads gelöscht.")
+                due = await next_blob_expiry()
+            except Exception as e:
+                print(f"⚠️ Fehler beim Aufräumen der Uploads: {e}")
+                due = None
+            wait = min(REAP_INTERVAL, self.ttl if due is None else max(1.0, due - time.time()))
+            await asyncio.sleep(wait)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "ttl": self.ttl,
+            "stored": self.stored,
+            "deduplicated": self.deduplicated,
+            "reaped": self.reaped,
+            **await get_blob_stats(),
+        }
+
+
+store = BlobStore()
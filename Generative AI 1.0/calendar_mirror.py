@@ -0,0 +1,137 @@
+import datetime
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+import database
+
+CALENDAR_ID = "primary"
+# Versionsname in database.table_versions; jede Änderung am Spiegel invalidiert z.B. get_events-Ergebnisse
+EVENTS_TABLE = "calendar_events"
+
+_thread_local = threading.local()
+# Alle offenen Thread-Verbindungen, damit close() sie beim Herunterfahren schließen kann
+_connections: Set[sqlite3.Connection] = set()
+_connections_lock = threading.Lock()
+# Erhöht sich mit jedem close(); Threads mit älterer Verbindung verbinden sich neu
+_generation = 0
+
+
+def _conn() -> sqlite3.Connection:
+    # Die Google-Calendar-Funktionen laufen synchron in Worker-Threads: eine Verbindung pro Thread
+    conn = getattr(_thread_local, "conn", None)
+    if conn is not None and _thread_local.path == database.DB_PATH and _thread_local.generation == _generation:
+        return conn
+    if conn is not None:
+        _release(conn)
+    # check_same_thread=False nur für close() aus dem Haupt-Thread; genutzt wird jede Verbindung von ihrem Thread
+    conn = sqlite3.connect(database.DB_PATH, timeout=5, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    with _connections_lock:
+        _connections.add(conn)
+    _thread_local.conn = conn
+    _thread_local.path = database.DB_PATH
+    _thread_local.generation = _generation
+    return conn
+
+
+def _release(conn: sqlite3.Connection) -> None:
+    with _connections_lock:
+        _connections.discard(conn)
+    conn.close()
+
+
+def close() -> None:
+    """Schließt die Verbindungen aller Threads (beim Herunterfahren, nach dem Ende der Kalender-Jobs)."""
+    global _generation
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+        _generation += 1
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ Kalender-Spiegel: Verbindung konnte nicht geschlossen werden: {e}")
+
+
+def _to_utc(value: Dict[str, str], timezone: str) -> str:
+    """Normalisiert start/end eines Events auf 'YYYY-MM-DDTHH:MM:SS' in UTC."""
+    if "dateTime" in value:
+        dt = datetime.datetime.fromisoformat(value["dateTime"].replace("Z", "+00:00"))
+    else:
+        # Ganztägige Termine beginnen um Mitternacht in der Kalender-Zeitzone
+        dt = datetime.datetime.fromisoformat(value["date"]).replace(
+            tzinfo=ZoneInfo(value.get("timeZone") or timezone)
+        )
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=ZoneInfo(value.get("timeZone") or timezone))
+    return dt.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _row(event: dict, timezone: str) -> Tuple:
+    start = event["start"].get("dateTime", event["start"].get("date"))
+    return (
+        event["id"],
+        event.get("summary", "Ohne Titel"),
+        start,
+        _to_utc(event["start"], timezone),
+        _to_utc(event.get("end", event["start"]), timezone),
+        event.get("updated", ""),
+    )
+
+
+def _apply(conn: sqlite3.Connection, events: List[dict], timezone: str) -> None:
+    for event in events:
+        if event.get("status") == "cancelled" or "start" not in event:
+            conn.execute("DELETE FROM calendar_events WHERE id = ?", (event["id"],))
+        else:
+            conn.execute(
+                "INSERT OR REPLACE INTO calendar_events (id, summary, start, start_utc, end_utc, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                _row(event, timezone),
+            )
+
+
+def get_sync_state() -> Tuple[Optional[str], float]:
+    row = _conn().execute(
+        "SELECT sync_token, synced_at FROM calendar_sync WHERE calendar_id = ?",
+        (CALENDAR_ID,),
+    ).fetchone()
+    return (row[0], row[1] or 0.0) if row else (None, 0.0)
+
+
+def apply_sync(events: List[dict], sync_token: Optional[str], full: bool, timezone: str) -> None:
+    """Übernimmt das Ergebnis einer (Voll- oder inkrementellen) Synchronisation atomar."""
+    # Ein leerer inkrementeller Abgleich ändert nichts und invalidiert keine Caches
+    with database.versioned_transaction(_conn(), EVENTS_TABLE, changed=full or bool(events)) as conn:
+        if full:
+            conn.execute("DELETE FROM calendar_events")
+        _apply(conn, events, timezone)
+        conn.execute(
+            "INSERT OR REPLACE INTO calendar_sync (calendar_id, sync_token, synced_at) VALUES (?, ?, ?)",
+            (CALENDAR_ID, sync_token, time.time()),
+        )
+
+
+def upsert_event(event: dict, timezone: str) -> None:
+    with database.versioned_transaction(_conn(), EVENTS_TABLE) as conn:
+        _apply(conn, [event], timezone)
+
+
+def remove_event(event_id: str) -> None:
+    with database.versioned_transaction(_conn(), EVENTS_TABLE) as conn:
+        conn.execute("DELETE FROM calendar_events WHERE id = ?", (event_id,))
+
+
+def query_events(time_min: str, time_max: str) -> List[Dict[str, str]]:
+    """Events, die sich mit [time_min, time_max) überschneiden (UTC, 'YYYY-MM-DDTHH:MM:SS')."""
+    rows = _conn().execute(
+        "SELECT id, summary, start FROM calendar_events "
+        "WHERE start_utc < ? AND end_utc > ? ORDER BY start_utc",
+        (time_max, time_min),
+    ).fetchall()
+    return [{"id": r[0], "summary": r[1], "start": r[2]} for r in rows]
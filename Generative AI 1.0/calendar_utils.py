@@ -1,25 +1,51 @@
 import re
+from typing import List
+
 import google_calendar
+from action_blocks import CALENDAR_TAG, find_blocks, parse_fields
+
+DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+ACTION_PREFIX = {"add": "✅", "delete": "🗑️", "edit": "✏️"}
+SINGLE_ACTIONS = {
+    "add": google_calendar.add_event,
+    "delete": google_calendar.delete_event,
+    "edit": google_calendar.edit_event,
+}
 
 
-def process_calendar_event(text: str) -> str:
+def _list_events(title: str) -> str:
+    title_clean = title.strip()
+    # Prüfen, ob ein exaktes Datum im Format YYYY-MM-DD übergeben wurde
+    if DATE_RE.match(title_clean):
+        return google_calendar.get_events(specific_date=title_clean)
+    days = 7
+    try:
+        days = int(title_clean)
+    except ValueError:
+        pass
+    return google_calendar.get_events(days=days)
+
+
+def process_calendar_event(text: str, batch: bool = True) -> str:
     print("🔍 Prüfe KI-Antwort auf Kalender-Aktionen...")
-    pattern = r"\[CALENDAR_EVENT\](.*?)\[/CALENDAR_EVENT\]"
-    matches = re.findall(pattern, text, re.DOTALL)
+    return process_calendar_blocks(find_blocks(text, CALENDAR_TAG), batch=batch)
+
 
+def process_calendar_blocks(matches: List[str], batch: bool = True) -> str:
+    """
+    Führt bereits extrahierte [CALENDAR_EVENT]-Blöcke aus. Mit `batch=True`
+    werden mehrere Mutationen (add/delete/edit) gesammelt über den
+    Google-Batch-Endpunkt gesendet; die Ergebnisse bleiben in Block-Reihenfolge.
+    """
     if not matches:
         return ""
 
     results = []
+    mutations = []  # (Position in results, action, kwargs)
     for match in matches:
         try:
-            data = {}
-            for line in match.strip().split("\n"):
-                line = line.strip()
-                if not line or ":" not in line:
-                    continue
-                k, v = line.split(":", 1)
-                data[k.strip().lower()] = v.strip()
+            data = parse_fields(match)
 
             title = data.get("title", "")
             start = data.get("start", "")
@@ -32,19 +58,7 @@ def process_calendar_event(text: str) -> str:
                 action = "add"
 
             if action == "list":
-                title_clean = title.strip()
-                # Prüfen, ob ein exaktes Datum im Format YYYY-MM-DD übergeben wurde
-                if re.match(r"^\d{4}-\d{2}-\d{2}$", title_clean):
-                    res = google_calendar.get_events(specific_date=title_clean)
-                else:
-                    days = 7
-                    try:
-                        days = int(title_clean)
-                    except ValueError:
-                        pass
-                    res = google_calendar.get_events(days=days)
-
-                results.append(f"🔎 {res}")
+                results.append(f"🔎 {_list_events(title)}")
                 continue
 
             if action == "add" and (not title or not start):
@@ -58,26 +72,41 @@ def process_calendar_event(text: str) -> str:
                 continue
 
             if action == "delete":
-                res = google_calendar.delete_event(summary=title, date_str=start)
-                results.append(f"🗑️ {res}")
+                kwargs = {"summary": title, "date_str": start}
             elif action == "edit":
-                new_title = data.get("new_title", title)
-                new_start = data.get("new_start", start)
-                res = google_calendar.edit_event(
-                    old_summary=title,
-                    old_date_str=start,
-                    new_summary=new_title,
-                    new_start_time=new_start,
-                )
-                results.append(f"✏️ {res}")
+                kwargs = {
+                    "old_summary": title,
+                    "old_date_str": start,
+                    "new_summary": data.get("new_title", title),
+                    "new_start_time": data.get("new_start", start),
+                }
             else:
-                desc = data.get("description", "Von Lumina automatisch erstellt.")
-                res = google_calendar.add_event(
-                    summary=title, start_time=start, description=desc
-                )
-                results.append(f"✅ {res}")
+                action = "add"
+                kwargs = {
+                    "summary": title,
+                    "start_time": start,
+                    "description": data.get("description", "Von Lumina automatisch erstellt."),
+                }
+            results.append(None)
+            mutations.append((len(results) - 1, action, kwargs))
 
         except Exception as e:
             results.append(f"⚠️ Interner Fehler: {e}")
 
+    if batch and len(mutations) > 1:
+        try:
+            outcomes = google_calendar.execute_batch([(a, kw) for _, a, kw in mutations])
+            for (pos, action, _), res in zip(mutations, outcomes):
+                results[pos] = f"{ACTION_PREFIX[action]} {res}"
+        except Exception as e:
+            # Google kann Teile des Batches schon ausgeführt haben: kein pauschales "fehlgeschlagen"
+            for pos, _, _ in mutations:
+                results[pos] = results[pos] or f"⚠️ Status unbekannt ({e}), bitte im Kalender prüfen."
+    else:
+        for pos, action, kwargs in mutations:
+            try:
+                results[pos] = f"{ACTION_PREFIX[action]} {SINGLE_ACTIONS[action](**kwargs)}"
+            except Exception as e:
+                results[pos] = f"⚠️ Interner Fehler: {e}"
+
     return "\n".join(results)
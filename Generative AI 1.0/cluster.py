@@ -0,0 +1,118 @@
+import asyncio
+import os
+import socket
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from database import CHANGE_POLL_INTERVAL, acquire_lease, get_lease, poll_changes, release_lease
+
+# Ohne Verlängerung geht die Leader-Rolle nach dieser Zeit an einen anderen Worker
+LEADER_TTL = float(os.getenv("LEADER_TTL", "15"))
+LEADER_LEASE = "leader"
+
+Callback = Callable[[], Awaitable[None]]
+
+
+class Leadership:
+    """
+    Leader-Wahl zwischen den Worker-Prozessen über eine Lease-Zeile in SQLite:
+    wer sie hält, startet die Dienste, die genau einmal laufen dürfen
+    (Telegram-Bot, Job-Worker, Gedächtnis-Schleife, Upload-Reaper). Der Leader
+    verlängert die Lease alle TTL/3 Sekunden; stirbt er, übernimmt nach
+    spätestens einer TTL ein anderer Worker. Alle übrigen Worker bedienen nur
+    HTTP-Anfragen und reichen Hintergrundarbeit über die Job-Queue weiter.
+    """
+
+    def __init__(self, name: str = LEADER_LEASE, ttl: float = LEADER_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self.since: Optional[float] = None
+        self._valid_until = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._on_promote: Optional[Callback] = None
+        self._on_demote: Optional[Callback] = None
+        # Beförderung und Rückstufung laufen nie gleichzeitig
+        self._transition = asyncio.Lock()
+        self.promotions = 0
+
+    async def start(self, on_promote: Callback, on_demote: Callback) -> None:
+        """Erster Versuch sofort (der Start wartet auf die Leader-Dienste), danach im Hintergrund."""
+        self._on_promote, self._on_demote = on_promote, on_demote
+        await self._step()
+        self._task = asyncio.create_task(self._run(), name="leadership")
+
+    async def _step(self) -> None:
+        acquired = await acquire_lease(self.name, self.holder, self.ttl)
+        if acquired:
+            self._valid_until = time.monotonic() + self.ttl
+        elif acquired is None and time.monotonic() < self._valid_until:
+            # DB kurz nicht erreichbar: Rolle behalten, solange die Lease sicher noch gilt
+            return
+        async with self._transition:
+            if acquired and not self.is_leader:
+                self.is_leader = True
+                self.since = time.time()
+                self.promotions += 1
+                print(f"👑 Worker {os.getpid()} ist Leader.")
+                # Der Start der Dienste (z.B. Neuaufbau des Gedächtnisses) kann länger als die TTL dauern
+                renew = asyncio.create_task(self._renew())
+                try:
+                    await self._on_promote()
+                finally:
+                    renew.cancel()
+            elif not acquired and self.is_leader:
+                self.is_leader = False
+                self.since = None
+                print(f"⚠️ Worker {os.getpid()} hat die Leader-Rolle verloren.")
+                await self._on_demote()
+
+    async def _renew(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            if await acquire_lease(self.name, self.holder, self.ttl):
+                self._valid_until = time.monotonic() + self.ttl
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self._step()
+            except Exception as e:
+                print(f"⚠️ Fehler bei der Leader-Wahl: {e}")
+
+    async def stop(self) -> None:
+        """Beendet die Wahl; die Lease bleibt, bis der Aufrufer seine Dienste angehalten hat (release)."""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def release(self) -> None:
+        # Sofort freigeben, damit ein anderer Worker nicht die ganze TTL warten muss
+        if self.is_leader:
+            self.is_leader = False
+            await release_lease(self.name, self.holder)
+
+    async def stats(self) -> Dict[str, Any]:
+        lease = await get_lease(self.name)
+        return {
+            "worker": self.holder,
+            "is_leader": self.is_leader,
+            "leader": lease["holder"] if lease else None,
+            "leader_since": self.since,
+            "ttl": self.ttl,
+            "promotions": self.promotions,
+        }
+
+
+async def watch_changes(interval: float = CHANGE_POLL_INTERVAL) -> None:
+    """Macht Schreibzugriffe anderer Worker lokal sichtbar (siehe database.poll_changes)."""
+    while True:
+        await poll_changes()
+        await asyncio.sleep(interval)
+
+
+leadership = Leadership()
@@ -0,0 +1,95 @@
+import os
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+# Eingabe-Budget (System-Prompt + Verlauf + Nachricht) je Anbieter in Tokens
+DEFAULT_CONTEXT_BUDGET = int(os.getenv("LLM_CONTEXT_BUDGET", "12000"))
+CONTEXT_BUDGETS = {
+    "OpenAI": int(os.getenv("LLM_CONTEXT_BUDGET_OPENAI", DEFAULT_CONTEXT_BUDGET)),
+    "Gemini": int(os.getenv("LLM_CONTEXT_BUDGET_GEMINI", DEFAULT_CONTEXT_BUDGET)),
+    # Die freien OpenRouter-Modelle haben oft nur kleine Kontextfenster
+    "OpenRouter": int(os.getenv("LLM_CONTEXT_BUDGET_OPENROUTER", "6000")),
+}
+# Einzelne Verlaufseinträge werden auf diese Länge gekürzt (z.B. lange Dokument-Antworten)
+TURN_TOKEN_LIMIT = int(os.getenv("LLM_TURN_TOKEN_LIMIT", "1500"))
+# Anteil des Budgets, den die aktuelle Nachricht (z.B. mit PDF-Inhalt) höchstens belegen darf
+MESSAGE_BUDGET_SHARE = 0.6
+NOTES_TOKEN_BUDGET = int(os.getenv("LLM_NOTES_TOKEN_BUDGET", "1500"))
+# Obergrenze der geladenen Verlaufszeilen; wie viele davon mitgehen, entscheidet das Budget
+HISTORY_FETCH_LIMIT = 100
+
+# Aufschlag pro Nachricht für Rolle und Trenner im Chat-Format
+MESSAGE_OVERHEAD = 4
+# Näherung ohne tiktoken; bewusst knapp, deutsche Texte zerfallen in mehr Tokens als englische
+CHARS_PER_TOKEN = 3.5
+TRUNCATION_MARKER = "\n[… gekürzt]"
+
+try:
+    import tiktoken
+
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    # Optionale Abhängigkeit (oder Encoding offline nicht verfügbar): lokale Näherung
+    _encoding = None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Tokenanzahl eines Textes. Gecacht, da der Verlauf bei jeder Anfrage erneut gezählt wird."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def truncate_to_tokens(text: str, limit: int) -> str:
+    if count_tokens(text) <= limit:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:limit]) + TRUNCATION_MARKER
+    return text[: int(limit * CHARS_PER_TOKEN)] + TRUNCATION_MARKER
+
+
+def fit_notes(lines: List[str], budget: int = NOTES_TOKEN_BUDGET) -> Tuple[List[str], int]:
+    """Nimmt Notizzeilen (neueste zuerst) bis zum Budget; liefert (zeilen, weggelassen)."""
+    used = 0
+    for i, line in enumerate(lines):
+        used += count_tokens(line) + 1
+        if used > budget:
+            return lines[:i], len(lines) - i
+    return lines, 0
+
+
+def assemble_context(
+    provider: str, system_instruction: str, history: List[Dict[str, str]], message: str
+) -> Tuple[str, List[Dict[str, str]], str]:
+    """
+    Passt System-Prompt, Verlauf und Nachricht in das Budget des Anbieters:
+    die Nachricht wird bei Bedarf gekürzt, danach wird der Verlauf von der
+    neuesten Nachricht rückwärts aufgefüllt, überlange Einträge gekürzt.
+    """
+    budget = CONTEXT_BUDGETS.get(provider, DEFAULT_CONTEXT_BUDGET)
+
+    # Die aktuelle Nachricht wurde bereits gespeichert und steht am Ende des Verlaufs
+    if history and history[-1]["role"] == "user" and history[-1]["content"] == message:
+        history = history[:-1]
+
+    message = truncate_to_tokens(message, int(budget * MESSAGE_BUDGET_SHARE))
+    remaining = (
+        budget
+        - count_tokens(system_instruction)
+        - count_tokens(message)
+        - 2 * MESSAGE_OVERHEAD
+    )
+
+    selected = []
+    for turn in reversed(history):
+        content = truncate_to_tokens(turn["content"], TURN_TOKEN_LIMIT)
+        cost = count_tokens(content) + MESSAGE_OVERHEAD
+        if cost > remaining:
+            break
+        remaining -= cost
+        selected.append(turn if content is turn["content"] else {**turn, "content": content})
+    selected.reverse()
+    return system_instruction, selected, message
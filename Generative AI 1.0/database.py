@@ -7,18 +7,182 @@ if sys.platform.startswith("win"):
         pass
 
 import aiosqlite
+import asyncio
 import os
-from typing import List, Dict, Tuple, Any
+import sqlite3
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import List, Dict, Tuple, Any, AsyncIterator, Iterator, Optional, Set
+
+from event_bus import bus
+from tracing import traced
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_PATH = os.path.join(BASE_DIR, "assistant_memory.db")
 
+DB_POOL_READERS = int(os.getenv("DB_POOL_READERS", "3"))
+# Größe des sqlite3-Statement-Caches pro Verbindung (vorbereitete Statements)
+DB_STATEMENT_CACHE = 128
+
+# FTS5-Spiegel (external content) von chat_history und notes, per Trigger synchron gehalten.
+# notes nutzt Trigramme, damit "Löschen nach Inhalt" weiterhin Teilstrings findet.
+FTS_TABLES = {
+    "chat_history_fts": ("chat_history", "unicode61 remove_diacritics 2"),
+    "notes_fts": ("notes", "trigram"),
+}
+
+
+class ConnectionPool:
+    """
+    Langlebige SQLite-Verbindungen: genau eine Schreibverbindung (serialisiert
+    über ein Lock) und mehrere Leseverbindungen. Pragmas werden einmalig beim
+    Öffnen gesetzt, vorbereitete Statements bleiben im Cache jeder Verbindung.
+    """
+
+    def __init__(self, path: str, readers: int = DB_POOL_READERS):
+        self.path = path
+        self.reader_count = max(1, readers)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._all_readers: List[aiosqlite.Connection] = []
+        self._write_lock: Optional[asyncio.Lock] = None
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, cached_statements=DB_STATEMENT_CACHE)
+        await conn.execute("PRAGMA journal_mode=WAL;")
+        await conn.execute("PRAGMA synchronous=NORMAL;")
+        await conn.execute("PRAGMA busy_timeout=5000;")
+        if read_only:
+            await conn.execute("PRAGMA query_only=ON;")
+        return conn
+
+    async def open(self) -> None:
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        self._writer = await self._connect()
+        for _ in range(self.reader_count):
+            conn = await self._connect(read_only=True)
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self) -> None:
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers = []
+        if self._writer:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+
+_pool: Optional[ConnectionPool] = None
+
+# Versionszähler pro Tabelle, von jeder Schreibfunktion erhöht (Cache-Invalidierung)
+_table_versions: Dict[str, int] = {
+    "user_info": 0, "calendar_cache": 0, "calendar_events": 0, "notes": 0, "memory_chunks": 0,
+}
+# Zuletzt gesehene Stände aus table_versions (Schreibzugriffe anderer Worker-Prozesse)
+_shared_versions: Dict[str, int] = {}
+# Eigene, schon veröffentlichte Chat-Nachrichten; der Change-Watcher überspringt sie
+_local_message_ids: Set[int] = set()
+CHANGE_POLL_INTERVAL = float(os.getenv("CHANGE_POLL_INTERVAL", "1.0"))
+
+
+def get_table_version(table: str) -> int:
+    return _table_versions.get(table, 0)
+
+
+def _bump_version(table: str) -> None:
+    _table_versions[table] = _table_versions.get(table, 0) + 1
+
+
+BUMP_SHARED_VERSION_SQL = """
+    INSERT INTO table_versions (name, version) VALUES (?, 1)
+    ON CONFLICT(name) DO UPDATE SET version = version + 1
+    RETURNING version
+"""
+
+
+async def _bump_shared_version(conn: aiosqlite.Connection, table: str) -> None:
+    """In derselben Transaktion wie die Änderung, damit andere Worker sie sicher bemerken."""
+    async with conn.execute(BUMP_SHARED_VERSION_SQL, (table,)) as cursor:
+        row = await cursor.fetchone()
+    _seen_own_version(table, row[0])
+
+
+def _seen_own_version(table: str, version: int) -> None:
+    # Die eigene Änderung ist lokal schon invalidiert, der Watcher muss sie nicht melden
+    if _shared_versions.get(table, 0) == version - 1:
+        _shared_versions[table] = version
+
+
+@contextmanager
+def versioned_transaction(conn: sqlite3.Connection, table: str, changed: bool = True) -> Iterator[sqlite3.Connection]:
+    """
+    Transaktion für synchrone Schreiber außerhalb des Pools (z.B. Kalender-Spiegel
+    in Worker-Threads), die wie die async Schreibfunktionen die Version von `table` erhöht.
+    """
+    with conn:
+        yield conn
+        version = conn.execute(BUMP_SHARED_VERSION_SQL, (table,)).fetchone()[0] if changed else None
+    if version is not None:
+        _seen_own_version(table, version)
+        _bump_version(table)
+
+
+@asynccontextmanager
+async def _read_conn() -> AsyncIterator[aiosqlite.Connection]:
+    # Ohne gestarteten Pool (z.B. Skripte) fällt der Zugriff auf eine Einzelverbindung zurück
+    if _pool:
+        async with _pool.reader() as conn:
+            yield conn
+    else:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            yield conn
+
+
+@asynccontextmanager
+async def _write_conn() -> AsyncIterator[aiosqlite.Connection]:
+    if _pool:
+        async with _pool.writer() as conn:
+            yield conn
+    else:
+        async with aiosqlite.connect(DB_PATH) as conn:
+            yield conn
+
+
+async def close_db() -> None:
+    global _pool
+    if _pool:
+        await _pool.close()
+        _pool = None
+        print("🔌 Datenbank-Verbindungen geschlossen.")
+
 
 async def init_db() -> None:
+    global _pool
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            await conn.execute("PRAGMA journal_mode=WAL;")
-            await conn.execute("PRAGMA synchronous=NORMAL;")
+        if _pool is None:
+            pool = ConnectionPool(DB_PATH)
+            await pool.open()
+            _pool = pool
+        async with _write_conn() as conn:
             await conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS users (
@@ -56,6 +220,30 @@ async def init_db() -> None:
                 )
             """
             )
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS calendar_events (
+                    id TEXT PRIMARY KEY,
+                    summary TEXT,
+                    start TEXT,
+                    start_utc TEXT,
+                    end_utc TEXT,
+                    updated TEXT
+                )
+            """
+            )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_calendar_events_start ON calendar_events (start_utc)"
+            )
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS calendar_sync (
+                    calendar_id TEXT PRIMARY KEY,
+                    sync_token TEXT,
+                    synced_at REAL
+                )
+            """
+            )
             await conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS notes (
@@ -65,27 +253,156 @@ async def init_db() -> None:
                 )
             """
             )
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    run_at REAL NOT NULL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL
+                )
+            """
+            )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, run_at)"
+            )
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS blobs (
+                    key TEXT PRIMARY KEY,
+                    digest TEXT,
+                    size INTEGER NOT NULL,
+                    mime TEXT,
+                    created_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """
+            )
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_blobs_expiry ON blobs (expires_at)"
+            )
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS summary_runs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    started_at REAL NOT NULL,
+                    duration_ms REAL NOT NULL,
+                    first_message_id INTEGER NOT NULL,
+                    last_message_id INTEGER NOT NULL,
+                    messages INTEGER NOT NULL,
+                    provider TEXT,
+                    model TEXT,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    cost_usd REAL,
+                    status TEXT NOT NULL,
+                    error TEXT
+                )
+            """
+            )
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS memory_chunks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    first_message_id INTEGER,
+                    last_message_id INTEGER,
+                    vec_row INTEGER NOT NULL UNIQUE,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """
+            )
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS table_versions (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )
+            """
+            )
+            await conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS leases (
+                    name TEXT PRIMARY KEY,
+                    holder TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """
+            )
+            await _create_fts(conn)
             await conn.commit()
-        print("✅ Datenbank erfolgreich initialisiert (async).")
+        print(
+            f"✅ Datenbank erfolgreich initialisiert (async, 1 Schreib- + {_pool.reader_count} Leseverbindungen)."
+        )
     except Exception as e:
         print(f"❌ Datenbank-Fehler bei Initialisierung: {e}")
 
 
+async def _create_fts(conn: aiosqlite.Connection) -> None:
+    for fts, (table, tokenizer) in FTS_TABLES.items():
+        async with conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,)
+        ) as cursor:
+            exists = await cursor.fetchone() is not None
+        await conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"content, content='{table}', content_rowid='id', tokenize='{tokenizer}')"
+        )
+        await conn.executescript(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF content ON {table} BEGIN
+                INSERT INTO {fts}({fts}, rowid, content) VALUES ('delete', old.id, old.content);
+                INSERT INTO {fts}(rowid, content) VALUES (new.id, new.content);
+            END;
+            """
+        )
+        if not exists:
+            # Bestehende Daten einmalig indexieren
+            await conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def _fts_query(query: str, prefix: bool = True) -> str:
+    """Nutzereingabe als sichere FTS5-Abfrage: jedes Wort als Phrase, alle müssen vorkommen."""
+    terms = [t.replace('"', '""') for t in query.split()]
+    if not terms:
+        return ""
+    parts = [f'"{t}"' for t in terms]
+    if prefix:
+        parts[-1] += "*"
+    return " ".join(parts)
+
+
+@traced("db.save_info")
 async def save_info(key: str, value: str) -> None:
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with _write_conn() as conn:
             await conn.execute(
                 "INSERT OR REPLACE INTO user_info (key, value) VALUES (?, ?)",
                 (key, value),
             )
+            await _bump_shared_version(conn, "user_info")
             await conn.commit()
+        _bump_version("user_info")
     except Exception as e:
         print(f"⚠️ Fehler beim Speichern der Info ({key}): {e}")
 
 
+@traced("db.get_all_info")
 async def get_all_info() -> List[Tuple[str, str]]:
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with _read_conn() as conn:
             async with conn.execute("SELECT key, value FROM user_info") as cursor:
                 return await cursor.fetchall()
     except Exception as e:
@@ -93,21 +410,28 @@ async def get_all_info() -> List[Tuple[str, str]]:
         return []
 
 
-async def save_message(role: str, content: str) -> None:
+@traced("db.save_message")
+async def save_message(role: str, content: str) -> Optional[int]:
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            await conn.execute(
+        async with _write_conn() as conn:
+            cursor = await conn.execute(
                 "INSERT INTO chat_history (role, content) VALUES (?, ?)",
                 (role, content),
             )
             await conn.commit()
+            message_id = cursor.lastrowid
+        _local_message_ids.add(message_id)
+        bus.publish("chat", {"id": message_id, "role": role, "content": content})
+        return message_id
     except Exception as e:
         print(f"⚠️ Fehler beim Speichern der Nachricht: {e}")
+        return None
 
 
+@traced("db.get_chat_history")
 async def get_chat_history(limit: int = 100) -> List[Dict[str, str]]:
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with _read_conn() as conn:
             async with conn.execute(
                 "SELECT role, content FROM chat_history ORDER BY id DESC LIMIT ?",
                 (limit,),
@@ -119,21 +443,69 @@ async def get_chat_history(limit: int = 100) -> List[Dict[str, str]]:
         return []
 
 
+@traced("db.get_history_rows")
+async def get_history_rows(limit: int = 50, since_id: int = 0) -> List[Dict[str, Any]]:
+    """Wie get_chat_history, aber mit IDs und optional nur Nachrichten nach since_id."""
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute(
+                "SELECT id, role, content FROM chat_history WHERE id > ? ORDER BY id DESC LIMIT ?",
+                (since_id, limit),
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return [{"id": i, "role": r, "content": c} for i, r, c in reversed(rows)]
+    except Exception as e:
+        print(f"⚠️ Fehler beim Laden des Chat-Verlaufs: {e}")
+        return []
+
+
+@traced("db.get_messages_since")
+async def get_messages_since(after_id: int, limit: int = 200) -> List[Dict[str, Any]]:
+    """Älteste Nachrichten nach after_id zuerst (für inkrementelle Verarbeitung)."""
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute(
+                "SELECT id, role, content, timestamp FROM chat_history WHERE id > ? ORDER BY id LIMIT ?",
+                (after_id, limit),
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return [{"id": i, "role": r, "content": c, "timestamp": t} for i, r, c, t in rows]
+    except Exception as e:
+        print(f"⚠️ Fehler beim Laden des Chat-Verlaufs: {e}")
+        return []
+
+
+@traced("db.get_latest_message_id")
+async def get_latest_message_id() -> int:
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute("SELECT MAX(id) FROM chat_history") as cursor:
+                row = await cursor.fetchone()
+        return row[0] or 0
+    except Exception as e:
+        print(f"⚠️ Fehler beim Laden der letzten Nachrichten-ID: {e}")
+        return 0
+
+
+@traced("db.save_calendar_context")
 async def save_calendar_context(event_name: str, action: str) -> None:
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with _write_conn() as conn:
             await conn.execute(
                 "INSERT INTO calendar_cache (event_name, action) VALUES (?, ?)",
                 (event_name, action),
             )
+            await _bump_shared_version(conn, "calendar_cache")
             await conn.commit()
+        _bump_version("calendar_cache")
     except Exception as e:
         print(f"⚠️ Fehler beim Speichern des Kalender-Kontexts: {e}")
 
 
+@traced("db.get_latest_calendar_context")
 async def get_latest_calendar_context() -> str:
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with _read_conn() as conn:
             async with conn.execute(
                 "SELECT event_name, action FROM calendar_cache ORDER BY id DESC LIMIT 5"
             ) as cursor:
@@ -157,48 +529,623 @@ async def get_latest_calendar_context() -> str:
         return ""
 
 
+@traced("db.add_note")
 async def add_note(content: str) -> int:
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with _write_conn() as conn:
             cursor = await conn.execute(
                 "INSERT INTO notes (content) VALUES (?)",
                 (content,)
             )
+            await _bump_shared_version(conn, "notes")
             await conn.commit()
-            return cursor.lastrowid
+            note_id = cursor.lastrowid
+        _bump_version("notes")
+        bus.publish("notes")
+        return note_id
     except Exception as e:
         print(f"⚠️ Fehler beim Speichern der Notiz: {e}")
         return -1
 
 
+@traced("db.delete_note")
 async def delete_note(note_id: int) -> bool:
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
+        async with _write_conn() as conn:
             cursor = await conn.execute(
                 "DELETE FROM notes WHERE id = ?",
                 (note_id,)
             )
+            deleted = cursor.rowcount > 0
+            if deleted:
+                await _bump_shared_version(conn, "notes")
             await conn.commit()
-            return cursor.rowcount > 0
+        if deleted:
+            _bump_version("notes")
+            bus.publish("notes")
+        return deleted
     except Exception as e:
         print(f"⚠️ Fehler beim Löschen der Notiz: {e}")
         return False
 
 
+@traced("db.get_all_notes")
 async def get_all_notes() -> List[Dict[str, Any]]:
     try:
-        async with aiosqlite.connect(DB_PATH) as conn:
-            conn.row_factory = aiosqlite.Row
+        async with _read_conn() as conn:
             async with conn.execute("SELECT id, content, created_at FROM notes ORDER BY id DESC") as cursor:
                 rows = await cursor.fetchall()
-                return [{"id": r["id"], "content": r["content"], "created_at": r["created_at"]} for r in rows]
+                return [{"id": r[0], "content": r[1], "created_at": r[2]} for r in rows]
     except Exception as e:
         print(f"⚠️ Fehler beim Laden der Notizen: {e}")
         return []
 
 
+@traced("db.search_messages")
+async def search_messages(query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Volltextsuche im Chatverlauf, nach Relevanz (bm25) sortiert."""
+    match = _fts_query(query)
+    if not match:
+        return []
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute(
+                """
+                SELECT h.id, h.role, h.timestamp,
+                       snippet(chat_history_fts, 0, '[', ']', '…', 16)
+                FROM chat_history_fts
+                JOIN chat_history h ON h.id = chat_history_fts.rowid
+                WHERE chat_history_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+                """,
+                (match, limit),
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return [{"id": i, "role": r, "timestamp": t, "snippet": s} for i, r, t, s in rows]
+    except Exception as e:
+        print(f"⚠️ Fehler bei der Verlaufssuche: {e}")
+        return []
+
+
+@traced("db.search_notes")
+async def search_notes(query: str, limit: int = 20) -> List[Dict[str, Any]]:
+    """Teilstring-Suche in den Notizen (Trigramm-Index, ohne Groß-/Kleinschreibung)."""
+    query = query.strip()
+    if not query:
+        return []
+    try:
+        async with _read_conn() as conn:
+            if len(query) >= 3:
+                sql = """
+                    SELECT n.id, n.content, n.created_at FROM notes_fts
+                    JOIN notes n ON n.id = notes_fts.rowid
+                    WHERE notes_fts MATCH ?
+                    ORDER BY rank
+                    LIMIT ?
+                """
+                params = (_fts_query(query, prefix=False), limit)
+            else:
+                # Trigramme brauchen mindestens 3 Zeichen
+                sql = "SELECT id, content, created_at FROM notes WHERE content LIKE ? ORDER BY id DESC LIMIT ?"
+                params = (f"%{query}%", limit)
+            async with conn.execute(sql, params) as cursor:
+                rows = await cursor.fetchall()
+        return [{"id": r[0], "content": r[1], "created_at": r[2]} for r in rows]
+    except Exception as e:
+        print(f"⚠️ Fehler bei der Notizsuche: {e}")
+        return []
+
+
+# ──────────────────────────────────────────────────────────
+# Upload-Speicher: Ablaufdaten der Dateien unter static/uploads
+# ──────────────────────────────────────────────────────────
+
+
+@traced("db.register_blob")
+async def register_blob(key: str, digest: Optional[str], size: int, mime: Optional[str], expires_at: float) -> bool:
+    """Legt einen Eintrag an; ein erneuter Upload derselben Datei verlängert nur die Frist."""
+    try:
+        async with _write_conn() as conn:
+            await conn.execute(
+                """
+                INSERT INTO blobs (key, digest, size, mime, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET expires_at = MAX(expires_at, excluded.expires_at)
+                """,
+                (key, digest, size, mime, time.time(), expires_at),
+            )
+            await conn.commit()
+        return True
+    except Exception as e:
+        print(f"⚠️ Fehler beim Registrieren des Uploads: {e}")
+        return False
+
+
+@traced("db.get_expired_blobs")
+async def get_expired_blobs(now: float, limit: int = 500) -> List[str]:
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute(
+                "SELECT key FROM blobs WHERE expires_at <= ? ORDER BY expires_at LIMIT ?",
+                (now, limit),
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return [r[0] for r in rows]
+    except Exception as e:
+        print(f"⚠️ Fehler beim Laden abgelaufener Uploads: {e}")
+        return []
+
+
+@traced("db.delete_expired_blobs")
+async def delete_expired_blobs(keys: List[str], now: float) -> List[str]:
+    """Löscht die Einträge und liefert die Schlüssel, deren Dateien weg dürfen."""
+    deleted = []
+    try:
+        async with _write_conn() as conn:
+            for key in keys:
+                # Nur, wenn die Frist nicht zwischenzeitlich durch einen erneuten Upload verlängert wurde
+                async with conn.execute(
+                    "DELETE FROM blobs WHERE key = ? AND expires_at <= ? RETURNING key", (key, now)
+                ) as cursor:
+                    deleted.extend(r[0] for r in await cursor.fetchall())
+            await conn.commit()
+    except Exception as e:
+        print(f"⚠️ Fehler beim Löschen der Upload-Einträge: {e}")
+        return []
+    return deleted
+
+
+@traced("db.next_blob_expiry")
+async def next_blob_expiry() -> Optional[float]:
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute("SELECT MIN(expires_at) FROM blobs") as cursor:
+                row = await cursor.fetchone()
+        return row[0]
+    except Exception as e:
+        print(f"⚠️ Fehler beim Laden der nächsten Upload-Frist: {e}")
+        return None
+
+
+@traced("db.get_blob_stats")
+async def get_blob_stats() -> Dict[str, Any]:
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs") as cursor:
+                count, size = await cursor.fetchone()
+        return {"files": count, "bytes": size}
+    except Exception as e:
+        print(f"⚠️ Fehler beim Laden der Upload-Statistik: {e}")
+        return {}
+
+
+# ──────────────────────────────────────────────────────────
+# Langzeit-Zusammenfassung: Läufe mit Wasserstand, Dauer und Kosten
+# ──────────────────────────────────────────────────────────
+
+
+@traced("db.record_summary_run")
+async def record_summary_run(run: Dict[str, Any]) -> None:
+    columns = (
+        "started_at", "duration_ms", "first_message_id", "last_message_id", "messages", "provider",
+        "model", "prompt_tokens", "completion_tokens", "cost_usd", "status", "error",
+    )
+    try:
+        async with _write_conn() as conn:
+            await conn.execute(
+                f"INSERT INTO summary_runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                [run.get(c) for c in columns],
+            )
+            await conn.commit()
+    except Exception as e:
+        print(f"⚠️ Fehler beim Protokollieren der Zusammenfassung: {e}")
+
+
+@traced("db.get_summary_watermark")
+async def get_summary_watermark() -> Optional[int]:
+    """Letzte erfolgreich zusammengefasste chat_history.id; None = noch kein Lauf."""
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute(
+                "SELECT MAX(last_message_id) FROM summary_runs WHERE status = 'ok'"
+            ) as cursor:
+                row = await cursor.fetchone()
+        return row[0]
+    except Exception as e:
+        print(f"⚠️ Fehler beim Laden des Zusammenfassungs-Wasserstands: {e}")
+        return None
+
+
+@traced("db.get_summary_stats")
+async def get_summary_stats() -> Dict[str, Any]:
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute(
+                """
+                SELECT COUNT(*), SUM(status = 'ok'), COALESCE(SUM(cost_usd), 0),
+                       SUM(status = 'ok' AND cost_usd IS NULL), COALESCE(SUM(messages), 0),
+                       COALESCE(SUM(prompt_tokens + completion_tokens), 0), AVG(duration_ms), MAX(started_at)
+                FROM summary_runs
+                """
+            ) as cursor:
+                runs, ok, cost, unpriced, messages, tokens, avg_ms, last = await cursor.fetchone()
+        return {
+            "runs": runs,
+            "failed": runs - (ok or 0),
+            "messages": messages,
+            "tokens": tokens,
+            # Nur Läufe mit bekanntem Preis (LLM_PRICE_*); die übrigen zählen unter unpriced_runs
+            "cost_usd": round(cost, 6),
+            "unpriced_runs": unpriced or 0,
+            "avg_duration_ms": round(avg_ms or 0, 1),
+            "last_run_at": last,
+        }
+    except Exception as e:
+        print(f"⚠️ Fehler beim Laden der Zusammenfassungs-Statistik: {e}")
+        return {}
+
+
+# ──────────────────────────────────────────────────────────
+# Vektor-Gedächtnis: Metadaten der Chunks (Vektoren liegen in memory_index/)
+# ──────────────────────────────────────────────────────────
+
+
+@traced("db.add_memory_chunks")
+async def add_memory_chunks(chunks: List[Tuple[str, str, Optional[int], Optional[int], int, Optional[str]]]) -> bool:
+    """chunks: (kind, content, first_message_id, last_message_id, vec_row, created_at)."""
+    try:
+        async with _write_conn() as conn:
+            await conn.executemany(
+                """
+                INSERT INTO memory_chunks (kind, content, first_message_id, last_message_id, vec_row, created_at)
+                VALUES (?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+                """,
+                chunks,
+            )
+            await _bump_shared_version(conn, "memory_chunks")
+            await conn.commit()
+        _bump_version("memory_chunks")
+        return True
+    except Exception as e:
+        print(f"⚠️ Fehler beim Speichern der Gedächtnis-Chunks: {e}")
+        return False
+
+
+@traced("db.get_memory_chunks")
+async def get_memory_chunks(
+    kind: Optional[str] = None, with_content: bool = False, min_row: int = 0
+) -> List[Dict[str, Any]]:
+    columns = "id, kind, vec_row, last_message_id" + (", content" if with_content else "")
+    where, params = "WHERE vec_row >= ?", [min_row]
+    if kind:
+        where += " AND kind = ?"
+        params.append(kind)
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute(
+                f"SELECT {columns} FROM memory_chunks {where} ORDER BY id", params
+            ) as cursor:
+                rows = await cursor.fetchall()
+        keys = ("id", "kind", "vec_row", "last_message_id", "content")
+        return [dict(zip(keys, row)) for row in rows]
+    except Exception as e:
+        print(f"⚠️ Fehler beim Laden der Gedächtnis-Chunks: {e}")
+        return []
+
+
+@traced("db.get_memory_contents")
+async def get_memory_contents(vec_rows: List[int]) -> Dict[int, Dict[str, Any]]:
+    if not vec_rows:
+        return {}
+    placeholders = ",".join("?" * len(vec_rows))
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute(
+                f"SELECT vec_row, kind, content, created_at FROM memory_chunks WHERE vec_row IN ({placeholders})",
+                vec_rows,
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return {r: {"kind": k, "content": c, "created_at": t} for r, k, c, t in rows}
+    except Exception as e:
+        print(f"⚠️ Fehler beim Laden der Gedächtnis-Inhalte: {e}")
+        return {}
+
+
+@traced("db.delete_memory_chunks")
+async def delete_memory_chunks(chunk_ids: List[int]) -> bool:
+    try:
+        async with _write_conn() as conn:
+            await conn.executemany("DELETE FROM memory_chunks WHERE id = ?", [(i,) for i in chunk_ids])
+            await _bump_shared_version(conn, "memory_chunks")
+            await conn.commit()
+        _bump_version("memory_chunks")
+        return True
+    except Exception as e:
+        print(f"⚠️ Fehler beim Löschen der Gedächtnis-Chunks: {e}")
+        return False
+
+
+@traced("db.set_memory_rows")
+async def set_memory_rows(rows: List[Tuple[int, int]]) -> bool:
+    """
+    Neue Vektor-Zeilen nach Kompaktierung/Neuaufbau: (vec_row, chunk_id).
+    Nicht aufgeführte Chunks gehören zu keinem Vektor mehr und werden entfernt.
+    """
+    try:
+        async with _write_conn() as conn:
+            # Zwei Schritte, damit die UNIQUE-Bedingung auf vec_row zwischendurch nicht greift
+            await conn.execute("UPDATE memory_chunks SET vec_row = -id")
+            await conn.executemany("UPDATE memory_chunks SET vec_row = ? WHERE id = ?", rows)
+            await conn.execute("DELETE FROM memory_chunks WHERE vec_row < 0")
+            await _bump_shared_version(conn, "memory_chunks")
+            await conn.commit()
+        _bump_version("memory_chunks")
+        return True
+    except Exception as e:
+        print(f"⚠️ Fehler beim Aktualisieren der Gedächtnis-Zeilen: {e}")
+        return False
+
+
+# ──────────────────────────────────────────────────────────
+# Persistente Job-Queue (siehe job_queue.py)
+# ──────────────────────────────────────────────────────────
+
+
+@traced("db.enqueue_job")
+async def enqueue_job(kind: str, payload: str, max_attempts: int) -> Optional[int]:
+    try:
+        now = time.time()
+        async with _write_conn() as conn:
+            cursor = await conn.execute(
+                "INSERT INTO jobs (kind, payload, max_attempts, run_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, payload, max_attempts, now, now),
+            )
+            await conn.commit()
+            return cursor.lastrowid
+    except Exception as e:
+        print(f"⚠️ Fehler beim Einreihen des Jobs: {e}")
+        return None
+
+
+@traced("db.claim_job")
+async def claim_job() -> Optional[Tuple[int, str, str, int, int]]:
+    """Nimmt den ältesten fälligen Job atomar (Status 'running') und liefert (id, kind, payload, attempts, max_attempts)."""
+    try:
+        async with _write_conn() as conn:
+            async with conn.execute(
+                """
+                UPDATE jobs SET status = 'running', attempts = attempts + 1
+                WHERE id = (
+                    SELECT id FROM jobs WHERE status = 'pending' AND run_at <= ?
+                    ORDER BY run_at, id LIMIT 1
+                )
+                RETURNING id, kind, payload, attempts, max_attempts
+                """,
+                (time.time(),),
+            ) as cursor:
+                row = await cursor.fetchone()
+            await conn.commit()
+        return tuple(row) if row else None
+    except Exception as e:
+        print(f"⚠️ Fehler beim Abholen eines Jobs: {e}")
+        return None
+
+
+@traced("db.finish_job")
+async def finish_job(job_id: int) -> None:
+    # Erledigte Jobs werden gelöscht, die Tabelle bleibt klein
+    try:
+        async with _write_conn() as conn:
+            await conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            await conn.commit()
+    except Exception as e:
+        print(f"⚠️ Fehler beim Abschließen des Jobs {job_id}: {e}")
+
+
+@traced("db.reschedule_job")
+async def reschedule_job(job_id: int, status: str, run_at: float, error: str = None) -> None:
+    """Zurück auf 'pending' (Retry ab run_at) oder endgültig 'failed'."""
+    try:
+        async with _write_conn() as conn:
+            await conn.execute(
+                "UPDATE jobs SET status = ?, run_at = ?, last_error = ? WHERE id = ?",
+                (status, run_at, error, job_id),
+            )
+            await conn.commit()
+    except Exception as e:
+        print(f"⚠️ Fehler beim Aktualisieren des Jobs {job_id}: {e}")
+
+
+@traced("db.update_job_payload")
+async def update_job_payload(job_id: int, payload: str) -> None:
+    try:
+        async with _write_conn() as conn:
+            await conn.execute("UPDATE jobs SET payload = ? WHERE id = ?", (payload, job_id))
+            await conn.commit()
+    except Exception as e:
+        print(f"⚠️ Fehler beim Sichern des Job-Zwischenstands {job_id}: {e}")
+
+
+async def recover_jobs() -> int:
+    """Beim Start: Jobs, die beim letzten Beenden noch liefen, wieder freigeben. Liefert die Zahl offener Jobs."""
+    try:
+        async with _write_conn() as conn:
+            await conn.execute("UPDATE jobs SET status = 'pending' WHERE status = 'running'")
+            await conn.commit()
+            async with conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'") as cursor:
+                row = await cursor.fetchone()
+        return row[0]
+    except Exception as e:
+        print(f"⚠️ Fehler beim Wiederherstellen der Jobs: {e}")
+        return 0
+
+
+async def next_job_due() -> Optional[float]:
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute(
+                "SELECT MIN(run_at) FROM jobs WHERE status = 'pending'"
+            ) as cursor:
+                row = await cursor.fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        print(f"⚠️ Fehler beim Lesen der Job-Queue: {e}")
+        return None
+
+
+async def get_job_counts() -> Dict[str, int]:
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status") as cursor:
+                rows = await cursor.fetchall()
+        return {status: count for status, count in rows}
+    except Exception as e:
+        print(f"⚠️ Fehler beim Lesen der Job-Queue: {e}")
+        return {}
+
+
+# ──────────────────────────────────────────────────────────
+# Mehrere Worker-Prozesse (siehe cluster.py)
+# ──────────────────────────────────────────────────────────
+
+
+async def acquire_lease(name: str, holder: str, ttl: float) -> Optional[bool]:
+    """Holt oder verlängert die Lease `name`; None, wenn die DB nicht erreichbar war."""
+    try:
+        now = time.time()
+        async with _write_conn() as conn:
+            async with conn.execute(
+                """
+                INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+                RETURNING holder
+                """,
+                (name, holder, now + ttl, now),
+            ) as cursor:
+                row = await cursor.fetchone()
+            await conn.commit()
+        return row is not None
+    except Exception as e:
+        print(f"⚠️ Fehler bei der Lease '{name}': {e}")
+        return None
+
+
+async def release_lease(name: str, holder: str) -> None:
+    try:
+        async with _write_conn() as conn:
+            await conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+            await conn.commit()
+    except Exception as e:
+        print(f"⚠️ Fehler beim Freigeben der Lease '{name}': {e}")
+
+
+async def get_lease(name: str) -> Optional[Dict[str, Any]]:
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute(
+                "SELECT holder, expires_at FROM leases WHERE name = ?", (name,)
+            ) as cursor:
+                row = await cursor.fetchone()
+        return {"holder": row[0], "expires_at": row[1]} if row else None
+    except Exception as e:
+        print(f"⚠️ Fehler beim Lesen der Lease '{name}': {e}")
+        return None
+
+
+_chat_watermark: Optional[int] = None
+
+
+async def poll_changes() -> None:
+    """
+    Übernimmt Schreibzugriffe anderer Worker: erhöht die lokalen
+    Tabellenversionen (Prompt-Caches) und veröffentlicht neue Chat-Nachrichten
+    und Notizblock-Änderungen auf dem lokalen Event-Bus (SSE, Gedächtnis-Schleife).
+    """
+    global _chat_watermark
+    try:
+        async with _read_conn() as conn:
+            async with conn.execute("SELECT name, version FROM table_versions") as cursor:
+                versions = dict(await cursor.fetchall())
+            if _chat_watermark is None:
+                async with conn.execute("SELECT MAX(id) FROM chat_history") as cursor:
+                    _chat_watermark = (await cursor.fetchone())[0] or 0
+                _shared_versions.update(versions)
+                return
+            async with conn.execute(
+                "SELECT id, role, content FROM chat_history WHERE id > ? ORDER BY id LIMIT 200",
+                (_chat_watermark,),
+            ) as cursor:
+                rows = await cursor.fetchall()
+    except Exception as e:
+        print(f"⚠️ Fehler beim Abgleich mit anderen Workern: {e}")
+        return
+
+    for table, version in versions.items():
+        if _shared_versions.get(table) != version:
+            _shared_versions[table] = version
+            _bump_version(table)
+            if table == "notes":
+                bus.publish("notes")
+    for message_id, role, content in rows:
+        _chat_watermark = message_id
+        if message_id in _local_message_ids:
+            _local_message_ids.discard(message_id)
+            continue
+        bus.publish("chat", {"id": message_id, "role": role, "content": content})
+    # Eigene IDs, die der Watcher schon hinter sich hat, nicht ewig aufheben
+    if _local_message_ids and min(_local_message_ids) <= _chat_watermark:
+        _local_message_ids.difference_update([i for i in _local_message_ids if i <= _chat_watermark])
+
+
+async def _bench_request() -> None:
+    # Entspricht den DB-Zugriffen eines /chat-Requests (System-Prompt, Verlauf, Speichern)
+    await save_message("user", "Benchmark")
+    await get_all_info()
+    await get_latest_calendar_context()
+    await get_all_notes()
+    await get_chat_history(limit=30)
+    await save_message("assistant", "Benchmark")
+
+
+async def _run_benchmark(rounds: int = 200) -> None:
+    import tempfile
+
+    global DB_PATH, _pool
+    original_path = DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        DB_PATH = os.path.join(tmp, "bench.db")
+        try:
+            await init_db()
+            for n in range(20):
+                await add_note(f"Notiz {n}")
+
+            pool = _pool
+            results = {}
+            for label, active in (("Einzelverbindungen", None), ("Pool", pool)):
+                _pool = active
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    await _bench_request()
+                results[label] = (time.perf_counter() - start) / rounds * 1000
+            _pool = pool
+
+            for label, ms in results.items():
+                print(f"⏱️ {label}: {ms:.2f} ms DB-Overhead pro Request")
+            print(f"🚀 Faktor: {results['Einzelverbindungen'] / results['Pool']:.1f}x")
+        finally:
+            await close_db()
+            DB_PATH = original_path
+
+
 if __name__ == "__main__":
-    import asyncio
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        asyncio.run(_run_benchmark())
+    else:
+        async def _setup() -> None:
+            await init_db()
+            await close_db()
 
-    asyncio.run(init_db())
-    print("Datenbank-Setup abgeschlossen.")
+        asyncio.run(_setup())
+        print("Datenbank-Setup abgeschlossen.")
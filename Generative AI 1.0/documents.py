@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import aclosing, suppress
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from context_budget import count_tokens, truncate_to_tokens
+from tracing import span
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Obergrenze des Dokumentinhalts im Prompt; der Rest des PDFs wird gar nicht erst extrahiert
+PDF_TOKEN_BUDGET = int(os.getenv("PDF_TOKEN_BUDGET", "6000"))
+PDF_CACHE_SIZE = int(os.getenv("PDF_CACHE_SIZE", "32"))
+# Kleine Dokumente lohnen den Prozess-Pool nicht (Start + Übergabe > Extraktion)
+PARALLEL_MIN_PAGES = 16
+# Seiten pro Auftrag: klein genug für frühe Ergebnisse, groß genug gegen IPC-Overhead
+PAGES_PER_TASK = 8
+# Auflösung der Vorschau, mit der gescannte PDFs an das Vision-Modell gehen
+VISION_DPI = 110
+
+PageResult = Tuple[int, str, bool]  # (seitenindex, text, nur_bild)
+
+
+def _extract_range(path: str, start: int, end: int) -> List[PageResult]:
+    """Läuft im Worker-Prozess: Text der Seiten [start, end) und ob sie nur aus Bildern bestehen."""
+    results = []
+    with fitz.open(path) as doc:
+        for index in range(start, min(end, doc.page_count)):
+            page = doc[index]
+            text = page.get_text().strip()
+            results.append((index, text, not text and bool(page.get_images(full=False))))
+    return results
+
+
+def _page_count(path: str) -> int:
+    """Läuft im Worker-Prozess: schon das Öffnen großer oder kaputter PDFs kann dauern."""
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def _ready() -> bool:
+    return True
+
+
+def _render_page(path: str, index: int = 0) -> bytes:
+    with fitz.open(path) as doc:
+        return doc[index].get_pixmap(dpi=VISION_DPI).tobytes("jpeg")
+
+
+class ExtractedDocument:
+    def __init__(self, digest: str, page_count: int):
+        self.digest = digest
+        self.page_count = page_count
+        self.text = ""
+        self.pages_used = 0
+        self.image_pages: List[int] = []
+        self.truncated = False
+        # Gerendete erste Seite, falls das PDF keinen Text enthält (Scan) -> Vision
+        self.preview_image: Optional[bytes] = None
+
+    @property
+    def has_text(self) -> bool:
+        return self.pages_used > 0
+
+
+class DocumentEngine:
+    """
+    Extrahiert PDF-Text seitenweise und parallel in einem Prozess-Pool
+    (PyMuPDF hält die GIL, Threads würden sich gegenseitig ausbremsen).
+    Seiten kommen in Reihenfolge als Stream an; ist das Token-Budget
+    erreicht, werden die restlichen Aufträge verworfen. Reine Bildseiten
+    werden übersprungen, Ergebnisse per Inhalts-Hash zwischengespeichert.
+    """
+
+    def __init__(
+        self,
+        workers: int = PDF_WORKERS,
+        token_budget: int = PDF_TOKEN_BUDGET,
+        cache_size: int = PDF_CACHE_SIZE,
+    ):
+        self.workers = max(1, workers)
+        self.token_budget = token_budget
+        self.cache_size = cache_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._cache: "OrderedDict[str, ExtractedDocument]" = OrderedDict()
+        self.extracted = 0
+        self.cache_hits = 0
+        self.pages_extracted = 0
+        self.pages_skipped = 0
+        self._latencies = deque(maxlen=200)
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    async def start(self) -> None:
+        """
+        Startet die Worker-Prozesse vorab: vor dem Öffnen der DB-/Whisper-Threads
+        geforkt und ohne Startverzögerung beim ersten großen PDF.
+        """
+        if self.workers == 1:
+            return
+        loop = asyncio.get_running_loop()
+        pool = self._pool()
+        await asyncio.gather(*(loop.run_in_executor(pool, _ready) for _ in range(self.workers)))
+
+    async def stream_pages(self, path: str, page_count: int) -> AsyncIterator[PageResult]:
+        """Seiten in Reihenfolge; bricht der Verbraucher ab, werden offene Aufträge storniert."""
+        if page_count < PARALLEL_MIN_PAGES or self.workers == 1:
+            for result in await asyncio.to_thread(_extract_range, path, 0, page_count):
+                yield result
+            return
+
+        loop = asyncio.get_running_loop()
+        pool = self._pool()
+        futures = [
+            loop.run_in_executor(pool, _extract_range, path, start, start + PAGES_PER_TASK)
+            for start in range(0, page_count, PAGES_PER_TASK)
+        ]
+        try:
+            for future in futures:
+                for result in await future:
+                    yield result
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def _cached(self, digest: str) -> Optional[ExtractedDocument]:
+        cached = self._cache.get(digest)
+        if cached is not None:
+            self._cache.move_to_end(digest)
+            self.cache_hits += 1
+        return cached
+
+    async def extract(self, data: bytes) -> ExtractedDocument:
+        """PDF aus dem Speicher (z.B. Telegram-Download); wird für die Worker kurz auf Platte gelegt."""
+        digest = hashlib.sha256(data).hexdigest()
+        cached = self._cached(digest)
+        if cached is not None:
+            return cached
+
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            return await self.extract_file(path, digest)
+        finally:
+            # Unter Windows kann ein noch laufender Worker die Datei offen halten
+            with suppress(OSError):
+                os.remove(path)
+
+    async def extract_file(self, path: str, digest: str) -> ExtractedDocument:
+        """PDF, das schon auf Platte liegt (Upload-Speicher); `digest` ist dessen SHA-256."""
+        cached = self._cached(digest)
+        if cached is not None:
+            return cached
+
+        start = time.perf_counter()
+        with span("documents.extract"):
+            doc = await self._extract(path, digest)
+        self._latencies.append(time.perf_counter() - start)
+        self.extracted += 1
+
+        self._cache[digest] = doc
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return doc
+
+    async def _extract(self, path: str, digest: str) -> ExtractedDocument:
+        # Nicht auf dem Event-Loop öffnen: PyMuPDF hält die GIL, daher bevorzugt im Prozess-Pool
+        if self.workers == 1:
+            page_count = await asyncio.to_thread(_page_count, path)
+        else:
+            page_count = await asyncio.get_running_loop().run_in_executor(self._pool(), _page_count, path)
+        doc = ExtractedDocument(digest, page_count)
+
+        # Worker-Prozesse lesen die Datei selbst, statt die Bytes pro Auftrag übergeben zu bekommen
+        parts, used = [], 0
+        # aclosing: beim Abbruch am Budget sofort die restlichen Aufträge stornieren
+        async with aclosing(self.stream_pages(path, page_count)) as pages:
+            async for index, text, image_only in pages:
+                if image_only:
+                    doc.image_pages.append(index + 1)
+                    continue
+                if not text:
+                    continue
+                part = f"--- Seite {index + 1} ---\n{text}"
+                cost = count_tokens(part)
+                if used + cost > self.token_budget:
+                    parts.append(truncate_to_tokens(part, max(0, self.token_budget - used)))
+                    doc.pages_used += 1
+                    doc.truncated = True
+                    break
+                parts.append(part)
+                used += cost
+                doc.pages_used += 1
+
+        self.pages_extracted += doc.pages_used
+        self.pages_skipped += len(doc.image_pages)
+        notes = []
+        if doc.truncated:
+            notes.append(
+                f"[Token-Budget erreicht: nur {doc.pages_used} von {page_count} Seiten übernommen]"
+            )
+        if doc.image_pages:
+            notes.append(f"[Reine Bildseiten übersprungen: {', '.join(map(str, doc.image_pages[:20]))}]")
+        doc.text = "\n\n".join(parts + notes)
+
+        if not parts and page_count:
+            # Gescanntes PDF ohne Textebene: erste Seite als Bild an das Vision-Modell
+            doc.preview_image = await asyncio.to_thread(_render_page, path, 0)
+        return doc
+
+    def stats(self) -> Dict:
+        ordered = sorted(self._latencies)
+        return {
+            "workers": self.workers,
+            "token_budget": self.token_budget,
+            "extracted": self.extracted,
+            "cache_hits": self.cache_hits,
+            "cached": len(self._cache),
+            "pages_extracted": self.pages_extracted,
+            "pages_skipped": self.pages_skipped,
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1) if ordered else 0.0,
+        }
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+engine = DocumentEngine()
+
+
+def document_prompt(message: str, doc: ExtractedDocument) -> str:
+    """Nutzernachricht plus Dokumentinhalt, wie er an das LLM geht."""
+    if doc.has_text:
+        return f"{message}\n\nDokumentinhalt:\n{doc.text}"
+    if doc.preview_image:
+        return f"{message}\n\n(Das Dokument enthält keinen Text; die erste Seite ist als Bild angehängt.)"
+    return f"{message}\n\n(Das Dokument enthält keinen auslesbaren Text.)"
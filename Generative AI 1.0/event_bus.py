@@ -0,0 +1,50 @@
+import asyncio
+from typing import Any, Dict, Optional, Set
+
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class EventBus:
+    """
+    In-Process Pub/Sub für Live-Updates (z.B. neue Chat-Nachrichten).
+    Jeder Abonnent erhält eine eigene, begrenzte Queue; läuft sie voll,
+    wird sie geleert und ein 'resync'-Event eingereiht.
+    """
+
+    def __init__(self, maxsize: int = SUBSCRIBER_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.maxsize)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    @staticmethod
+    def _force_put(queue: asyncio.Queue, event: Optional[Dict[str, Any]]) -> None:
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    def publish(self, topic: str, data: Any = None) -> None:
+        event = {"topic": topic, "data": data}
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._force_put(queue, {"topic": "resync", "data": None})
+
+    def close(self) -> None:
+        # None signalisiert den offenen Streams das Ende (z.B. beim Shutdown)
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(None)
+            except asyncio.QueueFull:
+                self._force_put(queue, None)
+        self._subscribers.clear()
+
+
+bus = EventBus()
@@ -0,0 +1,158 @@
+"""
+Lokaler Fake der Telegram Bot API für Tests des Webhook-Modus ohne echten Bot.
+
+    python fake_telegram.py --count 10
+
+und in einem zweiten Terminal die App gegen den Fake starten:
+
+    TELEGRAM_BOT_TOKEN=123:fake TELEGRAM_API_URL=http://127.0.0.1:8081 \\
+    TELEGRAM_WEBHOOK_URL=http://127.0.0.1:8000/telegram/webhook python main.py
+
+Sobald die App ihren Webhook registriert, schickt der Fake einen Burst von
+Updates an die hinterlegte URL (mit Secret-Header) und protokolliert, in
+welcher Reihenfolge und nach welcher Zeit die Antworten eintreffen.
+tests/test_telegram_webhook.py startet Fake und Webhook-Route im selben
+Prozess und prüft damit automatisch die Reihenfolge je Chat.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+fake = FastAPI()
+calls: List[Dict[str, Any]] = []
+webhook: Dict[str, Optional[str]] = {"url": None, "secret": None}
+files: Dict[str, bytes] = {}
+webhook_set = asyncio.Event()
+_message_ids = iter(range(1, 1_000_000))
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+
+
+def _message(chat_id, text: str = "") -> Dict[str, Any]:
+    return {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": int(chat_id), "type": "private"},
+        "from": BOT_USER,
+        "text": text,
+    }
+
+
+def text_update(update_id: int, chat_id: int, text: str) -> Dict[str, Any]:
+    user = {"id": chat_id, "is_bot": False, "first_name": "Test"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+async def _params(request: Request) -> Dict[str, Any]:
+    if request.headers.get("content-type", "").startswith("application/json"):
+        return await request.json()
+    form = await request.form()
+    return {k: v for k, v in form.items() if isinstance(v, str)}
+
+
+@fake.post("/bot{token}/{method}")
+async def bot_api(token: str, method: str, request: Request):
+    params = await _params(request)
+    calls.append({"method": method, "params": params, "at": time.monotonic()})
+
+    if method == "getMe":
+        result: Any = BOT_USER
+    elif method == "setWebhook":
+        webhook["url"], webhook["secret"] = params.get("url"), params.get("secret_token")
+        webhook_set.set()
+        result = True
+    elif method in ("sendMessage", "editMessageText"):
+        result = _message(params.get("chat_id", 0), params.get("text", ""))
+    elif method in ("sendPhoto", "sendDocument", "sendVoice"):
+        result = _message(params.get("chat_id", 0), params.get("caption", ""))
+    elif method == "getFile":
+        file_id = params.get("file_id", "")
+        result = {
+            "file_id": file_id,
+            "file_unique_id": file_id,
+            "file_size": len(files.get(file_id, b"")),
+            "file_path": file_id,
+        }
+    else:
+        result = True
+    return {"ok": True, "result": result}
+
+
+@fake.get("/file/bot{token}/{path:path}")
+async def file_download(token: str, path: str):
+    return Response(files.get(path, b""))
+
+
+async def wait_reachable(url: str, timeout: float = 30.0) -> None:
+    """setWebhook kommt aus dem Lifespan der App, also bevor deren Port offen ist."""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2) as client:
+        while True:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.2)
+
+
+async def send_burst(updates: List[Dict[str, Any]]) -> List[int]:
+    """Schickt alle Updates gleichzeitig an den registrierten Webhook; liefert die HTTP-Status."""
+    headers = {"X-Telegram-Bot-Api-Secret-Token": webhook["secret"] or ""}
+    async with httpx.AsyncClient(timeout=30) as client:
+        responses = await asyncio.gather(
+            *(client.post(webhook["url"], json=u, headers=headers) for u in updates)
+        )
+    return [r.status_code for r in responses]
+
+
+async def main(port: int, count: int, chat_id: int, chats: int, wait: float) -> None:
+    server = uvicorn.Server(uvicorn.Config(fake, host="127.0.0.1", port=port, log_level="warning"))
+    serve = asyncio.create_task(server.serve())
+    print(f"🤖 Fake Bot API auf http://127.0.0.1:{port}, warte auf setWebhook …")
+    await webhook_set.wait()
+    await wait_reachable(webhook["url"])
+
+    updates = [
+        text_update(1000 + i, chat_id + i % chats, f"Nachricht {i}")
+        for i in range(count)
+    ]
+    start = time.monotonic()
+    statuses = await send_burst(updates)
+    print(f"📨 {count} Updates an {webhook['url']} in {time.monotonic() - start:.3f}s angenommen: {statuses}")
+
+    await asyncio.sleep(wait)
+    for call in calls:
+        if call["method"] in ("sendMessage", "sendPhoto", "sendDocument", "sendVoice"):
+            text = json.dumps(call["params"].get("text") or call["params"].get("caption", ""), ensure_ascii=False)
+            print(f"  +{call['at'] - start:6.2f}s {call['method']} → {call['params'].get('chat_id')}: {text[:60]}")
+    server.should_exit = True
+    await serve
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--count", type=int, default=10, help="Anzahl Updates im Burst")
+    parser.add_argument("--chat", type=int, default=12345, help="Chat-/Nutzer-ID (= ALLOWED_TELEGRAM_ID)")
+    parser.add_argument("--chats", type=int, default=1, help="Updates auf so viele Chats verteilen")
+    parser.add_argument("--wait", type=float, default=15.0, help="Sekunden auf Antworten warten")
+    args = parser.parse_args()
+    asyncio.run(main(args.port, args.count, args.chat, args.chats, args.wait))
@@ -6,7 +6,8 @@ const calendarPanel = document.getElementById('calendar-panel');
 const chatPanel = document.getElementById('chat-panel');
 const toastContainer = document.getElementById('toast-container');
 
-let isProcessing = false, lastHistoryJSON = "";
+let isProcessing = false, lastMessageId = 0, historyETag = null;
+let eventSource = null, eventsConnected = false;
 let currDate = new Date(), viewYear = currDate.getFullYear(), viewMonth = currDate.getMonth();
 let currentMonthEvents = [];
 let allEvents = [];
@@ -18,6 +19,7 @@ let showCmdDropdown = false;
 const commands = [
     { name: '/heute', desc: 'Termine von heute', action: 'cmd' },
     { name: '/woche', desc: 'Termine diese Woche', action: 'cmd' },
+    { name: '/notizen', desc: 'Notizen anzeigen', action: 'cmd' },
     { name: '/kalender', desc: 'Zum aktuellen Monat', action: 'cmd' },
     { name: '/export', desc: 'Chat exportieren', action: 'cmd' },
     { name: '/tts', desc: 'Letzte Antwort vorlesen', action: 'cmd' },
@@ -65,7 +67,6 @@ function executeCommand(cmdName) {
     switch(cmdName) {
         case '/clear':
             chatBox.innerHTML = '';
-            lastHistoryJSON = '';
             showToast('Chat geleert', 'success');
             break;
         case '/kalender':
@@ -88,6 +89,7 @@ function executeCommand(cmdName) {
             break;
         case '/heute':
         case '/woche':
+        case '/notizen':
             userInput.value = cmdName + ' ';
             userInput.focus();
             break;
@@ -518,6 +520,40 @@ function appendMessage(role, text) {
     }
     
     chatBox.appendChild(d);
+    return d;
+}
+
+function setMessageText(msgEl, text) {
+    const actions = msgEl.querySelector('.message-actions');
+    msgEl.innerHTML = renderMarkdown(text);
+    if (actions) msgEl.appendChild(actions);
+}
+
+async function streamChat(message) {
+    const res = await fetch('/chat/stream', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ message }) });
+    if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+    const reader = res.body.getReader(), decoder = new TextDecoder();
+    let buffer = '', text = '', bubble = null;
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const ev of events) {
+            if (!ev.startsWith('data: ')) continue;
+            const data = JSON.parse(ev.slice(6));
+            if (!bubble) {
+                removeTypingIndicator();
+                bubble = appendMessage('assistant', '');
+                bubble.classList.add('pending');
+            }
+            text = data.done ? data.content : text + data.delta;
+            setMessageText(bubble, text);
+            chatBox.scrollTop = chatBox.scrollHeight;
+        }
+    }
 }
 
 function appendTypingIndicator() {
@@ -534,24 +570,45 @@ function removeTypingIndicator() {
     if (l) l.remove();
 }
 
-async function refreshChat() {
-    if (isProcessing) return;
-    try {
-        const h = await (await fetch('/history')).json(), cJSON = JSON.stringify(h);
-        if (cJSON !== lastHistoryJSON) {
-            const isAtBottom = chatBox.scrollHeight - chatBox.clientHeight <= chatBox.scrollTop + 50;
+function appendHistoryRows(rows) {
+    const fresh = rows.filter(m => m.id > lastMessageId);
+    if (fresh.length === 0) return;
+    const isAtBottom = chatBox.scrollHeight - chatBox.clientHeight <= chatBox.scrollTop + 50;
+
+    fresh.forEach(m => {
+        const el = appendMessage(m.role, m.content);
+        // Optimistisch angezeigte Nachricht (gleiche Rolle) durch die gespeicherte ersetzen
+        const pending = chatBox.querySelector(`.message.pending.${el.classList.contains('bot') ? 'bot' : 'user'}`);
+        if (pending) pending.replaceWith(el);
+        lastMessageId = m.id;
+    });
 
-            chatBox.innerHTML = '';
-            h.forEach(m => appendMessage(m.role, m.content));
-            lastHistoryJSON = cJSON;
+    if (isAtBottom) chatBox.scrollTop = chatBox.scrollHeight;
+    loadCalendar();
+    loadNotes();
+}
 
-            if (isAtBottom) chatBox.scrollTop = chatBox.scrollHeight;
-            loadCalendar();
-            loadNotes();
-        }
+async function refreshChat() {
+    try {
+        const headers = historyETag ? { 'If-None-Match': historyETag } : {};
+        const res = await fetch(`/history?since_id=${lastMessageId}`, { headers });
+        if (res.status === 304 || !res.ok) return;
+        historyETag = res.headers.get('ETag');
+        appendHistoryRows(await res.json());
     } catch { }
 }
 
+function connectEvents() {
+    if (!window.EventSource) return;
+    eventSource = new EventSource(`/events?since_id=${lastMessageId}`);
+    eventSource.onopen = () => { eventsConnected = true; };
+    // Bei Verbindungsabbruch verbindet sich der Browser selbst neu (Last-Event-ID), bis dahin wird gepollt
+    eventSource.onerror = () => { eventsConnected = false; };
+    eventSource.addEventListener('chat', e => appendHistoryRows([JSON.parse(e.data)]));
+    eventSource.addEventListener('notes', () => loadNotes());
+    eventSource.addEventListener('resync', () => refreshChat());
+}
+
 async function sendMessage() {
     const rawInput = userInput.value;
     const m = rawInput.trim(); 
@@ -561,13 +618,12 @@ async function sendMessage() {
     isProcessing = true; 
     userInput.value = '';
     updateActionButton();
-    appendMessage('user', m);
+    appendMessage('user', m).classList.add('pending');
     chatBox.scrollTop = chatBox.scrollHeight;
     appendTypingIndicator();
 
     try { 
-        await fetch('/chat', { method: 'POST', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ message: m }) }); 
-        await refreshChat(); 
+        await streamChat(m);
         showToast('Nachricht gesendet', 'success');
     }
     catch (e) { 
@@ -1048,6 +1104,8 @@ async function toggleSpeechRecognition() {
 
 loadCalendar(); 
 loadNotes();
-setInterval(refreshChat, 3000); 
+refreshChat().then(connectEvents);
+// Polling nur als Fallback, solange der Push-Kanal nicht verbunden ist
+setInterval(() => { if (!eventsConnected) refreshChat(); }, 3000); 
 setInterval(loadCalendar, 30000);
 
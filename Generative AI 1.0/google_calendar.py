@@ -9,24 +9,80 @@ if sys.platform.startswith("win"):
 import os.path
 import datetime
 import re
+import threading
+import time
+import httplib2
+import google_auth_httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
 from google.auth.exceptions import RefreshError
+import calendar_mirror
+from database import get_table_version
+from response_cache import TTLCache
+from tracing import span
 
 SCOPES = ["https://www.googleapis.com/auth/calendar.events"]
 TIMEZONE = os.getenv("TIMEZONE", "Europe/Berlin")
+# Token wird so lange vor Ablauf erneuert, damit kein Request in einen 401 läuft
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
 
+_service = None
+_creds = None
+_service_lock = threading.Lock()
+_thread_local = threading.local()
+_sync_lock = threading.Lock()
 
-def get_calendar_service():
+# Lesezugriffe synchronisieren den lokalen Spiegel höchstens so oft (Sekunden)
+CALENDAR_SYNC_INTERVAL = float(os.getenv("CALENDAR_SYNC_INTERVAL", "60"))
+# Zeitraum der Erstsynchronisation in die Vergangenheit
+CALENDAR_SYNC_PAST_DAYS = 365
+
+# get_events-Texte je Zeitraum, gültig bis zur nächsten Änderung am Spiegel (Version im Schlüssel).
+# Die TTL begrenzt relative Zeiträume ("nächste 7 Tage"), die mit der Uhr weiterwandern.
+_events_cache = TTLCache(maxsize=64, ttl=CALENDAR_SYNC_INTERVAL)
+
+
+def _thread_http():
+    # httplib2 ist nicht thread-safe: jeder Worker-Thread bekommt seine eigene Verbindung
+    http = getattr(_thread_local, "http", None)
+    if http is None or http.credentials is not _creds:
+        http = google_auth_httplib2.AuthorizedHttp(_creds, http=httplib2.Http())
+        _thread_local.http = http
+    return http
+
+
+class _TracedRequest(HttpRequest):
+    def execute(self, *args, **kwargs):
+        with span(f"gcal.{self.methodId}"):
+            return super().execute(*args, **kwargs)
+
+
+def _build_request(http, *args, **kwargs):
+    return _TracedRequest(_thread_http(), *args, **kwargs)
+
+
+def _save_token(creds) -> None:
+    with open("token.json", "w") as token:
+        token.write(creds.to_json())
+
+
+def _needs_refresh(creds) -> bool:
+    if not creds.expiry:
+        return False
+    return datetime.datetime.utcnow() >= creds.expiry - TOKEN_REFRESH_MARGIN
+
+
+def _load_credentials():
     creds = None
     if os.path.exists("token.json"):
         creds = Credentials.from_authorized_user_file("token.json", SCOPES)
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+    if not creds or not creds.valid or _needs_refresh(creds):
+        if creds and creds.refresh_token and (creds.expired or _needs_refresh(creds)):
             try:
                 creds.refresh(Request())
             except RefreshError:
@@ -34,7 +90,7 @@ def get_calendar_service():
                     os.remove("token.json")
                 creds = None
 
-        if not creds:
+        if not creds or not creds.valid:
             if not os.path.exists("credentials.json"):
                 return None
             try:
@@ -44,109 +100,229 @@ def get_calendar_service():
                 print(f"❌ Autorisierungsfehler: Kein Browser verfügbar oder OAuth fehlgeschlagen: {e}")
                 return None
 
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
+        _save_token(creds)
 
-    return build("calendar", "v3", credentials=creds)
+    return creds
 
 
-def add_event(
+def reset_calendar_service() -> None:
+    global _service, _creds
+    with _service_lock:
+        _service = None
+        _creds = None
+
+
+def get_calendar_service():
+    """
+    Liefert den prozessweit gecachten Calendar-Service. Er wird einmalig mit
+    dem statischen Discovery-Dokument gebaut; das Token wird vor Ablauf
+    proaktiv erneuert.
+    """
+    global _service, _creds
+    with _service_lock:
+        if _service is not None and _creds.valid and not _needs_refresh(_creds):
+            return _service
+
+        if _creds is not None and _creds.refresh_token:
+            try:
+                _creds.refresh(Request())
+                _save_token(_creds)
+                return _service
+            except RefreshError:
+                if os.path.exists("token.json"):
+                    os.remove("token.json")
+                _service = None
+                _creds = None
+
+        creds = _load_credentials()
+        if not creds:
+            return None
+        _creds = creds
+        _service = build(
+            "calendar",
+            "v3",
+            credentials=creds,
+            requestBuilder=_build_request,
+            static_discovery=True,
+            cache_discovery=False,
+        )
+        return _service
+
+
+def _event_body(
     summary: str,
     start_time: str,
     end_time: str = None,
     description: str = "",
     location: str = "",
-) -> str:
-    service = get_calendar_service()
-    if not service:
-        return "Fehler: Kein Kalender-Service."
-
+) -> dict:
     start_dt = datetime.datetime.fromisoformat(start_time.replace("Z", "+00:00"))
     end_dt = (
         start_dt + datetime.timedelta(hours=1)
         if not end_time
         else datetime.datetime.fromisoformat(end_time.replace("Z", "+00:00"))
     )
-
-    event = {
+    return {
         "summary": summary,
         "location": location,
         "description": description,
         "start": {"dateTime": start_dt.isoformat(), "timeZone": TIMEZONE},
         "end": {"dateTime": end_dt.isoformat(), "timeZone": TIMEZONE},
     }
+
+
+def _edit_body(new_summary: str = None, new_start_time: str = None) -> dict:
+    body = {}
+    if new_summary:
+        body["summary"] = new_summary
+    if new_start_time:
+        start_dt = datetime.datetime.fromisoformat(new_start_time.replace("Z", "+00:00"))
+        body["start"] = {"dateTime": start_dt.isoformat(), "timeZone": TIMEZONE}
+        body["end"] = {
+            "dateTime": (start_dt + datetime.timedelta(hours=1)).isoformat(),
+            "timeZone": TIMEZONE,
+        }
+    return body
+
+
+def add_event(
+    summary: str,
+    start_time: str,
+    end_time: str = None,
+    description: str = "",
+    location: str = "",
+) -> str:
+    service = get_calendar_service()
+    if not service:
+        return "Fehler: Kein Kalender-Service."
+
     try:
+        event = _event_body(summary, start_time, end_time, description, location)
         res = service.events().insert(calendarId="primary", body=event).execute()
+        calendar_mirror.upsert_event(res, TIMEZONE)
         return f"Erfolgreich hinzugefügt (Link: {res.get('htmlLink')})"
     except HttpError as e:
         return f"Google API Fehler ({e.resp.status}): {e.reason}"
     except RefreshError:
+        reset_calendar_service()
         return "Fehler: Die Google-Sitzung ist abgelaufen. Bitte authentifizieren Sie sich erneut."
     except Exception as e:
         return f"Unerwarteter Fehler: {e}"
 
 
+def _utc(dt: datetime.datetime) -> str:
+    return dt.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def sync_events(force_full: bool = False) -> bool:
+    """
+    Gleicht den lokalen Spiegel (Tabelle calendar_events) mit Google ab.
+    Mit vorhandenem syncToken werden nur Änderungen seit dem letzten Abgleich
+    geladen; ist der Token abgelaufen (HTTP 410), folgt eine Vollsynchronisation.
+    """
+    service = get_calendar_service()
+    if not service:
+        return False
+
+    with _sync_lock:
+        sync_token, _ = calendar_mirror.get_sync_state()
+        full = force_full or not sync_token
+        params = {"calendarId": "primary", "singleEvents": True, "maxResults": 2500}
+        if full:
+            time_min = datetime.datetime.utcnow() - datetime.timedelta(days=CALENDAR_SYNC_PAST_DAYS)
+            params["timeMin"] = time_min.isoformat() + "Z"
+        else:
+            params["syncToken"] = sync_token
+            params["showDeleted"] = True
+
+        items, page_token = [], None
+        try:
+            while True:
+                resp = service.events().list(pageToken=page_token, **params).execute()
+                items.extend(resp.get("items", []))
+                page_token = resp.get("nextPageToken")
+                if not page_token:
+                    break
+        except HttpError as e:
+            if e.resp.status != 410 or full:
+                raise
+            print("🔄 Kalender-syncToken abgelaufen, starte Vollsynchronisation.")
+        else:
+            calendar_mirror.apply_sync(items, resp.get("nextSyncToken"), full, TIMEZONE)
+            return True
+
+    return sync_events(force_full=True)
+
+
+def _ensure_synced() -> None:
+    _, synced_at = calendar_mirror.get_sync_state()
+    if time.time() - synced_at < CALENDAR_SYNC_INTERVAL:
+        return
+    try:
+        sync_events()
+    except Exception as e:
+        # Ohne Verbindung wird aus dem (ggf. veralteten) Spiegel gelesen
+        if not synced_at:
+            raise
+        print(f"⚠️ Kalender-Sync fehlgeschlagen, nutze lokalen Stand: {e}")
+
+
 def get_events(days: int = 7, specific_date: str = None) -> str:
     service = get_calendar_service()
     if not service:
         return "Fehler: Kein Service."
     try:
+        # Ein fälliger Sync mit Änderungen erhöht die Version und verfehlt damit den Cache
+        _ensure_synced()
+        key = (days, specific_date, get_table_version(calendar_mirror.EVENTS_TABLE))
+        cached = _events_cache.get(key)
+        if cached is not None:
+            return cached
         now = datetime.datetime.utcnow()
         if specific_date:
             target_date = datetime.datetime.strptime(specific_date, "%Y-%m-%d")
-            time_min = target_date.isoformat() + "Z"
-            time_max = (target_date + datetime.timedelta(days=1)).isoformat() + "Z"
+            time_min = _utc(target_date)
+            time_max = _utc(target_date + datetime.timedelta(days=1))
             label = f"am {specific_date}"
         else:
-            time_min = (
-                now.isoformat() + "Z"
-                if days >= 0
-                else (now + datetime.timedelta(days=days)).isoformat() + "Z"
-            )
-            time_max = (
-                (now + datetime.timedelta(days=days)).isoformat() + "Z"
-                if days >= 0
-                else now.isoformat() + "Z"
-            )
+            time_min = _utc(now if days >= 0 else now + datetime.timedelta(days=days))
+            time_max = _utc(now + datetime.timedelta(days=days) if days >= 0 else now)
             label = (
                 f"nächsten {days} Tage" if days >= 0 else f"letzten {abs(days)} Tage"
             )
 
-        events_result = (
-            service.events()
-            .list(
-                calendarId="primary",
-                timeMin=time_min,
-                timeMax=time_max,
-                singleEvents=True,
-                orderBy="startTime",
-            )
-            .execute()
-        )
-        events = events_result.get("items", [])
+        events = calendar_mirror.query_events(time_min, time_max)
         if not events:
-            return f"Keine Termine {label} gefunden."
-
-        lines = [f"📅 **Termine {label}:**"]
-        for event in events:
-            start = event["start"].get("dateTime", event["start"].get("date"))
-            lines.append(
-                f"• {start[:10]} {start[11:16] if 'T' in start else ''}: {event.get('summary', 'Ohne Titel')}"
-            )
-        return "\n".join(lines)
+            text = f"Keine Termine {label} gefunden."
+        else:
+            lines = [f"📅 **Termine {label}:**"]
+            for event in events:
+                start = event["start"]
+                lines.append(
+                    f"• {start[:10]} {start[11:16] if 'T' in start else ''}: {event['summary']}"
+                )
+            text = "\n".join(lines)
+        _events_cache.put(key, text)
+        return text
     except HttpError as e:
         return f"Google API Fehler ({e.resp.status}): {e.reason}"
     except RefreshError:
+        reset_calendar_service()
         return "Fehler: Die Google-Sitzung ist abgelaufen. Bitte authentifizieren Sie sich erneut."
     except Exception as e:
         return f"Unerwarteter Fehler: {e}"
 
 
+def events_cache_stats() -> dict:
+    return _events_cache.stats()
+
+
 def get_events_json(year: int = None, month: int = None) -> list:
     service = get_calendar_service()
     if not service:
         return []
     try:
+        _ensure_synced()
         now = datetime.datetime.utcnow()
         y = year or now.year
         m = month or now.month
@@ -158,61 +334,40 @@ def get_events_json(year: int = None, month: int = None) -> list:
             else datetime.datetime(y, m + 1, 1)
         )
 
-        events_result = (
-            service.events()
-            .list(
-                calendarId="primary",
-                timeMin=start_date.isoformat() + "Z",
-                timeMax=end_date.isoformat() + "Z",
-                singleEvents=True,
-                orderBy="startTime",
-            )
-            .execute()
-        )
-
-        result = []
-        for event in events_result.get("items", []):
-            start = event["start"].get("dateTime", event["start"].get("date"))
-            result.append(
-                {"summary": event.get("summary", "Ohne Titel"), "start": start}
-            )
-        return result
+        return [
+            {"summary": e["summary"], "start": e["start"]}
+            for e in calendar_mirror.query_events(_utc(start_date), _utc(end_date))
+        ]
     except Exception:
         return []
 
 
-def find_event_ids(summary: str, date_str: str = "") -> list:
-    service = get_calendar_service()
+def _search_key(summary: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9]", "", summary.lower())
+
+
+def find_event_ids(summary: str, date_str: str = "", service=None) -> list:
+    service = service or get_calendar_service()
     if not service:
         return []
     try:
+        _ensure_synced()
         if date_str:
             day_prefix = date_str[:10]
             target_date = datetime.datetime.strptime(day_prefix, "%Y-%m-%d")
-            time_min = (target_date - datetime.timedelta(days=1)).isoformat() + "Z"
-            time_max = (target_date + datetime.timedelta(days=2)).isoformat() + "Z"
+            time_min = _utc(target_date - datetime.timedelta(days=1))
+            time_max = _utc(target_date + datetime.timedelta(days=2))
         else:
             now = datetime.datetime.utcnow()
-            time_min = now.isoformat() + "Z"
-            time_max = (now + datetime.timedelta(days=30)).isoformat() + "Z"
+            time_min = _utc(now)
+            time_max = _utc(now + datetime.timedelta(days=30))
 
-        events_result = (
-            service.events()
-            .list(
-                calendarId="primary",
-                timeMin=time_min,
-                timeMax=time_max,
-                singleEvents=True,
-                orderBy="startTime",
-            )
-            .execute()
-        )
-        search_term = re.sub(r"[^a-zA-Z0-9]", "", summary.lower())
+        search_term = _search_key(summary)
 
         return [
             e["id"]
-            for e in events_result.get("items", [])
-            if search_term in re.sub(r"[^a-zA-Z0-9]", "", e.get("summary", "").lower())
+            for e in calendar_mirror.query_events(time_min, time_max)
+            if search_term in _search_key(e["summary"])
         ]
     except Exception:
         return []
@@ -222,7 +377,7 @@ def delete_event(summary: str, date_str: str = "") -> str:
     service = get_calendar_service()
     if not service:
         return "Fehler: Kein Service."
-    event_ids = find_event_ids(summary, date_str)
+    event_ids = find_event_ids(summary, date_str, service=service)
     if not event_ids:
         return f"Fehler: Termin '{summary}' nicht gefunden."
 
@@ -230,6 +385,7 @@ def delete_event(summary: str, date_str: str = "") -> str:
     for e_id in event_ids:
         try:
             service.events().delete(calendarId="primary", eventId=e_id).execute()
+            calendar_mirror.remove_event(e_id)
             count += 1
         except Exception:
             pass
@@ -245,35 +401,163 @@ def edit_event(
     service = get_calendar_service()
     if not service:
         return "Fehler: Kein Service."
-    event_ids = find_event_ids(old_summary, old_date_str)
+    event_ids = find_event_ids(old_summary, old_date_str, service=service)
     if not event_ids:
         return f"Fehler: Termin '{old_summary}' nicht gefunden."
 
     try:
-        event = (
-            service.events().get(calendarId="primary", eventId=event_ids[0]).execute()
-        )
-        if new_summary:
-            event["summary"] = new_summary
-        if new_start_time:
-            start_dt = datetime.datetime.fromisoformat(
-                new_start_time.replace("Z", "+00:00")
-            )
-            event["start"] = {"dateTime": start_dt.isoformat(), "timeZone": TIMEZONE}
-            event["end"] = {
-                "dateTime": (start_dt + datetime.timedelta(hours=1)).isoformat(),
-                "timeZone": TIMEZONE,
-            }
-
+        # patch statt get + update: ein Round-Trip weniger
         res = (
             service.events()
-            .update(calendarId="primary", eventId=event_ids[0], body=event)
+            .patch(
+                calendarId="primary",
+                eventId=event_ids[0],
+                body=_edit_body(new_summary, new_start_time),
+            )
             .execute()
         )
+        calendar_mirror.upsert_event(res, TIMEZONE)
         return f"Aktualisiert (Link: {res.get('htmlLink')})"
     except HttpError as e:
         return f"Google API Fehler ({e.resp.status}): {e.reason}"
     except RefreshError:
+        reset_calendar_service()
         return "Fehler: Die Google-Sitzung ist abgelaufen. Bitte authentifizieren Sie sich erneut."
     except Exception as e:
         return f"Unerwarteter Fehler: {e}"
+
+
+# Google akzeptiert höchstens 50 Einzelanfragen pro Batch-Request
+BATCH_LIMIT = 50
+
+
+def _error_text(e: Exception) -> str:
+    if isinstance(e, HttpError) and e.resp is not None:
+        return f"Google API Fehler ({e.resp.status}): {e.reason}"
+    return f"Unerwarteter Fehler: {e}"
+
+
+def execute_batch(operations: list) -> list:
+    """
+    Führt mehrere Kalender-Mutationen gesammelt über den Batch-Endpunkt aus.
+    `operations` ist eine Liste von (action, kwargs) mit action in add/delete/edit
+    und den Keyword-Argumenten von add_event/delete_event/edit_event.
+    Alle Termin-Suchen laufen gegen den lokalen Spiegel (ein Sync vorab).
+    Bezieht sich ein delete/edit auf einen Titel, den eine frühere Operation
+    derselben Liste anlegt, ändert oder löscht ("add X, dann edit X"), werden
+    die bisherigen Requests zuerst gesendet; die Suche sieht dann deren Ergebnis.
+    Liefert pro Operation den Ergebnistext in derselben Reihenfolge. Bricht ein
+    Chunk ohne Antwort ab, gelten dessen Operationen als "Status unbekannt"
+    (Google kann sie ausgeführt haben), spätere Chunks als nicht ausgeführt.
+    """
+    service = get_calendar_service()
+    if not service:
+        return ["Fehler: Kein Kalender-Service."] * len(operations)
+
+    results = [None] * len(operations)
+    delete_counts = {}
+    requests = []  # (operation_index, action, event_id, request)
+    answered = set()  # Request-Indizes mit Antwort (Erfolg oder Fehler)
+    in_flight = range(0)  # Requests des gerade gesendeten Chunks
+    sent = 0  # Requests davor sind bereits gesendet
+    touched = []  # Suchschlüssel der Titel, die noch ungesendete Requests betreffen
+    failure = None
+
+    def on_response(request_id, response, exception):
+        answered.add(int(request_id))
+        i, action, event_id, _ = requests[int(request_id)]
+        if exception is not None:
+            if action != "delete":
+                results[i] = _error_text(exception)
+            return
+        if action == "delete":
+            calendar_mirror.remove_event(event_id)
+            delete_counts[i] += 1
+        else:
+            calendar_mirror.upsert_event(response, TIMEZONE)
+            label = "Erfolgreich hinzugefügt" if action == "add" else "Aktualisiert"
+            results[i] = f"{label} (Link: {response.get('htmlLink')})"
+
+    def flush():
+        nonlocal in_flight, sent
+        for offset in range(sent, len(requests), BATCH_LIMIT):
+            in_flight = range(offset, min(offset + BATCH_LIMIT, len(requests)))
+            batch = service.new_batch_http_request(callback=on_response)
+            for n in in_flight:
+                batch.add(requests[n][3], request_id=str(n))
+            with span("gcal.batch"):
+                batch.execute()
+        in_flight = range(0)
+        sent = len(requests)
+        touched.clear()
+
+    def depends(summary: str) -> bool:
+        key = _search_key(summary)
+        return bool(key) and any(key in name or name in key for name in touched)
+
+    try:
+        _ensure_synced()
+        for i, (action, kwargs) in enumerate(operations):
+            target = kwargs.get("summary" if action == "delete" else "old_summary", "")
+            if action in ("delete", "edit") and depends(target):
+                # Abhängig von einer noch nicht gesendeten Operation: erst diese ausführen
+                flush()
+            names = [kwargs.get("summary", "")] if action != "edit" else [target, kwargs.get("new_summary") or ""]
+            touched.extend(_search_key(name) for name in names if _search_key(name))
+            try:
+                if action == "add":
+                    body = _event_body(**kwargs)
+                    requests.append(
+                        (i, action, None, service.events().insert(calendarId="primary", body=body))
+                    )
+                elif action == "delete":
+                    event_ids = find_event_ids(kwargs["summary"], kwargs.get("date_str", ""), service=service)
+                    if not event_ids:
+                        results[i] = f"Fehler: Termin '{kwargs['summary']}' nicht gefunden."
+                        continue
+                    delete_counts[i] = 0
+                    for e_id in event_ids:
+                        requests.append(
+                            (i, action, e_id, service.events().delete(calendarId="primary", eventId=e_id))
+                        )
+                elif action == "edit":
+                    event_ids = find_event_ids(
+                        kwargs["old_summary"], kwargs.get("old_date_str", ""), service=service
+                    )
+                    if not event_ids:
+                        results[i] = f"Fehler: Termin '{kwargs['old_summary']}' nicht gefunden."
+                        continue
+                    body = _edit_body(kwargs.get("new_summary"), kwargs.get("new_start_time"))
+                    requests.append(
+                        (
+                            i,
+                            action,
+                            event_ids[0],
+                            service.events().patch(calendarId="primary", eventId=event_ids[0], body=body),
+                        )
+                    )
+                else:
+                    results[i] = f"Fehler: Unbekannte Aktion '{action}'."
+            except Exception as e:
+                results[i] = _error_text(e)
+        flush()
+    except RefreshError:
+        reset_calendar_service()
+        # Token-Erneuerung scheitert vor dem Senden: nichts wurde ausgeführt
+        in_flight = range(0)
+        failure = "Fehler: Die Google-Sitzung ist abgelaufen. Bitte authentifizieren Sie sich erneut."
+    except Exception as e:
+        failure = _error_text(e)
+
+    # Antwort verloren: Google hat die Requests des laufenden Chunks evtl. schon ausgeführt
+    unknown = {requests[n][0] for n in in_flight if n not in answered}
+    for i in unknown:
+        results[i] = f"Status unbekannt ({failure}), bitte im Kalender prüfen."
+    for i, count in delete_counts.items():
+        if i in unknown:
+            continue
+        if all(n in answered for n, req in enumerate(requests) if req[0] == i):
+            results[i] = f"Erfolgreich gelöscht: {count} Termin(e)."
+        elif count:
+            results[i] = f"Teilweise gelöscht: {count} Termin(e), Rest nicht ausgeführt ({failure})."
+    return [r or failure or "Fehler: Keine Antwort von Google erhalten." for r in results]
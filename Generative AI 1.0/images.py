@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from tracing import span
+
+IMAGE_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_SIZE", "32"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+# (längste Seite, kürzeste Seite) in Pixeln, ab der die Anbieter ohnehin herunterskalieren.
+# OpenAI (detail=high): erst auf 2048² einpassen, dann kürzeste Seite 768 px.
+# Gemini rechnet in 768er-Kacheln; mehr als eine Kachelreihe bringt für Fotos kaum etwas.
+PROVIDER_LIMITS: Dict[str, Tuple[int, int]] = {
+    "OpenAI": (2048, 768),
+    "Gemini": (1536, 768),
+}
+DEFAULT_LIMITS = (1536, 768)
+
+# Erkennung über die Dateisignatur, falls Pillow das Format nicht öffnen kann
+MAGIC = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"RIFF", "image/webp"),
+]
+PIL_MIME = {"JPEG": "image/jpeg", "PNG": "image/png", "GIF": "image/gif", "WEBP": "image/webp"}
+
+
+def sniff_mime(data: bytes) -> str:
+    for signature, mime in MAGIC:
+        if data.startswith(signature):
+            if mime == "image/webp" and data[8:12] != b"WEBP":
+                continue
+            return mime
+    if data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return "image/jpeg"
+
+
+class PreparedImage:
+    def __init__(self, data: bytes, mime: str, width: int = 0, height: int = 0, source_mime: str = ""):
+        self.data = data
+        self.mime = mime
+        self.width = width
+        self.height = height
+        self.source_mime = source_mime or mime
+
+
+def _target_size(width: int, height: int, limits: Tuple[int, int]) -> Tuple[int, int]:
+    max_long, max_short = limits
+    scale = min(1.0, max_long / max(width, height), max_short / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _process(data: bytes, limits: Tuple[int, int]) -> PreparedImage:
+    try:
+        return _reencode(data, limits)
+    except Exception:
+        # Unbekanntes oder beschädigtes Format (z.B. HEIC ohne Plugin): unverändert, aber korrekt deklariert
+        mime = sniff_mime(data)
+        return PreparedImage(data, mime, source_mime=mime)
+
+
+def _reencode(data: bytes, limits: Tuple[int, int]) -> PreparedImage:
+    """Dekodieren, ausrichten, verkleinern und ohne Metadaten als JPEG neu kodieren."""
+    img = Image.open(io.BytesIO(data))
+    source_mime = PIL_MIME.get(img.format, sniff_mime(data))
+    # JPEG direkt in 1/2, 1/4 oder 1/8 dekodieren, wenn das Ziel ohnehin kleiner ist
+    img.draft("RGB", _target_size(img.width, img.height, limits))
+    # Bei animierten GIFs nur das erste Bild; EXIF-Drehung anwenden, bevor EXIF wegfällt
+    img.seek(0)
+    img = ImageOps.exif_transpose(img)
+
+    size = _target_size(img.width, img.height, limits)
+    if img.mode in ("RGBA", "LA", "P"):
+        # Transparenz auf Weiß legen, JPEG kennt keinen Alphakanal
+        rgba = img.convert("RGBA")
+        img = Image.new("RGB", rgba.size, "white")
+        img.paste(rgba, mask=rgba.getchannel("A"))
+    elif img.mode != "RGB":
+        img = img.convert("RGB")
+    if size != img.size:
+        img = img.resize(size, Image.LANCZOS, reducing_gap=2.0)
+
+    out = io.BytesIO()
+    # Ohne exif=/icc_profile= schreibt Pillow keine Metadaten (GPS, Kameradaten)
+    img.save(out, "JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    return PreparedImage(out.getvalue(), "image/jpeg", img.width, img.height, source_mime)
+
+
+class ImageProcessor:
+    """
+    Bereitet Bilder vor dem Vision-Aufruf auf: echtes Format erkennen, auf die
+    Auflösung verkleinern, die der Anbieter ohnehin verwendet, Metadaten
+    entfernen und neu kodieren. Ergebnisse werden pro Inhalts-Hash und
+    Auflösung zwischengespeichert; gleichzeitige Anfragen für dasselbe Bild
+    (z.B. gehedgte Aufrufe) teilen sich eine Verarbeitung.
+    """
+
+    def __init__(self, cache_size: int = IMAGE_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, Tuple[int, int]], PreparedImage]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, Tuple[int, int]], asyncio.Future] = {}
+        self.processed = 0
+        self.cache_hits = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._latencies = deque(maxlen=200)
+
+    async def prepare(self, data: Optional[bytes], provider: str = "") -> Optional[PreparedImage]:
+        if not data:
+            return None
+        limits = PROVIDER_LIMITS.get(provider, DEFAULT_LIMITS)
+        key = (hashlib.sha256(data).hexdigest(), limits)
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+            return cached
+        if key in self._inflight:
+            self.cache_hits += 1
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            start = time.perf_counter()
+            with span("images.prepare"):
+                image = await asyncio.to_thread(_process, data, limits)
+            self._latencies.append(time.perf_counter() - start)
+            self.processed += 1
+            self.bytes_in += len(data)
+            self.bytes_out += len(image.data)
+            self._cache[key] = image
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            future.set_result(image)
+            return image
+        except Exception as e:
+            future.set_exception(e)
+            # Evtl. wartet niemand: Exception nicht als "never retrieved" melden
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._inflight[key]
+
+    def stats(self) -> Dict:
+        ordered = sorted(self._latencies)
+        return {
+            "processed": self.processed,
+            "cache_hits": self.cache_hits,
+            "cached": len(self._cache),
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1) if ordered else 0.0,
+        }
+
+
+processor = ImageProcessor()
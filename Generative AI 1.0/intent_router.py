@@ -0,0 +1,194 @@
+import asyncio
+import datetime
+import os
+import re
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
+
+from action_blocks import CALENDAR_TAG, NOTE_TAG
+from calendar_utils import process_calendar_blocks
+from notepad_utils import process_note_blocks
+from response_cache import normalize_message
+
+INTENT_ROUTER = os.getenv("INTENT_ROUTER", "1") == "1"
+# Längere Nachrichten sind nie ein einfaches Kommando
+ROUTER_MAX_LENGTH = 300
+
+
+class Route:
+    """Erkanntes Kommando als Felder eines Aktionsblocks (wie vom LLM erzeugt)."""
+
+    def __init__(self, intent: str, tag: str, fields: Dict[str, str]):
+        self.intent = intent
+        self.tag = tag
+        self.fields = fields
+
+    @property
+    def block(self) -> str:
+        return "\n".join(f"{k}: {v}" for k, v in self.fields.items())
+
+
+def _notes_list(_=None) -> Route:
+    return Route("notes.list", NOTE_TAG, {"action": "list"})
+
+
+def _notes_delete(match: re.Match) -> Route:
+    return Route("notes.delete", NOTE_TAG, {"action": "delete", "id": match.group("id") or match.group("id2")})
+
+
+def _notes_add(content: str) -> Optional[Route]:
+    # Blockfelder sind zeilenbasiert: Inhalt auf eine Zeile bringen
+    content = " ".join(content.split())
+    if not content:
+        return None
+    return Route("notes.add", NOTE_TAG, {"action": "add", "content": content})
+
+
+def _calendar_route(title: str) -> Route:
+    return Route("calendar.list", CALENDAR_TAG, {"action": "list", "title": title})
+
+
+def _period_title(period: str) -> Optional[str]:
+    """'heute' -> Datum, 'diese woche' -> '7', 'nachsten 3 tage' -> '3' (Titel eines list-Blocks)."""
+    offsets = {"heute": 0, "morgen": 1, "ubermorgen": 2}
+    if period in offsets:
+        return (datetime.date.today() + datetime.timedelta(days=offsets[period])).isoformat()
+    days = re.search(r"\d+", period)
+    if days:
+        return days.group() if 0 < int(days.group()) <= 365 else None
+    return "7"
+
+
+def _calendar_list(match: re.Match) -> Optional[Route]:
+    title = _period_title(match.groupdict().get("period") or "")
+    return _calendar_route(title) if title else None
+
+
+# Alle Muster beziehen sich auf den normalisierten Text (siehe response_cache.normalize_message):
+# Kleinbuchstaben, ohne Umlaute/Satzzeichen/Füllwörter, also "Lösche bitte Notiz 3!" -> "losche notiz 3".
+# Sie müssen die ganze Nachricht abdecken; "Zeig mir meine Notizen zum Urlaub" geht an das LLM.
+CAL_PERIOD = r"(?P<period>heute|morgen|ubermorgen|(?:in )?diese[rn]? woche|(?:in )?(?:den |die )?nachsten \d+ tagen?)"
+CAL_QUERY = (
+    r"(?:was (?:steht|habe ich|hab ich)|welche termine (?:habe ich|hab ich|stehen)|(?:habe|hab) ich"
+    r"|(?:zeig(?:e)? )?(?:mir )?(?:meine |die )?termine(?: fur| am)?)"
+)
+RULES: List[Tuple[Pattern, Callable[[re.Match], Optional[Route]]]] = [
+    (
+        re.compile(
+            r"(?:(?:zeig(?:e)?|liste) (?:mir )?(?:meine |alle |die )?notizen(?: an| auf)?"
+            r"|(?:meine |alle )?notizen(?: anzeigen| zeigen)?"
+            r"|welche notizen (?:habe ich|hab ich|gibt es)"
+            r"|was steht (?:auf|in) (?:meinem|dem) notizblock"
+            r"|(?:zeig(?:e)? )?(?:mir )?(?:meinen |den )?notizblock(?: an)?)"
+        ),
+        _notes_list,
+    ),
+    (
+        re.compile(
+            r"(?:(?:losche|loesche|entferne) (?:die )?notiz (?:nr |nummer |id )?(?P<id>\d+)"
+            r"|notiz (?:nr |nummer |id )?(?P<id2>\d+) (?:loschen|entfernen))"
+        ),
+        _notes_delete,
+    ),
+    (
+        re.compile(rf"{CAL_QUERY} {CAL_PERIOD}(?: an| vor| termine| so an| ansteht)?"),
+        _calendar_list,
+    ),
+    (re.compile(rf"{CAL_PERIOD} (?:an termine|termine)"), _calendar_list),
+    (re.compile(r"(?:zeig(?:e)? )?(?:mir )?(?:meine|alle) termine(?: an)?"), _calendar_list),
+]
+
+# Auf dem Originaltext, damit der Notizinhalt unverändert bleibt; der Doppelpunkt grenzt ihn eindeutig ab
+NOTE_ADD_RE = re.compile(
+    r"(?:notiere|notier|neue notiz|notiz hinzufügen|schreib(?:e)? auf)\s*:\s*(?P<content>.+)",
+    re.IGNORECASE | re.DOTALL,
+)
+# Slash-Kommandos aus dem Web-Frontend und von Telegram ("/heute@lumina_bot" in Gruppen)
+SLASH_RE = re.compile(r"/(?P<command>\w+)(?:@\w+)?(?:\s+(?P<args>.*))?", re.DOTALL)
+# Kommando -> (Route ohne Argumente, Route mit Argumenten); None = an das LLM
+SLASH_COMMANDS: Dict[str, Tuple[Callable[[], Optional[Route]], Callable[[str], Optional[Route]]]] = {
+    "heute": (lambda: _calendar_route(_period_title("heute")), lambda args: None),
+    "morgen": (lambda: _calendar_route(_period_title("morgen")), lambda args: None),
+    "woche": (lambda: _calendar_route("7"), lambda args: None),
+    "notizen": (_notes_list, lambda args: None),
+    "notiz": (lambda: None, _notes_add),
+}
+
+
+def match_intent(message: str) -> Optional[Route]:
+    """Eindeutiges Notiz-/Kalenderkommando oder None (dann entscheidet das LLM)."""
+    text = message.strip()
+    if not text or len(text) > ROUTER_MAX_LENGTH:
+        return None
+
+    slash = SLASH_RE.fullmatch(text)
+    if slash:
+        command = SLASH_COMMANDS.get(slash.group("command").lower())
+        if command is None:
+            return None
+        without_args, with_args = command
+        args = (slash.group("args") or "").strip()
+        return with_args(args) if args else without_args()
+
+    added = NOTE_ADD_RE.fullmatch(text)
+    if added:
+        return _notes_add(added.group("content"))
+
+    normalized = normalize_message(text)
+    for pattern, build in RULES:
+        match = pattern.fullmatch(normalized)
+        if match:
+            return build(match)
+    return None
+
+
+class IntentRouter:
+    """
+    Regelbasierter Schnellweg vor dem LLM: eindeutige Kommandos wie "Zeig mir
+    meine Notizen", "Lösche Notiz 3", "Was steht morgen an?" oder "/woche"
+    werden direkt über Notizblock bzw. Kalender-Spiegel ausgeführt, ohne
+    Kontextaufbau und ohne Modellaufruf. Die Regeln müssen die ganze Nachricht
+    abdecken; alles andere (Rückfragen, Bezüge auf den Verlauf, Termine
+    anlegen) geht wie bisher an das LLM.
+    """
+
+    def __init__(self, enabled: bool = INTENT_ROUTER):
+        self.enabled = enabled
+        self.routed: Counter = Counter()
+        self.fallbacks = 0
+        self._latencies = deque(maxlen=200)
+
+    def match(self, message: str) -> Optional[Route]:
+        if not self.enabled:
+            return None
+        route = match_intent(message)
+        if route is None:
+            self.fallbacks += 1
+        return route
+
+    async def execute(self, route: Route) -> str:
+        """Gleiche Ausführung (und gleiche Statustexte) wie für Blöcke aus einer KI-Antwort."""
+        start = time.perf_counter()
+        try:
+            if route.tag == NOTE_TAG:
+                return await process_note_blocks([route.block])
+            return await asyncio.to_thread(process_calendar_blocks, [route.block])
+        finally:
+            self._latencies.append(time.perf_counter() - start)
+            self.routed[route.intent] += 1
+
+    def stats(self) -> Dict:
+        ordered = sorted(self._latencies)
+        routed = sum(self.routed.values())
+        return {
+            "enabled": self.enabled,
+            "routed": routed,
+            "fallbacks": self.fallbacks,
+            "route_rate": round(routed / (routed + self.fallbacks), 3) if routed + self.fallbacks else 0.0,
+            "intents": dict(self.routed),
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1) if ordered else 0.0,
+        }
+
+
+router = IntentRouter()
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from database import (
+    claim_job,
+    enqueue_job,
+    finish_job,
+    get_job_counts,
+    next_job_due,
+    recover_jobs,
+    reschedule_job,
+    update_job_payload,
+)
+from tracing import observe
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# Obergrenze offener Jobs; darüber wartet enqueue() (Backpressure auf den Aufrufer)
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "100"))
+JOB_DRAIN_TIMEOUT = float(os.getenv("JOB_DRAIN_TIMEOUT", "30"))
+JOB_BACKOFF_BASE = 2.0
+JOB_BACKOFF_MAX = 300.0
+# Wie oft untätige Worker spätestens nachschauen (fällige Retries, Jobs anderer Worker-Prozesse)
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+
+Checkpoint = Callable[[Dict[str, Any]], Awaitable[None]]
+Handler = Callable[[Dict[str, Any], Checkpoint], Awaitable[None]]
+
+
+class JobQueue:
+    """
+    Persistente Hintergrund-Jobs in SQLite mit fester Worker-Anzahl.
+    Fehlgeschlagene Jobs werden mit exponentiellem Backoff erneut versucht,
+    jeder Lauf ist durch ein Timeout begrenzt (außer mit `bounded=False`,
+    dann begrenzt der Handler selbst). Handler können über
+    `checkpoint` ihren Zwischenstand sichern, damit ein Retry bereits
+    erledigte Schritte überspringt. Beim Beenden arbeiten die Worker die
+    fälligen Jobs noch bis zu `drain_timeout` Sekunden ab; der Rest bleibt
+    in der Tabelle und läuft beim nächsten Start weiter.
+    Mit mehreren Worker-Prozessen arbeitet nur der Leader Jobs ab; die übrigen
+    sind per `attach()` reine Produzenten und legen Jobs nur in der Tabelle ab.
+    """
+
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        timeout: float = JOB_TIMEOUT,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        limit: int = JOB_QUEUE_LIMIT,
+    ):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.limit = limit
+        self._handlers: Dict[str, Handler] = {}
+        self._unbounded: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._outstanding = 0
+        self._stopping = False
+        self._producer = False
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def register(self, kind: str, handler: Handler, bounded: bool = True) -> None:
+        self._handlers[kind] = handler
+        if not bounded:
+            self._unbounded.add(kind)
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def attach(self) -> None:
+        """Nur einreihen, nicht abarbeiten (Follower-Worker; der Leader holt die Jobs ab)."""
+        self._producer = True
+
+    async def start(self) -> None:
+        self._producer = False
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Condition()
+        self._stopping = False
+        self._outstanding = await recover_jobs()
+        if self._outstanding:
+            print(f"📦 {self._outstanding} offene Hintergrund-Jobs aus dem letzten Lauf übernommen.")
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def enqueue(self, kind: str, payload: Dict[str, Any]) -> None:
+        if self._producer:
+            if await enqueue_job(kind, json.dumps(payload), self.max_attempts) is None:
+                await self._handlers[kind](payload, self._noop_checkpoint)
+            return
+        if not self.running:
+            # Ohne gestartete Queue (z.B. Skripte) direkt ausführen
+            await self._handlers[kind](payload, self._noop_checkpoint)
+            return
+
+        async with self._space:
+            await self._space.wait_for(lambda: self._outstanding < self.limit)
+            self._outstanding += 1
+
+        job_id = await enqueue_job(kind, json.dumps(payload), self.max_attempts)
+        if job_id is None:
+            # Speichern fehlgeschlagen: Seiteneffekte lieber sofort ausführen als verlieren
+            await self._release()
+            await self._handlers[kind](payload, self._noop_checkpoint)
+            return
+        self._wakeup.set()
+
+    @staticmethod
+    async def _noop_checkpoint(payload: Dict[str, Any]) -> None:
+        pass
+
+    async def _release(self) -> None:
+        async with self._space:
+            self._outstanding = max(0, self._outstanding - 1)
+            self._space.notify_all()
+
+    def _backoff(self, attempts: int) -> float:
+        delay = min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE * 2 ** (attempts - 1))
+        return delay * random.uniform(0.8, 1.2)
+
+    async def _idle(self) -> None:
+        due = await next_job_due()
+        wait = JOB_POLL_INTERVAL if due is None else min(JOB_POLL_INTERVAL, max(0.0, due - time.time()))
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self) -> None:
+        while True:
+            self._wakeup.clear()
+            job = await claim_job()
+            if job is None:
+                if self._stopping:
+                    return
+                await self._idle()
+                continue
+            await self._run(*job)
+
+    async def _run(self, job_id: int, kind: str, payload: str, attempts: int, max_attempts: int) -> None:
+        handler = self._handlers.get(kind)
+        data = json.loads(payload)
+
+        async def checkpoint(new_payload: Dict[str, Any]) -> None:
+            await update_job_payload(job_id, json.dumps(new_payload))
+
+        start = time.perf_counter()
+        try:
+            if handler is None:
+                raise LookupError(f"Kein Handler für Job-Typ '{kind}'")
+            if kind in self._unbounded:
+                await handler(data, checkpoint)
+            else:
+                await asyncio.wait_for(handler(data, checkpoint), timeout=self.timeout)
+        except asyncio.CancelledError:
+            # Abbruch beim Herunterfahren: Versuch nicht anrechnen, beim nächsten Start erneut
+            await reschedule_job(job_id, "pending", time.time())
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            observe(f"job.{kind}", time.perf_counter() - start, "error")
+            if attempts < max_attempts:
+                delay = self._backoff(attempts)
+                self.retried += 1
+                print(f"⚠️ Job {job_id} ({kind}) fehlgeschlagen, Retry in {delay:.0f}s: {error}")
+                await reschedule_job(job_id, "pending", time.time() + delay, error)
+                return
+            self.failed += 1
+            print(f"❌ Job {job_id} ({kind}) endgültig fehlgeschlagen: {error}")
+            await reschedule_job(job_id, "failed", time.time(), error)
+            await self._release()
+            return
+
+        observe(f"job.{kind}", time.perf_counter() - start)
+        self.completed += 1
+        await finish_job(job_id)
+        await self._release()
+
+    async def stop(self, drain_timeout: float = JOB_DRAIN_TIMEOUT) -> None:
+        if not self._tasks:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        done, pending = await asyncio.wait(self._tasks, timeout=drain_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+            print(f"⏹️ Job-Queue nach {drain_timeout:.0f}s beendet, offene Jobs laufen beim nächsten Start weiter.")
+        self._tasks = []
+
+    async def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": "producer" if self._producer else "worker",
+            "workers": self.workers,
+            "outstanding": self._outstanding,
+            "limit": self.limit,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "by_status": await get_job_counts(),
+        }
+
+
+jobs = JobQueue()
@@ -0,0 +1,191 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from tracing import span
+
+# Unterhalb dieser Stichprobengröße wird die Standard-Verzögerung zum Hedgen verwendet
+MIN_LATENCY_SAMPLES = 5
+
+
+class AllProvidersFailed(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Überspringt einen Anbieter nach `failure_threshold` Fehlern in Folge für
+    `reset_timeout` Sekunden. Danach ist genau ein Probeaufruf erlaubt
+    (half-open); schlägt er fehl, bleibt der Breaker offen.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def release(self) -> None:
+        # Abgebrochener Probeaufruf zählt weder als Erfolg noch als Fehler
+        self._trial_running = False
+
+
+class LatencyTracker:
+    def __init__(self, window: int = 50):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self.samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        # Nearest-Rank wie StageStats: kleinster Wert, unter dem mindestens der Anteil p liegt
+        index = max(0, min(len(ordered) - 1, math.ceil(p * len(ordered)) - 1))
+        return ordered[index]
+
+
+class ProviderHealth:
+    """Langlebiger Zustand eines LLM-Anbieters (Breaker + Latenzverlauf)."""
+
+    def __init__(self, name: str, timeout: float, default_hedge_delay: float = 4.0):
+        self.name = name
+        self.timeout = timeout
+        self.default_hedge_delay = default_hedge_delay
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+
+    def hedge_delay(self, percentile: float) -> float:
+        observed = self.latency.percentile(percentile)
+        delay = observed if observed is not None else self.default_hedge_delay
+        return min(delay, self.timeout)
+
+
+Attempt = Tuple[ProviderHealth, Callable[[], Awaitable[Any]]]
+
+
+async def _run_attempt(provider: ProviderHealth, call: Callable[[], Awaitable[Any]]) -> Any:
+    start = time.monotonic()
+    try:
+        with span(f"llm.{provider.name}"):
+            result = await asyncio.wait_for(call(), timeout=provider.timeout)
+    except asyncio.CancelledError:
+        provider.breaker.release()
+        raise
+    except Exception:
+        provider.breaker.record_failure()
+        raise
+    provider.latency.record(time.monotonic() - start)
+    provider.breaker.record_success()
+    return result
+
+
+def _next_available(queue: List[Attempt]) -> Optional[Attempt]:
+    # Breaker erst beim Start prüfen, damit ein Probeaufruf nur für gestartete Anbieter reserviert wird
+    while queue:
+        provider, call = queue.pop(0)
+        if provider.breaker.allow():
+            return provider, call
+        print(f"🔌 {provider.name} übersprungen (Circuit Breaker offen).")
+    return None
+
+
+async def _dispatch_sequential(attempts: List[Attempt]) -> Tuple[str, Any]:
+    queue = list(attempts)
+    while True:
+        attempt = _next_available(queue)
+        if attempt is None:
+            raise AllProvidersFailed()
+        provider, call = attempt
+        try:
+            return provider.name, await _run_attempt(provider, call)
+        except Exception as e:
+            print(f"⚠️ {provider.name} Fehler, wechsle Anbieter: {e}")
+
+
+async def _dispatch_hedged(attempts: List[Attempt], percentile: float) -> Tuple[str, Any]:
+    queue = list(attempts)
+    running = {}
+    last_started: Optional[ProviderHealth] = None
+
+    def launch() -> bool:
+        nonlocal last_started
+        attempt = _next_available(queue)
+        if attempt is None:
+            return False
+        provider, call = attempt
+        running[asyncio.create_task(_run_attempt(provider, call))] = provider
+        last_started = provider
+        return True
+
+    launch()
+    try:
+        while running:
+            delay = last_started.hedge_delay(percentile) if queue else None
+            done, _ = await asyncio.wait(
+                running, timeout=delay, return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                print(f"⏱️ {last_started.name} antwortet nicht innerhalb {delay:.1f}s, starte Hedge-Anfrage.")
+                launch()
+                continue
+            for task in done:
+                provider = running.pop(task)
+                if task.exception() is None:
+                    return provider.name, task.result()
+                print(f"⚠️ {provider.name} Fehler: {task.exception()}")
+                launch()
+        raise AllProvidersFailed()
+    finally:
+        # Verlierer abbrechen und abwarten: sonst bleiben HTTP-Streams offen und
+        # "Task exception was never retrieved" landet im Log
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+
+async def dispatch(
+    attempts: List[Attempt], mode: str = "sequential", percentile: float = 0.95
+) -> Tuple[str, Any]:
+    """
+    Führt die Anbieter in Prioritätsreihenfolge aus und liefert (name, ergebnis)
+    des ersten erfolgreichen Aufrufs. Anbieter mit offenem Circuit Breaker
+    werden übersprungen. Im Modus 'hedged' wird der nächste Anbieter parallel
+    gestartet, sobald der laufende länger als sein Latenz-Perzentil braucht.
+    """
+    if mode == "hedged":
+        return await _dispatch_hedged(attempts, percentile)
+    return await _dispatch_sequential(attempts)
@@ -8,28 +8,61 @@ if sys.platform.startswith("win"):
 
 import os
 import asyncio
-import uuid
+import json
 import time
-import fitz
-import re
 from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, BackgroundTasks
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
-from database import init_db, save_message, get_chat_history, get_all_notes, add_note, delete_note
-from telegram_bot import setup_telegram
-from ai_logic import fetch_llm_response, fetch_gemini_vision, update_long_term_memory
-from calendar_utils import process_calendar_event
-from notepad_utils import process_notepad_event
+from database import (
+    init_db,
+    close_db,
+    get_history_rows,
+    get_latest_message_id,
+    get_all_notes,
+    get_summary_stats,
+    add_note,
+    delete_note,
+    search_messages,
+    search_notes,
+)
+import calendar_mirror
+from event_bus import bus
+from transcription import engine as transcription_engine, WHISPER_WARMUP
+from documents import document_prompt, engine as document_engine
+from blob_store import UploadTooLarge, store as blob_store
+from images import processor as image_processor
+from telegram_bot import (
+    TELEGRAM_WEBHOOK_URL,
+    check_webhook_secret,
+    feed_update,
+    setup_telegram,
+    start_telegram,
+    stop_telegram,
+)
+from telegram_outbox import Outgoing, outbox
+from ai_logic import (
+    SUMMARY_IDLE_MESSAGES,
+    SUMMARY_IDLE_SECONDS,
+    SUMMARY_MIN_MESSAGES,
+    init_memory,
+    pending_summary_messages,
+    update_long_term_memory,
+)
+from memory_index import memory
+from pipeline import MessageContext, pipeline, set_notifier
+from job_queue import jobs
+from response_cache import responses as response_cache
+from intent_router import router as intent_router
+from cluster import leadership, watch_changes
+from tracing import TracingMiddleware, render_metrics
 import google_calendar
 
 load_dotenv()
-UPLOAD_DIR = "static/uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 T_KEY = os.getenv("TELEGRAM_BOT_TOKEN")
 ALLOWED_ID = os.getenv("ALLOWED_TELEGRAM_ID")
@@ -43,84 +76,167 @@ ALLOWED_MIME_TYPES = {
 }
 
 
-async def cleanup_uploads():
-    while True:
-        try:
-            now = time.time()
-            for f in os.listdir(UPLOAD_DIR):
-                path = os.path.join(UPLOAD_DIR, f)
-                if os.path.isfile(path) and now - os.path.getmtime(path) > 86400:
-                    os.remove(path)
-        except:
-            pass
-        await asyncio.sleep(3600)
+async def memory_loop():
+    """
+    Startet die Langzeit-Zusammenfassung ereignisgesteuert statt stündlich:
+    sobald SUMMARY_MIN_MESSAGES neue Nachrichten vorliegen oder nach
+    SUMMARY_IDLE_SECONDS Gesprächspause mit mindestens SUMMARY_IDLE_MESSAGES.
+    """
+    queue = bus.subscribe()
+    last_message = time.monotonic()
+    try:
+        while True:
+            timeout = (
+                None if last_message is None
+                else max(0.0, last_message + SUMMARY_IDLE_SECONDS - time.monotonic())
+            )
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=timeout)
+                if event is None:
+                    return
+                if event["topic"] not in ("chat", "resync"):
+                    continue
+                last_message = time.monotonic()
+                threshold = SUMMARY_MIN_MESSAGES
+            except asyncio.TimeoutError:
+                # Pause erreicht: Rest zusammenfassen, danach erst nach der nächsten Nachricht wieder
+                last_message = None
+                threshold = SUMMARY_IDLE_MESSAGES
+            try:
+                # Größere Rückstände in mehreren Blöcken abarbeiten
+                while await pending_summary_messages() >= threshold:
+                    if not await update_long_term_memory():
+                        break
+            except Exception as e:
+                print(f"⚠️ Fehler in der Gedächtnis-Schleife: {e}")
+    finally:
+        bus.unsubscribe(queue)
 
 
-async def memory_loop():
-    while True:
-        await asyncio.sleep(3600)
+async def send_telegram(chat_id: str, text: str) -> None:
+    # Nur einreihen: Versand, Rate-Limits und Retries übernimmt die Outbox
+    outbox.send_text(chat_id, text)
+
+
+set_notifier(send_telegram)
+# Statusmeldungen von Web-Anfragen gehen in den Telegram-Chat des Besitzers
+WEB_NOTIFY_CHAT_ID = ALLOWED_ID if tg_app else None
+
+
+def telegram_mirror(user_text: str, kind: Optional[str] = None, path: Optional[str] = None):
+    """
+    Fan-out-Senke: spiegelt Nutzernachricht (oder Anhang `kind` = photo/document/voice
+    aus `path`) und Antwort nach Telegram. Reiht nur in die Outbox ein, die Web-Antwort
+    wartet nicht auf Telegram.
+    """
+
+    async def mirror(ctx: MessageContext) -> None:
+        if tg_app and ALLOWED_ID:
+            outbox.mirror(ALLOWED_ID, user_text, ctx.display, kind, path)
+
+    return mirror
+
+
+# Ohne eigenen Bot (Follower-Worker) laufen Telegram-Updates und -Nachrichten über die Job-Queue zum Leader
+TELEGRAM_UPDATE_JOB = "telegram_update"
+TELEGRAM_SEND_JOB = "telegram_send"
+
+
+async def _run_telegram_update(payload: Dict[str, Any], checkpoint) -> None:
+    if not (tg_app and tg_app.running):
+        raise RuntimeError("Telegram-Bot läuft in diesem Worker nicht")
+    await feed_update(tg_app, payload)
+
+
+async def _run_telegram_send(payload: Dict[str, Any], checkpoint) -> None:
+    if not outbox.running:
+        raise RuntimeError("Telegram-Outbox läuft in diesem Worker nicht")
+    outbox.put(Outgoing(**payload))
+
+
+async def forward_telegram(item: Outgoing) -> None:
+    try:
+        await jobs.enqueue(TELEGRAM_SEND_JOB, item.to_dict())
+    except Exception as e:
+        print(f"⚠️ Telegram-Nachricht konnte nicht an den Leader übergeben werden: {e}")
+
+
+jobs.register(TELEGRAM_UPDATE_JOB, _run_telegram_update)
+jobs.register(TELEGRAM_SEND_JOB, _run_telegram_send)
+
+leader_tasks: List[asyncio.Task] = []
+
+
+async def start_leader_services() -> None:
+    """Alles, was über alle Worker-Prozesse hinweg genau einmal laufen darf (siehe cluster.py)."""
+    await init_memory()
+    await jobs.start()
+    leader_tasks.append(asyncio.create_task(blob_store.reaper()))
+    leader_tasks.append(asyncio.create_task(memory_loop()))
+    if tg_app:
         try:
-            await update_long_term_memory()
-        except:
-            pass
+            await start_telegram(tg_app)
+            outbox.start(tg_app.bot)
+        except Exception as e:
+            print(f"⚠️ Telegram-Bot konnte nicht gestartet werden: {e}")
 
 
-def extract_pdf_text(b: bytes) -> str:
-    return "\n".join(p.get_text() for p in fitz.open(stream=b, filetype="pdf"))
+async def stop_leader_services() -> None:
+    # Offene Kalender-/Notizblock-Jobs abarbeiten, solange Bot und DB noch laufen
+    await jobs.stop()
+    await outbox.stop()
+    for task in leader_tasks:
+        task.cancel()
+    leader_tasks.clear()
+    if tg_app:
+        await stop_telegram(tg_app)
 
 
-async def background_calendar_task(ai_msg: str, msg_save: str, bot_app=None):
-    cal_status = await asyncio.to_thread(process_calendar_event, ai_msg)
-    if cal_status:
-        msg_save += f"\n\n{cal_status}"
-        if bot_app and ALLOWED_ID:
-            try:
-                await bot_app.bot.send_message(
-                    chat_id=ALLOWED_ID, text=f"🗓️ **Update:**\n{cal_status}"
-                )
-            except:
-                pass
-
-    note_status = await process_notepad_event(ai_msg)
-    if note_status:
-        msg_save += f"\n\n{note_status}"
-        if bot_app and ALLOWED_ID:
-            try:
-                await bot_app.bot.send_message(
-                    chat_id=ALLOWED_ID, text=f"📝 **Update:**\n{note_status}"
-                )
-            except:
-                pass
+async def follow() -> None:
+    """Follower: nur HTTP bedienen, Hintergrundarbeit und Telegram an den Leader abgeben."""
+    jobs.attach()
+    outbox.forward(forward_telegram)
+    await memory.open(writable=False)
+
 
-    await save_message("assistant", msg_save)
+async def demote() -> None:
+    await stop_leader_services()
+    await follow()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    await document_engine.start()
     await init_db()
-    c_task = asyncio.create_task(cleanup_uploads())
-    m_task = asyncio.create_task(memory_loop())
-    if tg_app:
-        try:
-            await tg_app.initialize()
-            await tg_app.start()
-            await tg_app.updater.start_polling(drop_pending_updates=True)
-        except:
-            pass
+    await leadership.start(start_leader_services, demote)
+    if not leadership.is_leader:
+        await follow()
+    x_task = asyncio.create_task(watch_changes())
+    w_task = asyncio.create_task(transcription_engine.warm_up()) if WHISPER_WARMUP else None
     yield
-    c_task.cancel()
-    m_task.cancel()
-    if tg_app:
-        await tg_app.updater.stop()
-        await tg_app.stop()
+    bus.close()
+    await pipeline.drain()
+    await leadership.stop()
+    if leadership.is_leader:
+        await stop_leader_services()
+        # Erst nach dem Anhalten freigeben, damit der nächste Leader nicht parallel pollt
+        await leadership.release()
+    x_task.cancel()
+    if w_task:
+        w_task.cancel()
+    transcription_engine.shutdown()
+    document_engine.shutdown()
+    calendar_mirror.close()
     try:
         from ai_logic import close_http_client
         await close_http_client()
     except:
         pass
+    await close_db()
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(TracingMiddleware)
 app.mount("/frontend", StaticFiles(directory="frontend"), name="frontend")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -129,9 +245,175 @@ class ChatRequest(BaseModel):
     message: str
 
 
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match nach RFC 9110: Liste von Tags, schwacher Vergleich (W/ ignoriert), '*' passt immer."""
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
+
+
 @app.get("/history")
-async def history():
-    return await get_chat_history(limit=50)
+async def history(request: Request, since_id: int = 0):
+    # ETag = neueste Nachricht + since_id (die Antwort hängt von beiden ab); unverändert -> 304 ohne Body
+    etag = f'W/"{await get_latest_message_id()}-{since_id}"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    rows = await get_history_rows(limit=50, since_id=since_id)
+    return JSONResponse(rows, headers={"ETag": etag})
+
+
+@app.get("/search")
+async def search(q: str, scope: str = "all", limit: int = 20):
+    """Volltextsuche über Chatverlauf und Notizen (scope: all, chat, notes)."""
+    if scope not in ("all", "chat", "notes"):
+        raise HTTPException(400, "scope muss 'all', 'chat' oder 'notes' sein.")
+    limit = max(1, min(limit, 100))
+    messages, notes = await asyncio.gather(
+        search_messages(q, limit) if scope != "notes" else asyncio.sleep(0, []),
+        search_notes(q, limit) if scope != "chat" else asyncio.sleep(0, []),
+    )
+    return {"query": q, "messages": messages, "notes": notes}
+
+
+def sse_event(event: str, data: Any, event_id: Optional[int] = None) -> str:
+    lines = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{lines}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.get("/events")
+async def events(request: Request, since_id: int = 0):
+    """Push-Kanal (SSE) für neue Chat-Nachrichten und Notizblock-Änderungen."""
+    last_event_id = request.headers.get("last-event-id", "")
+    if last_event_id.isdigit():
+        since_id = max(since_id, int(last_event_id))
+
+    # Erst abonnieren, dann nachladen, damit keine Nachricht verloren geht
+    queue = bus.subscribe()
+
+    async def event_stream():
+        last_sent = since_id
+        try:
+            if since_id:
+                for row in await get_history_rows(limit=50, since_id=since_id):
+                    last_sent = row["id"]
+                    yield sse_event("chat", row, row["id"])
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    break
+                data = event["data"]
+                if event["topic"] == "chat":
+                    if data["id"] <= last_sent:
+                        continue
+                    last_sent = data["id"]
+                    yield sse_event("chat", data, data["id"])
+                else:
+                    yield sse_event(event["topic"], data)
+        finally:
+            bus.unsubscribe(queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/transcription/stats")
+async def transcription_stats():
+    return transcription_engine.stats()
+
+
+@app.get("/documents/stats")
+async def document_stats():
+    return document_engine.stats()
+
+
+@app.post("/telegram/webhook", include_in_schema=False)
+async def telegram_webhook(request: Request):
+    if not (tg_app and TELEGRAM_WEBHOOK_URL):
+        raise HTTPException(404)
+    if not check_webhook_secret(tg_app, request.headers.get("X-Telegram-Bot-Api-Secret-Token")):
+        raise HTTPException(403)
+    data = await request.json()
+    if tg_app.running:
+        await feed_update(tg_app, data)
+    else:
+        # Bot läuft beim Leader-Worker; Update persistent weiterreichen, Telegram bekommt sofort 200
+        await jobs.enqueue(TELEGRAM_UPDATE_JOB, data)
+    return Response(status_code=200)
+
+
+@app.get("/telegram/stats")
+async def telegram_stats():
+    return {
+        "mode": "webhook" if TELEGRAM_WEBHOOK_URL else "polling",
+        "updates_in_flight": tg_app.update_processor.current_concurrent_updates if tg_app else 0,
+        "max_concurrent_updates": tg_app.update_processor.max_concurrent_updates if tg_app else 0,
+        "outbox": outbox.stats(),
+    }
+
+
+@app.get("/cluster/stats")
+async def cluster_stats():
+    return await leadership.stats()
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "responses": response_cache.stats(),
+        "calendar_events": google_calendar.events_cache_stats(),
+    }
+
+
+@app.get("/router/stats")
+async def router_stats():
+    return intent_router.stats()
+
+
+@app.get("/images/stats")
+async def image_stats():
+    return image_processor.stats()
+
+
+@app.get("/uploads/stats")
+async def upload_stats():
+    return await blob_store.stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/pipeline/stats")
+async def pipeline_stats():
+    return pipeline.stats()
+
+
+@app.get("/jobs/stats")
+async def job_stats():
+    return await jobs.stats()
+
+
+@app.get("/memory/stats")
+async def memory_stats():
+    return {
+        **memory.stats(),
+        "summary": {**await get_summary_stats(), "pending": await pending_summary_messages()},
+    }
 
 
 @app.get("/calendar")
@@ -166,65 +448,48 @@ async def remove_note(note_id: int):
     raise HTTPException(404, "Notiz nicht gefunden.")
 
 
+async def save_upload(file: UploadFile, ext: str):
+    try:
+        return await blob_store.save(file, ext)
+    except UploadTooLarge as e:
+        raise HTTPException(413, str(e))
+
+
 @app.post("/upload")
 async def upload_file(
     file: UploadFile = File(...),
     message: str = Form(""),
-    bg_tasks: BackgroundTasks = BackgroundTasks(),
 ):
     if file.content_type not in ALLOWED_MIME_TYPES:
         raise HTTPException(400, "Format nicht unterstützt.")
-    ext = ALLOWED_MIME_TYPES[file.content_type]
-    b = await file.read()
-    name = f"{uuid.uuid4()}.{ext}"
-    path = os.path.join(UPLOAD_DIR, name)
-    with open(path, "wb") as f:
-        f.write(b)
-
-    url = f"/static/uploads/{name}"
-    await save_message("user", f"FILE_CONFIRM:{url}|{message}")
-
-    if file.content_type.startswith("image/"):
-        res = await fetch_gemini_vision(message, b)
+    blob = await save_upload(file, ALLOWED_MIME_TYPES[file.content_type])
+
+    url = blob.url
+    is_image = file.content_type.startswith("image/")
+    if is_image:
+        prompt, image_bytes = message, await blob_store.read(blob)
     else:
-        res = await fetch_llm_response(
-            f"{message}\n\nDokumentinhalt:\n{await asyncio.to_thread(extract_pdf_text, b)}"
+        doc = await document_engine.extract_file(blob.path, blob.digest)
+        prompt, image_bytes = document_prompt(message, doc), doc.preview_image
+
+    ctx = await pipeline.run(
+        MessageContext(
+            prompt,
+            history_entry=f"FILE_CONFIRM:{url}|{message}",
+            image_bytes=image_bytes,
+            sinks=[telegram_mirror(f"Du:\n{message}", "photo" if is_image else "document", blob.path)],
+            notify_chat_id=WEB_NOTIFY_CHAT_ID,
         )
-
-    ai_msg = res.get("content", "")
-    disp = re.sub(
-        r"\[CALENDAR_EVENT\].*?\[/CALENDAR_EVENT\]", "", ai_msg, flags=re.DOTALL
     )
-    disp = re.sub(
-        r"\[NOTE_EVENT\].*?\[/NOTE_EVENT\]", "", disp, flags=re.DOTALL
-    ).strip()
-
-    if tg_app and ALLOWED_ID:
-        try:
-            with open(path, "rb") as f:
-                if file.content_type.startswith("image/"):
-                    await tg_app.bot.send_photo(
-                        chat_id=ALLOWED_ID, photo=f, caption=f"Du:\n{message}"
-                    )
-                else:
-                    await tg_app.bot.send_document(
-                        chat_id=ALLOWED_ID, document=f, caption=f"Du:\n{message}"
-                    )
-            await tg_app.bot.send_message(chat_id=ALLOWED_ID, text=f"KI:\n{disp}")
-        except:
-            pass
-
-    bg_tasks.add_task(background_calendar_task, ai_msg, disp, tg_app)
-    return {"content": disp}
+    await pipeline.enqueue(ctx)
+    return {"content": ctx.display}
 
 
 @app.post("/voice-record")
 async def voice_record(
     file: UploadFile = File(...),
     transcript: str = Form(""),
-    bg_tasks: BackgroundTasks = BackgroundTasks(),
 ):
-    b = await file.read()
     ext = "webm"
     if file.content_type == "audio/wav":
         ext = "wav"
@@ -233,85 +498,51 @@ async def voice_record(
     elif file.content_type in ["audio/mp4", "audio/m4a"]:
         ext = "m4a"
 
-    name = f"voice_{uuid.uuid4()}.{ext}"
-    path = os.path.join(UPLOAD_DIR, name)
-    with open(path, "wb") as f:
-        f.write(b)
+    blob = await save_upload(file, ext)
 
-    url = f"/static/uploads/{name}"
+    url = blob.url
     user_msg = transcript.strip()
-
-    await save_message("user", f"VOICE_CONFIRM:{url}|{user_msg}")
-
-    res = await fetch_llm_response(user_msg)
-    ai_msg = res.get("content", "")
-    disp = re.sub(
-        r"\[CALENDAR_EVENT\].*?\[/CALENDAR_EVENT\]", "", ai_msg, flags=re.DOTALL
+    caption = f"Du (Sprachmemo):\n{user_msg}"
+
+    ctx = await pipeline.run(
+        MessageContext(
+            user_msg,
+            history_entry=f"VOICE_CONFIRM:{url}|{user_msg}",
+            sinks=[telegram_mirror(caption, "voice", blob.path)],
+            notify_chat_id=WEB_NOTIFY_CHAT_ID,
+        )
     )
-    disp = re.sub(
-        r"\[NOTE_EVENT\].*?\[/NOTE_EVENT\]", "", disp, flags=re.DOTALL
-    ).strip()
-
-    if tg_app and ALLOWED_ID:
-        try:
-            with open(path, "rb") as f_voice:
-                try:
-                    await tg_app.bot.send_voice(
-                        chat_id=ALLOWED_ID,
-                        voice=f_voice,
-                        caption=f"Du (Sprachmemo):\n{user_msg}",
-                    )
-                except Exception:
-                    f_voice.seek(0)
-                    await tg_app.bot.send_document(
-                        chat_id=ALLOWED_ID,
-                        document=f_voice,
-                        caption=f"Du (Sprachmemo):\n{user_msg}",
-                    )
-            await tg_app.bot.send_message(chat_id=ALLOWED_ID, text=f"KI:\n{disp}")
-        except Exception as e:
-            print("Telegram forward voice failed:", e)
-
-    bg_tasks.add_task(background_calendar_task, ai_msg, disp, tg_app)
-    return {"transcript": user_msg, "content": disp, "audio_url": url}
+    await pipeline.enqueue(ctx)
+    return {"transcript": user_msg, "content": ctx.display, "audio_url": url}
 
 
 class VoiceTextRequest(BaseModel):
     transcript: str
 
 
+async def _voice_memo(user_msg: str) -> dict:
+    ctx = await pipeline.run(
+        MessageContext(
+            user_msg,
+            history_entry=f"[Sprachmemo] {user_msg}",
+            sinks=[telegram_mirror(f"Du (Sprachmemo):\n{user_msg}")],
+            notify_chat_id=WEB_NOTIFY_CHAT_ID,
+        )
+    )
+    await pipeline.enqueue(ctx)
+    return {"transcript": user_msg, "content": ctx.display}
+
 
 @app.post("/voice-text")
-async def voice_text(req: VoiceTextRequest, bg_tasks: BackgroundTasks = BackgroundTasks()):
+async def voice_text(req: VoiceTextRequest):
     user_msg = req.transcript.strip()
     if not user_msg:
         raise HTTPException(400, "Transkript darf nicht leer sein.")
-        
-    await save_message("user", f"[Sprachmemo] {user_msg}")
-    res = await fetch_llm_response(user_msg)
-    ai_msg = res.get("content", "")
-    disp = re.sub(
-        r"\[CALENDAR_EVENT\].*?\[/CALENDAR_EVENT\]", "", ai_msg, flags=re.DOTALL
-    )
-    disp = re.sub(
-        r"\[NOTE_EVENT\].*?\[/NOTE_EVENT\]", "", disp, flags=re.DOTALL
-    ).strip()
-    
-    if tg_app and ALLOWED_ID:
-        try:
-            await tg_app.bot.send_message(
-                chat_id=ALLOWED_ID, text=f"Du (Sprachmemo):\n{user_msg}"
-            )
-            await tg_app.bot.send_message(chat_id=ALLOWED_ID, text=f"KI:\n{disp}")
-        except:
-            pass
-            
-    bg_tasks.add_task(background_calendar_task, ai_msg, disp, tg_app)
-    return {"transcript": user_msg, "content": disp}
+    return await _voice_memo(user_msg)
 
 
 @app.post("/voice")
-async def voice(file: UploadFile = File(...), bg_tasks: BackgroundTasks = BackgroundTasks()):
+async def voice(file: UploadFile = File(...)):
     audio_bytes = await file.read()
     filename = file.filename or "voice.webm"
     
@@ -320,53 +551,56 @@ async def voice(file: UploadFile = File(...), bg_tasks: BackgroundTasks = Backgr
     
     if not user_msg:
         raise HTTPException(400, "Sprachnachricht konnte nicht transkribiert werden.")
-        
-    await save_message("user", f"[Sprachmemo] {user_msg}")
-    res = await fetch_llm_response(user_msg)
-    ai_msg = res.get("content", "")
-    disp = re.sub(
-        r"\[CALENDAR_EVENT\].*?\[/CALENDAR_EVENT\]", "", ai_msg, flags=re.DOTALL
-    )
-    disp = re.sub(
-        r"\[NOTE_EVENT\].*?\[/NOTE_EVENT\]", "", disp, flags=re.DOTALL
-    ).strip()
-    
-    if tg_app and ALLOWED_ID:
-        try:
-            await tg_app.bot.send_message(
-                chat_id=ALLOWED_ID, text=f"Du (Sprachmemo):\n{user_msg}"
-            )
-            await tg_app.bot.send_message(chat_id=ALLOWED_ID, text=f"KI:\n{disp}")
-        except:
-            pass
-            
-    bg_tasks.add_task(background_calendar_task, ai_msg, disp, tg_app)
-    return {"transcript": user_msg, "content": disp}
+    return await _voice_memo(user_msg)
 
 
 @app.post("/chat")
-async def chat(req: ChatRequest, bg_tasks: BackgroundTasks):
-    await save_message("user", req.message)
-    res = await fetch_llm_response(req.message)
-    ai_msg = res.get("content", "")
-    disp = re.sub(
-        r"\[CALENDAR_EVENT\].*?\[/CALENDAR_EVENT\]", "", ai_msg, flags=re.DOTALL
+async def chat(req: ChatRequest):
+    ctx = await pipeline.run(
+        MessageContext(
+            req.message,
+            sinks=[telegram_mirror(f"Du:\n{req.message}")],
+            notify_chat_id=WEB_NOTIFY_CHAT_ID,
+        )
     )
-    disp = re.sub(
-        r"\[NOTE_EVENT\].*?\[/NOTE_EVENT\]", "", disp, flags=re.DOTALL
-    ).strip()
+    await pipeline.enqueue(ctx)
+    return {"content": ctx.display}
 
-    if tg_app and ALLOWED_ID:
-        try:
-            await tg_app.bot.send_message(
-                chat_id=ALLOWED_ID, text=f"Du:\n{req.message}"
-            )
-            await tg_app.bot.send_message(chat_id=ALLOWED_ID, text=f"KI:\n{disp}")
-        except:
-            pass
 
-    bg_tasks.add_task(background_calendar_task, ai_msg, disp, tg_app)
-    return {"content": disp}
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest):
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def reply(ctx: MessageContext) -> None:
+        queue.put_nowait({"done": True, "content": ctx.display})
+
+    ctx = MessageContext(
+        req.message,
+        sinks=[reply, telegram_mirror(f"Du:\n{req.message}")],
+        notify_chat_id=WEB_NOTIFY_CHAT_ID,
+        on_delta=lambda delta: queue.put_nowait({"delta": delta}),
+    )
+    async def event_stream():
+        # Pipeline und Job-Übergabe laufen unabhängig von der Verbindung zu Ende
+        run = pipeline.detach(ctx)
+        run.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while True:
+                event = await queue.get()
+                if event is None:
+                    break
+                yield f"data: {json.dumps(event)}\n\n"
+            await run
+        finally:
+            # Client hat die Verbindung getrennt: nur den laufenden LLM-Stream abbrechen
+            if not run.done():
+                ctx.stop_generation()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/favicon.ico", include_in_schema=False)
@@ -380,6 +614,19 @@ async def index():
 
 
 if __name__ == "__main__":
+    import argparse
     import uvicorn
 
-    uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
+    parser = argparse.ArgumentParser(description="Lumina-Server")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument(
+        "--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "1")),
+        help="Worker-Prozesse; ab 2 Produktionsmodus ohne Auto-Reload",
+    )
+    args = parser.parse_args()
+    if args.workers > 1:
+        # Ein Leader (per Lease gewählt) betreibt Bot, Jobs und Gedächtnis, alle bedienen HTTP
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
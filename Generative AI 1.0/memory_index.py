@@ -0,0 +1,439 @@
+import asyncio
+import json
+import math
+import os
+import re
+import unicodedata
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from context_budget import count_tokens, truncate_to_tokens
+from database import (
+    BASE_DIR,
+    add_memory_chunks,
+    delete_memory_chunks,
+    get_latest_message_id,
+    get_memory_chunks,
+    get_memory_contents,
+    get_messages_since,
+    get_table_version,
+    set_memory_rows,
+)
+from tracing import span
+
+MEMORY_DIR = os.getenv("MEMORY_INDEX_DIR", os.path.join(BASE_DIR, "memory_index"))
+# "auto": lokales sentence-transformers-Modell, falls installiert, sonst Hashing-Embedder
+MEMORY_EMBEDDER = os.getenv("MEMORY_EMBEDDER", "auto")
+MEMORY_EMBED_MODEL = os.getenv("MEMORY_EMBED_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+MEMORY_OPENAI_MODEL = "text-embedding-3-small"
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "6"))
+# Ohne Angabe gilt die Schwelle des Embedders (lexikalische Scores liegen deutlich niedriger)
+MEMORY_MIN_SCORE = os.getenv("MEMORY_MIN_SCORE")
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "800"))
+# Ein Verlaufs-Chunk fasst aufeinanderfolgende Nachrichten bis zu dieser Größe zusammen
+MEMORY_CHUNK_TOKENS = 200
+# Neue Nachrichten werden erst ab dieser Anzahl eingebettet (keine Mini-Chunks)
+MEMORY_MIN_PENDING = 6
+# Die jüngsten Nachrichten stehen ohnehin im Verlauf des Prompts
+MEMORY_SKIP_RECENT = int(os.getenv("MEMORY_SKIP_RECENT", "20"))
+EMBED_BATCH = 64
+
+FACT_PREFIX_RE = re.compile(r"^[\s\-*•]+")
+WORD_RE = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "aber alle als also am an auch auf aus bei bin bis bist da dann das dass dein dem den der des die "
+    "dir du ein eine einem einen einer er es für hab habe hat hatte ich ihr im in ist ja kann mal mein "
+    "mich mir mit nach nicht noch nur oder sie sind so und uns von war was wie wir wird zu zum zur "
+    "the and for you that this with are was have not but what".split()
+)
+
+
+def _fold(text: str) -> str:
+    """Kleinbuchstaben ohne Akzente/Umlaute: 'Äpfel' -> 'apfel'."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+class HashEmbedder:
+    """
+    Abhängigkeitsfreier Fallback: Feature-Hashing über Wörter und
+    Zeichen-Trigramme (fängt Flexionen und Komposita ab). Rein lexikalisch,
+    aber deterministisch, schnell und offline. Logarithmische Termfrequenz,
+    damit wiederkehrende Floskeln lange Chunks nicht dominieren.
+    """
+
+    min_score = 0.12
+    TRIGRAM_WEIGHT = 0.3
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.name = f"hash-{dim}"
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts: Dict[str, int] = {}
+            for word in WORD_RE.findall(_fold(text)):
+                if len(word) < 3 or word in STOPWORDS:
+                    continue
+                counts[word] = counts.get(word, 0) + 1
+                padded = f"#{word}#"
+                for i in range(len(padded) - 2):
+                    # \0 trennt Trigramme von gleichlautenden Dreibuchstaben-Wörtern
+                    gram = "\0" + padded[i:i + 3]
+                    counts[gram] = counts.get(gram, 0) + 1
+            vec = out[row]
+            for feature, count in counts.items():
+                weight = (self.TRIGRAM_WEIGHT if feature[0] == "\0" else 1.0) * (1 + math.log(count))
+                h = zlib.crc32(feature.encode())
+                vec[h % self.dim] += weight if h & 0x80000000 else -weight
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-9)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        return await asyncio.to_thread(self._encode, texts)
+
+
+class SentenceTransformerEmbedder:
+    """Lokales CPU-Modell über sentence-transformers (optionale Abhängigkeit)."""
+
+    min_score = 0.3
+
+    def __init__(self, model_name: str = MEMORY_EMBED_MODEL):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st:{model_name}"
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(texts, normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        return await asyncio.to_thread(self._encode, texts)
+
+
+class OpenAIEmbedder:
+    """OpenAI-Embeddings; nur auf ausdrücklichen Wunsch (MEMORY_EMBEDDER=openai)."""
+
+    min_score = 0.3
+
+    def __init__(self, model: str = MEMORY_OPENAI_MODEL, dim: int = 512):
+        from openai import AsyncOpenAI
+
+        self.client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.model = model
+        self.dim = dim
+        self.name = f"openai:{model}:{dim}"
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        resp = await self.client.embeddings.create(model=self.model, input=texts, dimensions=self.dim)
+        out = np.array([d.embedding for d in resp.data], dtype=np.float32)
+        return out / np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-9)
+
+
+def make_embedder(kind: str = MEMORY_EMBEDDER):
+    if kind == "openai":
+        return OpenAIEmbedder()
+    if kind in ("auto", "local"):
+        try:
+            return SentenceTransformerEmbedder()
+        except Exception as e:
+            if kind == "local":
+                raise
+            print(f"ℹ️ Kein lokales Embedding-Modell verfügbar ({e}), nutze Hashing-Embedder.")
+    return HashEmbedder()
+
+
+class VectorIndex:
+    """
+    Normierte float32-Vektoren, zeilenweise angehängt an eine Datei und per
+    np.memmap gelesen: der Index liegt nicht doppelt im RAM, und neue Chunks
+    kosten nur ein Anhängen. index.json hält Embedder und Dimension fest.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, "vectors.f32")
+        self.meta_path = os.path.join(directory, "index.json")
+        self.embedder = ""
+        self.dim = 0
+        self._matrix: Optional[np.memmap] = None
+
+    def open(self, embedder: str, dim: int, repair: bool = True) -> bool:
+        """False, wenn die Datei zu einem anderen Embedder gehört (Neuaufbau nötig)."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._matrix = None
+        meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        self.embedder, self.dim = embedder, dim
+        if meta.get("embedder") != embedder or meta.get("dim") != dim or not os.path.exists(self.path):
+            return False
+        # Halb geschriebene letzte Zeile (Absturz beim Anhängen) abschneiden
+        size = os.path.getsize(self.path)
+        if repair and size % self._row_bytes:
+            with open(self.path, "r+b") as f:
+                f.truncate(size - size % self._row_bytes)
+        return True
+
+    @property
+    def _row_bytes(self) -> int:
+        return 4 * self.dim
+
+    @property
+    def rows(self) -> int:
+        return os.path.getsize(self.path) // self._row_bytes if os.path.exists(self.path) else 0
+
+    @property
+    def matrix(self) -> Optional[np.ndarray]:
+        if self._matrix is None and self.rows:
+            self._matrix = np.memmap(self.path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        return self._matrix
+
+    def append(self, vectors: np.ndarray) -> int:
+        """Hängt Vektoren an und liefert die Zeilennummer des ersten."""
+        first = self.rows
+        self._matrix = None
+        with open(self.path, "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        return first
+
+    def rewrite(self, vectors: np.ndarray) -> None:
+        self._matrix = None
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        os.replace(tmp, self.path)
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump({"embedder": self.embedder, "dim": self.dim}, f)
+
+
+class MemoryStore:
+    """
+    Vektor-Gedächtnis aus Verlaufs-Chunks und Fakten der Langzeit-Zusammenfassung.
+    Metadaten und Texte liegen in SQLite (memory_chunks), die Vektoren im
+    VectorIndex; vec_row verbindet beide. Gelöschte Fakten hinterlassen tote
+    Zeilen, die beim nächsten Start kompaktiert werden, sobald sie überwiegen.
+    Mit mehreren Worker-Prozessen schreibt nur der Leader; die übrigen öffnen
+    den Index nur lesend und laden ihn nach, sobald der Leader Chunks ändert.
+    """
+
+    def __init__(self, directory: str = MEMORY_DIR, embedder=None):
+        self.directory = directory
+        self.embedder = embedder
+        self.index: Optional[VectorIndex] = None
+        self.ready = False
+        self.writable = True
+        self.watermark = 0
+        # Stand von memory_chunks beim letzten Laden (nur lesende Worker)
+        self._version = -1
+        self._lock = asyncio.Lock()
+        # Pro Vektorzeile: Chunk-ID (-1 = tot), Art (1 = Verlauf) und letzte Nachrichten-ID
+        self._chunk_ids = np.zeros(0, dtype=np.int64)
+        self._is_history = np.zeros(0, dtype=bool)
+        self._last_message = np.zeros(0, dtype=np.int64)
+        self.recalls = 0
+
+    async def open(self, writable: bool = True) -> None:
+        async with self._lock:
+            try:
+                if self.embedder is None:
+                    self.embedder = await asyncio.to_thread(make_embedder)
+                self.writable = writable
+                self.index = VectorIndex(self.directory)
+                if not writable:
+                    await self._follow()
+                    return
+                chunks = await get_memory_chunks()
+                valid = self.index.open(self.embedder.name, self.embedder.dim)
+                if not valid or any(c["vec_row"] >= self.index.rows for c in chunks):
+                    await self._rebuild()
+                elif self.index.rows > max(1000, 2 * len(chunks)):
+                    await self._compact(chunks)
+                else:
+                    self._load(chunks, self.index.rows)
+                self.ready = True
+                print(f"🧠 Vektor-Gedächtnis bereit ({len(chunks)} Chunks, Embedder {self.embedder.name}).")
+            except Exception as e:
+                self.ready = False
+                print(f"⚠️ Vektor-Gedächtnis nicht verfügbar: {e}")
+
+    async def _follow(self) -> None:
+        """Nur lesen: Neuaufbau und Kompaktierung übernimmt der Leader."""
+        self._version = get_table_version("memory_chunks")
+        chunks = await get_memory_chunks()
+        valid = self.index.open(self.embedder.name, self.embedder.dim, repair=False)
+        # Bis der Leader einen veralteten Index neu aufgebaut hat, ohne Gedächtnis antworten
+        self.ready = valid and all(c["vec_row"] < self.index.rows for c in chunks)
+        if self.ready:
+            self._load(chunks, self.index.rows)
+
+    async def _reload(self) -> None:
+        async with self._lock:
+            if self._version == get_table_version("memory_chunks"):
+                return
+            try:
+                await self._follow()
+            except Exception as e:
+                self.ready = False
+                print(f"⚠️ Vektor-Gedächtnis konnte nicht nachgeladen werden: {e}")
+
+    def _load(self, chunks: List[Dict], rows: int) -> None:
+        self._chunk_ids = np.full(rows, -1, dtype=np.int64)
+        self._is_history = np.zeros(rows, dtype=bool)
+        self._last_message = np.zeros(rows, dtype=np.int64)
+        for c in chunks:
+            self._register(c["vec_row"], c["id"], c["kind"], c["last_message_id"])
+        self.watermark = max(
+            (c["last_message_id"] or 0 for c in chunks if c["kind"] == "history"), default=0
+        )
+
+    def _register(self, row: int, chunk_id: int, kind: str, last_message_id: Optional[int]) -> None:
+        self._chunk_ids[row] = chunk_id
+        self._is_history[row] = kind == "history"
+        self._last_message[row] = last_message_id or 0
+
+    def _grow(self, rows: int) -> None:
+        extra = rows - len(self._chunk_ids)
+        if extra > 0:
+            self._chunk_ids = np.concatenate([self._chunk_ids, np.full(extra, -1, dtype=np.int64)])
+            self._is_history = np.concatenate([self._is_history, np.zeros(extra, dtype=bool)])
+            self._last_message = np.concatenate([self._last_message, np.zeros(extra, dtype=np.int64)])
+
+    async def _embed(self, texts: List[str]) -> np.ndarray:
+        parts = []
+        with span("memory.embed"):
+            for i in range(0, len(texts), EMBED_BATCH):
+                parts.append(await self.embedder.embed(texts[i:i + EMBED_BATCH]))
+        return np.vstack(parts) if parts else np.zeros((0, self.embedder.dim), dtype=np.float32)
+
+    async def _rebuild(self) -> None:
+        """Alle Chunks neu einbetten, z.B. nach einem Wechsel des Embedders."""
+        chunks = await get_memory_chunks(with_content=True)
+        if chunks:
+            print(f"🧠 Baue Vektor-Gedächtnis neu auf ({len(chunks)} Chunks, {self.embedder.name})...")
+        vectors = await self._embed([c["content"] for c in chunks])
+        self.index.rewrite(vectors)
+        await set_memory_rows([(row, c["id"]) for row, c in enumerate(chunks)])
+        self._load([{**c, "vec_row": row} for row, c in enumerate(chunks)], len(chunks))
+
+    async def _compact(self, chunks: List[Dict]) -> None:
+        """Tote Zeilen entfernen, ohne neu einzubetten."""
+        vectors = np.array(self.index.matrix[[c["vec_row"] for c in chunks]])
+        self.index.rewrite(vectors)
+        await set_memory_rows([(row, c["id"]) for row, c in enumerate(chunks)])
+        self._load([{**c, "vec_row": row} for row, c in enumerate(chunks)], len(chunks))
+
+    async def _add(self, entries: List[tuple]) -> None:
+        """entries: (kind, content, first_message_id, last_message_id, created_at)."""
+        vectors = await self._embed([e[1] for e in entries])
+        first = self.index.append(vectors)
+        # Erst Vektoren, dann Metadaten: ein Absturz dazwischen hinterlässt nur eine tote Zeile
+        rows = [(kind, text, a, b, first + i, ts) for i, (kind, text, a, b, ts) in enumerate(entries)]
+        if not await add_memory_chunks(rows):
+            raise RuntimeError("Gedächtnis-Chunks konnten nicht gespeichert werden")
+        self._grow(first + len(entries))
+        for c in await get_memory_chunks(min_row=first):
+            self._register(c["vec_row"], c["id"], c["kind"], c["last_message_id"])
+
+    async def sync(self, force: bool = False) -> int:
+        """Bettet neue Chatnachrichten (ab dem Wasserstand) als Chunks ein."""
+        if not self.ready or not self.writable:
+            return 0
+        async with self._lock:
+            if not force and await get_latest_message_id() - self.watermark < MEMORY_MIN_PENDING:
+                return 0
+            added = 0
+            while True:
+                messages = await get_messages_since(self.watermark, limit=200)
+                if not messages:
+                    return added
+                chunks = _chunk_messages(messages)
+                await self._add(chunks)
+                self.watermark = messages[-1]["id"]
+                added += len(chunks)
+
+    async def set_facts(self, summary: str) -> None:
+        """Gleicht die Fakten-Chunks mit den Stichpunkten der Zusammenfassung ab."""
+        if not self.ready or not self.writable:
+            return
+        facts = list(dict.fromkeys(
+            FACT_PREFIX_RE.sub("", line).strip() for line in summary.splitlines()
+        ))
+        facts = [f for f in facts if f]
+        async with self._lock:
+            existing = {c["content"]: c for c in await get_memory_chunks("fact", with_content=True)}
+            stale = [c for text, c in existing.items() if text not in facts]
+            new = [f for f in facts if f not in existing]
+            if new:
+                await self._add([("fact", f, None, None, None) for f in new])
+            if stale and await delete_memory_chunks([c["id"] for c in stale]):
+                for c in stale:
+                    self._chunk_ids[c["vec_row"]] = -1
+
+    async def recall(self, query: str, k: int = MEMORY_TOP_K) -> List[Dict]:
+        """Top-k Chunks zur Anfrage, ohne die jüngsten (ohnehin im Prompt) Nachrichten."""
+        if self.index is not None and not self.writable and self._version != get_table_version("memory_chunks"):
+            await self._reload()
+        if not self.ready or not query.strip() or self.index.matrix is None:
+            return []
+        matrix, chunk_ids = self.index.matrix, self._chunk_ids
+        recent = await get_latest_message_id() - MEMORY_SKIP_RECENT
+        q = (await self.embedder.embed([query]))[0]
+        min_score = float(MEMORY_MIN_SCORE) if MEMORY_MIN_SCORE else self.embedder.min_score
+
+        def search() -> List[int]:
+            n = min(len(matrix), len(chunk_ids))
+            if n == 0:
+                return []
+            scores = np.asarray(matrix[:n] @ q)
+            scores[chunk_ids[:n] < 0] = -1.0
+            scores[self._is_history[:n] & (self._last_message[:n] > recent)] = -1.0
+            top = np.argpartition(-scores, min(k, n - 1))[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(row), float(scores[row])) for row in top if scores[row] >= min_score]
+
+        with span("memory.search"):
+            hits = await asyncio.to_thread(search)
+        self.recalls += 1
+        contents = await get_memory_contents([row for row, _ in hits])
+        return [{**contents[row], "score": round(score, 3)} for row, score in hits if row in contents]
+
+    def stats(self) -> Dict:
+        live = int((self._chunk_ids >= 0).sum())
+        return {
+            "ready": self.ready,
+            "writable": self.writable,
+            "embedder": self.embedder.name if self.embedder else None,
+            "chunks": live,
+            "dead_rows": len(self._chunk_ids) - live,
+            "watermark": self.watermark,
+            "recalls": self.recalls,
+        }
+
+
+def _chunk_messages(messages: List[Dict]) -> List[tuple]:
+    """Fasst aufeinanderfolgende Nachrichten zu Chunks von höchstens MEMORY_CHUNK_TOKENS zusammen."""
+    chunks, lines, used, first = [], [], 0, None
+    for msg in messages:
+        speaker = "Nutzer" if msg["role"] == "user" else "Lumina"
+        line = f"{speaker}: {truncate_to_tokens(msg['content'], MEMORY_CHUNK_TOKENS)}"
+        cost = count_tokens(line)
+        if lines and used + cost > MEMORY_CHUNK_TOKENS:
+            chunks.append(("history", "\n".join(lines), first, last["id"], last["timestamp"]))
+            lines, used = [], 0
+        if not lines:
+            first = msg["id"]
+        lines.append(line)
+        used += cost
+        last = msg
+    if lines:
+        chunks.append(("history", "\n".join(lines), first, last["id"], last["timestamp"]))
+    return chunks
+
+
+memory = MemoryStore()
@@ -1,25 +1,23 @@
-import re
+from typing import List
+
 import database
+from action_blocks import NOTE_TAG, find_blocks, parse_fields
 
 
 async def process_notepad_event(text: str) -> str:
     print("🔍 Prüfe KI-Antwort auf Notizblock-Aktionen...")
-    pattern = r"\[NOTE_EVENT\](.*?)\[/NOTE_EVENT\]"
-    matches = re.findall(pattern, text, re.DOTALL)
+    return await process_note_blocks(find_blocks(text, NOTE_TAG))
+
 
+async def process_note_blocks(matches: List[str]) -> str:
+    """Führt bereits extrahierte [NOTE_EVENT]-Blöcke aus."""
     if not matches:
         return ""
 
     results = []
     for match in matches:
         try:
-            data = {}
-            for line in match.strip().split("\n"):
-                line = line.strip()
-                if not line or ":" not in line:
-                    continue
-                k, v = line.split(":", 1)
-                data[k.strip().lower()] = v.strip()
+            data = parse_fields(match)
 
             action = data.get("action", "add").lower()
             content = data.get("content", "")
@@ -52,14 +50,11 @@ async def process_notepad_event(text: str) -> str:
                         continue
 
                 if not success and content:
-                    # Alternativ nach Inhalt löschen
-                    notes = await database.get_all_notes()
-                    for n in notes:
-                        if content.lower() in n["content"].lower():
-                            success = await database.delete_note(n["id"])
-                            if success:
-                                results.append(f"🗑️ Notiz '{n['content']}' (ID: {n['id']}) gelöscht.")
-                                break
+                    # Alternativ nach Inhalt löschen: bester Treffer aus dem Volltextindex
+                    for n in await database.search_notes(content, limit=1):
+                        success = await database.delete_note(n["id"])
+                        if success:
+                            results.append(f"🗑️ Notiz '{n['content']}' (ID: {n['id']}) gelöscht.")
                     if not success:
                         results.append(f"⚠️ Keine passende Notiz mit Inhalt '{content}' gefunden.")
                 elif not success:
@@ -0,0 +1,389 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from action_blocks import parse_reply
+from ai_logic import EventBlockFilter, build_context, cache_calendar_titles, generate_response, stream_response
+from calendar_utils import process_calendar_blocks
+from database import save_message
+from intent_router import router
+from job_queue import jobs
+from memory_index import memory
+from notepad_utils import process_note_blocks
+from response_cache import is_read_only, response_key, responses
+from tracing import observe
+
+
+class MessageContext:
+    """
+    Zustand einer Nutzernachricht auf dem Weg durch die Pipeline. Die
+    Einstiegspunkte (Web, Telegram) befüllen nur die Eingaben; alles
+    Weitere schreiben die Stufen hinein.
+    """
+
+    def __init__(
+        self,
+        message: str,
+        history_entry: Optional[str] = None,
+        image_bytes: bytes = None,
+        channel: str = "web",
+        sinks: Optional[List[Callable[["MessageContext"], Awaitable[None]]]] = None,
+        notify_chat_id: Optional[str] = None,
+        on_delta: Optional[Callable[[str], None]] = None,
+    ):
+        # Prompt an das LLM und die Form, in der die Nachricht im Verlauf landet
+        self.message = message
+        self.history_entry = message if history_entry is None else history_entry
+        self.image_bytes = image_bytes
+        self.channel = channel
+        # Fan-out: Antwort an den Ursprungskanal und Spiegelungen (z.B. Telegram)
+        self.sinks = sinks or []
+        # Telegram-Chat für die Statusmeldungen der Kalender-/Notizblock-Aktionen
+        self.notify_chat_id = notify_chat_id
+        # Gesetzt = LLM-Antwort wird gestreamt (bereinigte Text-Deltas)
+        self.on_delta = on_delta
+        # Laufender LLM-Stream (nur während generate), siehe stop_generation
+        self.generation: Optional[asyncio.Task] = None
+
+        # Von Intent-Router oder Antwort-Cache beantwortet: kein Kontextaufbau, kein LLM-Aufruf
+        self.routed = False
+        # Schlüssel im Antwort-Cache (None = nicht zwischenspeicherbar, z.B. mit Bild)
+        self.cache_key: Optional[str] = None
+        self.system_instruction = ""
+        self.history: list = []
+        self.raw = ""
+        self.source = ""
+        self.reasoning: Optional[str] = None
+        self.display = ""
+        self.calendar_blocks: List[str] = []
+        self.note_blocks: List[str] = []
+        self.statuses: List[str] = []
+        # Antwort schon im Vordergrund gespeichert (save_reply); persist speichert dann nur die Statusmeldungen
+        self.reply_saved = False
+        self.completed: List[str] = []
+        self.timings: Dict[str, float] = {}
+
+    def stop_generation(self) -> None:
+        """Bricht nur den LLM-Stream ab (Client weg); die übrigen Stufen laufen mit dem bisherigen Text weiter."""
+        if self.generation is not None:
+            self.generation.cancel()
+
+    def to_job(self) -> Dict[str, Any]:
+        """Alles, was die Hintergrund-Stufen brauchen, als JSON-fähiges Dict."""
+        return {
+            "channel": self.channel,
+            "display": self.display,
+            "calendar_blocks": self.calendar_blocks,
+            "note_blocks": self.note_blocks,
+            "notify_chat_id": self.notify_chat_id,
+            "statuses": self.statuses,
+            "reply_saved": self.reply_saved,
+            "completed": self.completed,
+        }
+
+    @classmethod
+    def from_job(cls, payload: Dict[str, Any]) -> "MessageContext":
+        ctx = cls("", history_entry="", channel=payload["channel"], notify_chat_id=payload["notify_chat_id"])
+        ctx.display = payload["display"]
+        ctx.calendar_blocks = payload["calendar_blocks"]
+        ctx.note_blocks = payload["note_blocks"]
+        ctx.statuses = payload["statuses"]
+        ctx.reply_saved = payload.get("reply_saved", False)
+        ctx.completed = payload["completed"]
+        return ctx
+
+
+Stage = Callable[[MessageContext], Awaitable[None]]
+
+MESSAGE_JOB = "message_actions"
+# Hintergrund-Stufen ohne Job-Timeout: Kalender-Aufrufe laufen in einem Thread, den ein
+# Timeout nicht stoppt; ein Retry würde die noch laufenden Termine doppelt anlegen.
+# Die Google-Aufrufe sind durch das HTTP-Timeout des Clients begrenzt.
+UNBOUNDED_STAGES = {"actions"}
+
+# Versendet Statusmeldungen an einen Telegram-Chat (chat_id, text); wird von main.py gesetzt
+_notifier: Optional[Callable[[str, str], Awaitable[None]]] = None
+
+
+def set_notifier(notifier: Callable[[str, str], Awaitable[None]]) -> None:
+    global _notifier
+    _notifier = notifier
+
+
+async def ingest(ctx: MessageContext) -> None:
+    if ctx.history_entry:
+        await save_message("user", ctx.history_entry)
+
+
+async def route(ctx: MessageContext) -> None:
+    # Bilder brauchen immer das Modell und sind nicht Teil des Cache-Schlüssels
+    if ctx.image_bytes:
+        return
+    intent = router.match(ctx.message)
+    if intent is not None:
+        ctx.raw = await router.execute(intent)
+        ctx.source = "Router"
+        ctx.routed = True
+        if ctx.on_delta is not None:
+            ctx.on_delta(ctx.raw)
+        return
+
+    # Antwort-Cache vor build: ein Treffer spart auch Kontextaufbau und Gedächtnisabruf
+    ctx.cache_key = response_key(ctx.message)
+    cached = responses.get(ctx.cache_key) if ctx.cache_key else None
+    if cached is not None:
+        ctx.raw, ctx.source, ctx.reasoning = cached
+        ctx.routed = True
+        if ctx.on_delta is not None:
+            event_filter = EventBlockFilter()
+            ctx.on_delta(event_filter.feed(ctx.raw) + event_filter.flush())
+
+
+async def build(ctx: MessageContext) -> None:
+    if ctx.routed:
+        return
+    ctx.system_instruction, ctx.history = await build_context(query=ctx.message)
+
+
+async def generate(ctx: MessageContext) -> None:
+    if ctx.routed:
+        return
+    if ctx.on_delta is None:
+        response = await generate_response(
+            ctx.system_instruction, ctx.history, ctx.message, ctx.image_bytes
+        )
+    else:
+        response = {}
+        shown: List[str] = []
+
+        async def consume() -> None:
+            nonlocal response
+            async for event in stream_response(
+                ctx.system_instruction, ctx.history, ctx.message, ctx.image_bytes
+            ):
+                if event.get("done"):
+                    response = event
+                elif event.get("delta"):
+                    shown.append(event["delta"])
+                    ctx.on_delta(event["delta"])
+
+        ctx.generation = asyncio.create_task(consume())
+        try:
+            await ctx.generation
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+            # stop_generation: angezeigter Teil wird gespeichert, Aktionsblöcke fehlen darin ohnehin
+            response = {"content": "".join(shown), "source": "Abgebrochen"}
+        finally:
+            ctx.generation = None
+    ctx.raw = response.get("content", "")
+    ctx.source = response.get("source", "")
+    ctx.reasoning = response.get("reasoning")
+    if ctx.cache_key and ctx.source not in ("System Error", "Abgebrochen") and is_read_only(ctx.raw):
+        responses.put(ctx.cache_key, (ctx.raw, f"{ctx.source} (Cache)", ctx.reasoning))
+
+
+async def extract(ctx: MessageContext) -> None:
+    parsed = parse_reply(ctx.raw)
+    ctx.display = parsed.display
+    ctx.calendar_blocks = parsed.calendar
+    ctx.note_blocks = parsed.notes
+    await cache_calendar_titles(ctx.calendar_blocks)
+
+
+async def fan_out(ctx: MessageContext) -> None:
+    # Senken unabhängig voneinander: ein hängender Telegram-Versand bremst die Web-Antwort nicht
+    results = await asyncio.gather(*(sink(ctx) for sink in ctx.sinks), return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"⚠️ Fan-out ({ctx.channel}) fehlgeschlagen: {result}")
+
+
+async def run_actions(ctx: MessageContext) -> None:
+    async def calendar() -> str:
+        if not ctx.calendar_blocks:
+            return ""
+        print("🔍 Prüfe KI-Antwort auf Kalender-Aktionen...")
+        return await asyncio.to_thread(process_calendar_blocks, ctx.calendar_blocks)
+
+    async def notes() -> str:
+        if not ctx.note_blocks:
+            return ""
+        print("🔍 Prüfe KI-Antwort auf Notizblock-Aktionen...")
+        return await process_note_blocks(ctx.note_blocks)
+
+    cal_status, note_status = await asyncio.gather(calendar(), notes())
+    for prefix, status in (("🗓️", cal_status), ("📝", note_status)):
+        if not status:
+            continue
+        ctx.statuses.append(status)
+        if ctx.notify_chat_id and _notifier:
+            await _notifier(ctx.notify_chat_id, f"{prefix} **Update:**\n{status}")
+
+
+async def save_reply(ctx: MessageContext) -> None:
+    """
+    Speichert die Antwort sofort statt erst im Hintergrund-Job. Für Kanäle mit
+    Reihenfolge je Chat (Telegram): die nächste Nachricht sieht den Austausch im Verlauf.
+    """
+    if await save_message("assistant", ctx.display) is not None:
+        ctx.reply_saved = True
+
+
+async def persist(ctx: MessageContext) -> None:
+    parts = ([] if ctx.reply_saved else [ctx.display]) + ctx.statuses
+    if not parts:
+        return
+    # Nach save_reply landen die Statusmeldungen als eigene Nachricht (wie in Telegram nachträglich gesendet)
+    if await save_message("assistant", "\n\n".join(parts)) is None:
+        raise RuntimeError("Antwort konnte nicht gespeichert werden")
+
+
+async def index_memory(ctx: MessageContext) -> None:
+    # Bettet neue Nachrichten erst ein, wenn sich genug für einen Chunk angesammelt haben
+    await memory.sync()
+
+
+class StageStats:
+    def __init__(self, window: int = 200):
+        self.calls = 0
+        self.errors = 0
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float, failed: bool) -> None:
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.samples.append(seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        ordered = sorted(self.samples)
+        # Nearest-Rank: kleinster Wert, unter dem mindestens 95 % der Messungen liegen
+        p95 = ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)] if ordered else 0.0
+        avg = sum(ordered) / len(ordered) if ordered else 0.0
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(avg * 1000, 1),
+            "p95_ms": round(p95 * 1000, 1),
+        }
+
+
+class MessagePipeline:
+    """
+    Gemeinsamer Ablauf aller Einstiegspunkte:
+    ingest → route → build → generate → extract → fan_out (Vordergrund) und
+    run_actions → persist → memory (Hintergrund, als Job in der persistenten Queue).
+    Stufen sind austauschbar (`replace`); jede wird einzeln gemessen.
+    """
+
+    def __init__(self, stages: List[Tuple[str, Stage]], background: List[Tuple[str, Stage]]):
+        self.stages = list(stages)
+        self.background = list(background)
+        self._stats: Dict[str, StageStats] = {}
+        self._detached: Set[asyncio.Task] = set()
+
+    def replace(self, name: str, stage: Stage) -> None:
+        for stages in (self.stages, self.background):
+            for i, (stage_name, _) in enumerate(stages):
+                if stage_name == name:
+                    stages[i] = (name, stage)
+                    return
+        raise KeyError(name)
+
+    async def _run_stage(self, name: str, stage: Stage, ctx: MessageContext) -> None:
+        start = time.perf_counter()
+        failed = True
+        try:
+            await stage(ctx)
+            failed = False
+        finally:
+            elapsed = time.perf_counter() - start
+            ctx.timings[name] = elapsed
+            self._stats.setdefault(name, StageStats()).record(elapsed, failed)
+            observe(f"pipeline.{name}", elapsed, "error" if failed else "ok")
+
+    async def run(self, ctx: MessageContext) -> MessageContext:
+        """Vordergrund-Stufen; Fehler gehen an den Einstiegspunkt."""
+        for name, stage in self.stages:
+            await self._run_stage(name, stage, ctx)
+        return ctx
+
+    async def finish(self, ctx: MessageContext, checkpoint=None) -> None:
+        """
+        Hintergrund-Stufen. Abgeschlossene Stufen landen in ctx.completed und
+        werden per `checkpoint` gesichert, damit ein Retry z.B. keine Termine
+        doppelt anlegt. Das Job-Timeout gilt je Stufe, außer für UNBOUNDED_STAGES.
+        Fehler gehen an die Job-Queue (Retry mit Backoff).
+        """
+        for name, stage in self.background:
+            if name in ctx.completed:
+                continue
+            if name in UNBOUNDED_STAGES:
+                await self._run_stage(name, stage, ctx)
+            else:
+                await asyncio.wait_for(self._run_stage(name, stage, ctx), timeout=jobs.timeout)
+            ctx.completed.append(name)
+            if checkpoint and name != self.background[-1][0]:
+                await checkpoint(ctx.to_job())
+
+    async def enqueue(self, ctx: MessageContext) -> None:
+        await jobs.enqueue(MESSAGE_JOB, ctx.to_job())
+
+    def detach(self, ctx: MessageContext) -> asyncio.Task:
+        """
+        run + enqueue als eigener Task, den der Aufrufer nicht besitzt: bricht
+        z.B. ein SSE-Client ab, werden Aktionen und Antwort trotzdem gespeichert.
+        """
+
+        async def process() -> MessageContext:
+            await self.run(ctx)
+            await self.enqueue(ctx)
+            return ctx
+
+        def done(task: asyncio.Task) -> None:
+            self._detached.discard(task)
+            # Ohne wartenden Client würde der Fehler sonst nirgends sichtbar
+            if not task.cancelled() and task.exception() is not None:
+                print(f"⚠️ Nachricht ({ctx.channel}) fehlgeschlagen: {task.exception()}")
+
+        task = asyncio.create_task(process())
+        self._detached.add(task)
+        task.add_done_callback(done)
+        return task
+
+    async def drain(self, timeout: float = 30.0) -> None:
+        """Beim Beenden: laufende abgekoppelte Nachrichten noch in die Job-Queue bringen."""
+        if self._detached:
+            await asyncio.wait(list(self._detached), timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        names = [name for name, _ in self.stages + self.background]
+        return {name: self._stats[name].summary() for name in names if name in self._stats}
+
+
+pipeline = MessagePipeline(
+    stages=[
+        ("ingest", ingest),
+        ("route", route),
+        ("build", build),
+        ("generate", generate),
+        ("extract", extract),
+        ("fan_out", fan_out),
+    ],
+    background=[
+        ("actions", run_actions),
+        ("persist", persist),
+        ("memory", index_memory),
+    ],
+)
+
+
+async def _run_message_job(payload: Dict[str, Any], checkpoint) -> None:
+    await pipeline.finish(MessageContext.from_job(payload), checkpoint)
+
+
+jobs.register(MESSAGE_JOB, _run_message_job, bounded=False)
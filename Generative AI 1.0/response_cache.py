@@ -0,0 +1,109 @@
+import datetime
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from action_blocks import parse_fields, parse_reply
+from database import get_table_version
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+# Tabellen, aus denen der System-Prompt besteht; jede Änderung ergibt einen neuen Schlüssel
+CONTEXT_TABLES = ("user_info", "notes", "calendar_cache", "calendar_events", "memory_chunks")
+# Füllwörter ändern die Frage nicht: "Zeig mir bitte mal meine Notizen" = "Zeig mir meine Notizen"
+FILLER_WORDS = frozenset("bitte mal doch denn eigentlich eben nochmal kurz gerne please".split())
+WORD_RE = re.compile(r"\w+")
+
+
+class TTLCache:
+    """
+    LRU-Cache mit Ablaufzeit je Eintrag und Trefferstatistik. Threadsicher,
+    weil z.B. die Kalender-Funktionen in Worker-Threads laufen.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+def normalize_message(text: str) -> str:
+    """Kleinbuchstaben ohne Akzente, Satzzeichen und Füllwörter: 'Was steht diese Woche an?!' -> 'was steht diese woche an'."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(w for w in WORD_RE.findall(folded) if w not in FILLER_WORDS)
+
+
+def response_key(message: str) -> Optional[str]:
+    """
+    Semantischer Schlüssel: normalisierte Nachricht plus Datum und Versionen
+    aller Tabellen im Prompt. Relative Angaben ("morgen") gelten nur am selben
+    Tag, jede Änderung an Notizen, Kalender oder Gedächtnis macht alte Einträge
+    unerreichbar (sie laufen per TTL/LRU aus).
+    """
+    normalized = normalize_message(message)
+    if not normalized:
+        return None
+    versions = ",".join(str(get_table_version(t)) for t in CONTEXT_TABLES)
+    raw = f"{datetime.date.today().isoformat()}|{versions}|{normalized}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def is_read_only(raw: str) -> bool:
+    """
+    Nur Antworten, die ausschließlich lesende Aktionen ('list') enthalten, sind
+    wiederholbar: ihr Ergebnis entsteht bei jeder Ausführung frisch. Antworten
+    mit add/delete/edit oder ganz ohne Aktion (vom Gesprächsverlauf abhängig)
+    werden nicht zwischengespeichert.
+    """
+    parsed = parse_reply(raw)
+    blocks = parsed.calendar + parsed.notes
+    return bool(blocks) and all(parse_fields(b).get("action", "").lower() == "list" for b in blocks)
+
+
+responses = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
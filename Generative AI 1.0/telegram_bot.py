@@ -1,54 +1,164 @@
 import os
 import asyncio
-import fitz  # PyMuPDF
-import re
+import hashlib
+import secrets
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Deque, Dict, Optional, Tuple
 from telegram import Update
 from telegram.ext import (
+    Application,
     ApplicationBuilder,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     filters,
     ContextTypes,
 )
 
-from database import save_message
-from calendar_utils import process_calendar_event
-from notepad_utils import process_notepad_event
-from ai_logic import fetch_llm_response, fetch_gemini_vision, transcribe_audio
+from telegram.request import HTTPXRequest
 
-ALLOWED_ID = os.getenv("ALLOWED_TELEGRAM_ID")
+from ai_logic import stream_transcription
+from documents import document_prompt, engine as document_engine
+from pipeline import MessageContext, pipeline, save_reply
+from tracing import span
 
+ALLOWED_ID = os.getenv("ALLOWED_TELEGRAM_ID")
+# Mindestabstand zwischen zwei Zwischenstand-Edits des Transkripts (Telegram-Flood-Limits)
+TRANSCRIPT_EDIT_INTERVAL = 1.0
+# Gesetzt = Webhook-Modus: Telegram schickt Updates an <URL> (Route /telegram/webhook), kein Polling
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+# Wird bei setWebhook hinterlegt und von Telegram in jedem Request mitgeschickt
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+# Gleichzeitig verarbeitete Updates (über alle Chats)
+TELEGRAM_CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "8"))
+# Alternative Bot-API (z.B. fake_telegram.py oder ein lokaler Bot-API-Server)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+
+class TracedRequest(HTTPXRequest):
+    """Misst jeden Bot-API-Aufruf (sendMessage, sendPhoto, ...) als Span 'telegram.<methode>'."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        with span(f"telegram.{url.rsplit('/', 1)[-1]}"):
+            return await super().do_request(url, method, *args, **kwargs)
+
+
+class ChatOrder:
+    """
+    Reihenfolge je Chat bei nebenläufiger Verarbeitung: Updates stellen sich
+    beim Eintreffen an, `turn()` wartet, bis alle früheren Updates desselben
+    Chats fertig sind. Vorarbeiten (Download, PDF-Extraktion, Transkription)
+    laufen parallel, die Antworten eines Chats entstehen trotzdem in der
+    Reihenfolge der Nachrichten und sehen jeweils den vorherigen Austausch
+    (run_pipeline speichert die Antwort dafür noch innerhalb von `turn()`).
+    """
+
+    def __init__(self):
+        self._queues: Dict[int, Deque[Tuple[int, asyncio.Event]]] = {}
+
+    @staticmethod
+    def _key(update: object) -> Optional[Tuple[int, int]]:
+        if isinstance(update, Update) and update.effective_chat:
+            return update.effective_chat.id, update.update_id
+        return None
 
-async def is_allowed(update: Update) -> bool:
-    user_id = str(update.effective_user.id) if update.effective_user else ""
-    return user_id == ALLOWED_ID
+    def enter(self, update: object) -> None:
+        key = self._key(update)
+        if key is None:
+            return
+        queue = self._queues.setdefault(key[0], deque())
+        event = asyncio.Event()
+        if not queue:
+            event.set()
+        queue.append((key[1], event))
+
+    def leave(self, update: object) -> None:
+        key = self._key(update)
+        queue = self._queues.get(key[0]) if key else None
+        if not queue:
+            return
+        for i, (update_id, _) in enumerate(queue):
+            if update_id == key[1]:
+                del queue[i]
+                break
+        if queue:
+            queue[0][1].set()
+        else:
+            del self._queues[key[0]]
+
+    @asynccontextmanager
+    async def turn(self, update: object):
+        key = self._key(update)
+        for update_id, event in self._queues.get(key[0], ()) if key else ():
+            if update_id == key[1]:
+                await event.wait()
+                break
+        try:
+            yield
+        finally:
+            self.leave(update)
 
 
-def extract_pdf_text(file_bytes: bytes) -> str:
-    doc = fitz.open(stream=file_bytes, filetype="pdf")
-    return "\n".join(page.get_text() for page in doc)
+chat_order = ChatOrder()
 
 
-async def background_calendar_task_tg(ai_msg: str, display_msg: str, bot, chat_id):
-    """Hintergrund-Task für Telegram, der nachträglich das Kalenderergebnis liefert"""
-    cal_status = await asyncio.to_thread(process_calendar_event, ai_msg)
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Nebenläufige Updates (bis `max_concurrent_updates`) mit Reihenfolge je Chat über `chat_order`."""
 
-    if cal_status:
-        display_msg += f"\n\n{cal_status}"
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # Läuft in Eingangsreihenfolge an (FIFO-Semaphore), daher vor dem ersten await anstellen
+        chat_order.enter(update)
         try:
-            await bot.send_message(chat_id=chat_id, text=f"🗓️ **Update:**\n{cal_status}")
-        except Exception as e:
-            print(f"⚠️ Background Telegram Error (Calendar): {e}")
+            await coroutine
+        finally:
+            # Handler ohne Pipeline (z.B. /start, abgewiesene Nutzer) geben ihren Platz hier frei
+            chat_order.leave(update)
 
-    note_status = await process_notepad_event(ai_msg)
-    if note_status:
-        display_msg += f"\n\n{note_status}"
-        try:
-            await bot.send_message(chat_id=chat_id, text=f"📝 **Update:**\n{note_status}")
-        except Exception as e:
-            print(f"⚠️ Background Telegram Error (Notepad): {e}")
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+async def is_allowed(update: Update) -> bool:
+    user_id = str(update.effective_user.id) if update.effective_user else ""
+    return user_id == ALLOWED_ID
 
-    await save_message("assistant", display_msg)
+
+def _reply_sink(update: Update):
+    async def reply(ctx: MessageContext) -> None:
+        await update.message.reply_text(ctx.display)
+
+    return reply
+
+
+async def run_pipeline(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    message: str,
+    history_entry: str,
+    image_bytes: bytes = None,
+) -> None:
+    async with chat_order.turn(update):
+        ctx = await pipeline.run(
+            MessageContext(
+                message,
+                history_entry=history_entry,
+                image_bytes=image_bytes,
+                channel="telegram",
+                # Nutzer bekommt SOFORT die Antwort
+                sinks=[_reply_sink(update)],
+                # Ergebnisse der Kalender-/Notizblock-Aktionen kommen nachträglich in diesen Chat
+                notify_chat_id=str(update.effective_chat.id),
+            )
+        )
+        # Antwort vor dem nächsten Update desselben Chats im Verlauf, sonst fehlt sie dessen Kontext
+        await save_reply(ctx)
+    # Kalender-/Notizblock-Aktionen und Gedächtnis laufen unsichtbar in der persistenten Job-Queue
+    await pipeline.enqueue(ctx)
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -60,33 +170,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not user_msg:
         return
 
-    await save_message("user", user_msg)
-
     try:
         await context.bot.send_chat_action(
             chat_id=update.effective_chat.id, action="typing"
         )
-
-        # Nativer Async-Aufruf
-        response = await fetch_llm_response(user_msg)
-        ai_msg = response.get("content", "Fehler bei der KI-Generierung.")
-
-        display_msg = re.sub(
-            r"\[CALENDAR_EVENT\].*?\[/CALENDAR_EVENT\]", "", ai_msg, flags=re.DOTALL
-        )
-        display_msg = re.sub(
-            r"\[NOTE_EVENT\].*?\[/NOTE_EVENT\]", "", display_msg, flags=re.DOTALL
-        ).strip()
-
-        # Nutzer bekommt SOFORT die Antwort
-        await update.message.reply_text(display_msg)
-
-        # Kalender & Speichern wird unsichtbar in den Hintergrund ausgelagert
-        asyncio.create_task(
-            background_calendar_task_tg(
-                ai_msg, display_msg, context.bot, update.effective_chat.id
-            )
-        )
+        await run_pipeline(update, context, user_msg, user_msg)
 
     except Exception as e:
         print(f"❌ Fehler in handle_message: {e}")
@@ -107,23 +195,12 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         image_bytes = await photo_file.download_as_bytearray()
         caption = update.message.caption or ""
 
-        response = await fetch_gemini_vision(caption, bytes(image_bytes))
-        ai_msg = response.get("content", "Fehler bei der Bildanalyse.")
-
-        display_msg = re.sub(
-            r"\[CALENDAR_EVENT\].*?\[/CALENDAR_EVENT\]", "", ai_msg, flags=re.DOTALL
-        )
-        display_msg = re.sub(
-            r"\[NOTE_EVENT\].*?\[/NOTE_EVENT\]", "", display_msg, flags=re.DOTALL
-        ).strip()
-
-        await update.message.reply_text(display_msg)
-
-        await save_message("user", f"[Bild gesendet] {caption}")
-        asyncio.create_task(
-            background_calendar_task_tg(
-                ai_msg, display_msg, context.bot, update.effective_chat.id
-            )
+        await run_pipeline(
+            update,
+            context,
+            caption,
+            f"[Bild gesendet] {caption}",
+            image_bytes=bytes(image_bytes),
         )
 
     except Exception as e:
@@ -146,32 +223,19 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         caption = update.message.caption or "Extrahiere Termine aus diesem Dokument."
         mime_type = update.message.document.mime_type
 
-        if mime_type == "application/pdf":
-            extracted_text = await asyncio.to_thread(extract_pdf_text, doc_bytes)
-            full_prompt = f"{caption}\n\nDokumentinhalt:\n{extracted_text}"
-            response = await fetch_llm_response(full_prompt)
-        else:
+        if mime_type != "application/pdf":
             await update.message.reply_text(
                 "⚠️ Nur PDF-Dokumente werden aktuell unterstützt."
             )
             return
 
-        ai_msg = response.get("content", "Fehler bei der Dokumentenanalyse.")
-
-        display_msg = re.sub(
-            r"\[CALENDAR_EVENT\].*?\[/CALENDAR_EVENT\]", "", ai_msg, flags=re.DOTALL
-        )
-        display_msg = re.sub(
-            r"\[NOTE_EVENT\].*?\[/NOTE_EVENT\]", "", display_msg, flags=re.DOTALL
-        ).strip()
-
-        await update.message.reply_text(display_msg)
-
-        await save_message("user", f"[Dokument gesendet] {caption}")
-        asyncio.create_task(
-            background_calendar_task_tg(
-                ai_msg, display_msg, context.bot, update.effective_chat.id
-            )
+        doc = await document_engine.extract(bytes(doc_bytes))
+        await run_pipeline(
+            update,
+            context,
+            document_prompt(caption, doc),
+            f"[Dokument gesendet] {caption}",
+            doc.preview_image,
         )
 
     except Exception as e:
@@ -194,39 +258,33 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         voice_file = await update.message.voice.get_file()
         audio_bytes = await voice_file.download_as_bytearray()
 
-        # Transkribieren
-        user_msg = await transcribe_audio(bytes(audio_bytes), filename="voice.ogg")
+        # Transkribieren: Zwischenstände live in einer Statusnachricht anzeigen
+        status_msg = await update.message.reply_text("🎤 Transkribiere...")
+        user_msg = ""
+        last_edit = time.monotonic()
+        async for user_msg in stream_transcription(bytes(audio_bytes), filename="voice.ogg"):
+            if time.monotonic() - last_edit >= TRANSCRIPT_EDIT_INTERVAL:
+                last_edit = time.monotonic()
+                try:
+                    await status_msg.edit_text(f"🎤 {user_msg} …")
+                except Exception:
+                    pass
 
         if not user_msg:
-            await update.message.reply_text(
+            await status_msg.edit_text(
                 "🎤 **Sprachmemo konnte nicht verarbeitet werden.**\n\n"
                 "Bitte stelle sicher, dass ein gültiger `GEMINI_API_KEY` oder `OPENAI_API_KEY` in der `.env`-Datei auf dem Server konfiguriert ist, da die serverbasierte Transkription diese benötigt."
             )
             return
 
         # Dem Nutzer das Transkript zur Rückmeldung senden
-        await update.message.reply_text(f"🎤 **Transkript:** \"{user_msg}\"")
-
-        await save_message("user", f"[Sprachmemo] {user_msg}")
+        try:
+            await status_msg.edit_text(f"🎤 **Transkript:** \"{user_msg}\"")
+        except Exception:
+            await update.message.reply_text(f"🎤 **Transkript:** \"{user_msg}\"")
 
         # Identisch zu handle_message verarbeiten
-        response = await fetch_llm_response(user_msg)
-        ai_msg = response.get("content", "Fehler bei der KI-Generierung.")
-
-        display_msg = re.sub(
-            r"\[CALENDAR_EVENT\].*?\[/CALENDAR_EVENT\]", "", ai_msg, flags=re.DOTALL
-        )
-        display_msg = re.sub(
-            r"\[NOTE_EVENT\].*?\[/NOTE_EVENT\]", "", display_msg, flags=re.DOTALL
-        ).strip()
-
-        await update.message.reply_text(display_msg)
-
-        asyncio.create_task(
-            background_calendar_task_tg(
-                ai_msg, display_msg, context.bot, update.effective_chat.id
-            )
-        )
+        await run_pipeline(update, context, user_msg, f"[Sprachmemo] {user_msg}")
 
     except Exception as e:
         print(f"❌ Fehler in handle_voice: {e}")
@@ -267,12 +325,65 @@ def setup_telegram(token: str):
         print("⚠️ Kein Telegram Token gefunden! Bot wird nicht gestartet.")
         return None
 
-    app = ApplicationBuilder().token(token).build()
+    # getUpdates (Long Polling) nutzt eine eigene Request-Instanz und wird nicht gemessen
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .request(TracedRequest(connection_pool_size=256))
+        .concurrent_updates(ChatOrderedUpdateProcessor(TELEGRAM_CONCURRENT_UPDATES))
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    if TELEGRAM_WEBHOOK_URL:
+        # Updates kommen über die FastAPI-Route, kein Updater/Polling nötig
+        builder = builder.updater(None)
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start_command))
+    # Schnellkommandos beantwortet der Intent-Router ohne LLM
+    app.add_handler(CommandHandler(["heute", "morgen", "woche", "notizen", "notiz"], handle_message))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
     app.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     app.add_handler(MessageHandler(filters.VOICE, handle_voice))
 
     return app
+
+
+async def start_telegram(app: Application) -> None:
+    await app.initialize()
+    await app.start()
+    if TELEGRAM_WEBHOOK_URL:
+        await app.bot.set_webhook(
+            url=TELEGRAM_WEBHOOK_URL,
+            secret_token=webhook_secret(app),
+            max_connections=TELEGRAM_CONCURRENT_UPDATES,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=True,
+        )
+        print(f"🪝 Telegram-Webhook aktiv: {TELEGRAM_WEBHOOK_URL}")
+    else:
+        await app.updater.start_polling(drop_pending_updates=True)
+
+
+async def stop_telegram(app: Application) -> None:
+    if app.updater and app.updater.running:
+        await app.updater.stop()
+    if app.running:
+        await app.stop()
+    await app.shutdown()
+
+
+def webhook_secret(app: Application) -> str:
+    """Ohne TELEGRAM_WEBHOOK_SECRET aus dem Bot-Token abgeleitet: alle Worker-Prozesse (und Neustarts) erwarten dasselbe."""
+    return TELEGRAM_WEBHOOK_SECRET or hashlib.sha256(f"webhook:{app.bot.token}".encode()).hexdigest()
+
+
+def check_webhook_secret(app: Application, secret: Optional[str]) -> bool:
+    return secrets.compare_digest(secret or "", webhook_secret(app))
+
+
+async def feed_update(app: Application, data: dict) -> None:
+    """Reiht ein per Webhook empfangenes Update ein (nur im Prozess, der den Bot betreibt)."""
+    # Antwort an Telegram sofort, verarbeitet wird nebenläufig über die update_queue
+    await app.update_queue.put(Update.de_json(data, app.bot))
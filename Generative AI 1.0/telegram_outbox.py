@@ -0,0 +1,261 @@
+import asyncio
+import os
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+# Telegram erlaubt etwa eine Nachricht pro Sekunde und Chat (kurze Bursts) und ~30/s insgesamt
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))
+# Obergrenze wartender Nachrichten; darüber wird verworfen statt den Aufrufer zu blockieren
+TELEGRAM_OUTBOX_LIMIT = int(os.getenv("TELEGRAM_OUTBOX_LIMIT", "200"))
+TELEGRAM_MAX_ATTEMPTS = 5
+TELEGRAM_BACKOFF_BASE = 1.0
+TELEGRAM_DRAIN_TIMEOUT = 10.0
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+
+
+def _seconds(value) -> float:
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT):
+    """Teilt lange Texte an Zeilenumbrüchen in Stücke unterhalb des Telegram-Limits."""
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        yield text[:cut]
+        text = text[cut:].lstrip("\n")
+    if text:
+        yield text
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> None:
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        """Nach einem 429: erst nach `seconds` wieder Tokens ausgeben."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+
+class Outgoing:
+    def __init__(self, chat_id: str, kind: str, text: str = "", path: Optional[str] = None):
+        self.chat_id = chat_id
+        # "message", "photo", "document" oder "voice"
+        self.kind = kind
+        # Nachrichtentext bzw. Bildunterschrift
+        self.text = text
+        self.path = path
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"chat_id": self.chat_id, "kind": self.kind, "text": self.text, "path": self.path}
+
+
+class TelegramOutbox:
+    """
+    Ausgehende Telegram-Nachrichten mit eigener Warteschlange je Chat: Aufrufer
+    (Web-Endpunkte, Job-Statusmeldungen) legen nur ab und warten nie auf
+    Telegram. Pro Chat wird in Reihenfolge gesendet, begrenzt durch einen
+    Token-Bucket je Chat und einen globalen. Bei 429 wird die von Telegram
+    genannte Zeit abgewartet, bei Netzwerkfehlern mit Backoff wiederholt.
+    "Du:" und "KI:" gehen nach Möglichkeit als eine Nachricht raus; staut sich
+    ein Chat, werden aufeinanderfolgende Texte zusammengelegt.
+    Worker ohne eigenen Bot (mehrere Prozesse, nur der Leader hält den Bot)
+    reichen ihre Nachrichten per `forward()` an den Leader weiter.
+    """
+
+    def __init__(
+        self,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        chat_burst: int = TELEGRAM_CHAT_BURST,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        limit: int = TELEGRAM_OUTBOX_LIMIT,
+        max_attempts: int = TELEGRAM_MAX_ATTEMPTS,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.limit = limit
+        self.max_attempts = max_attempts
+        self.bot = None
+        self._forward: Optional[Callable[[Outgoing], Awaitable[None]]] = None
+        self._forwarding: Set[asyncio.Task] = set()
+        self._queues: Dict[str, Deque[Outgoing]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._global = TokenBucket(global_rate, int(global_rate))
+        self.pending = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def running(self) -> bool:
+        return self.bot is not None
+
+    def start(self, bot) -> None:
+        self.bot = bot
+
+    def forward(self, sink: Optional[Callable[[Outgoing], Awaitable[None]]]) -> None:
+        """Ohne Bot: Nachrichten an `sink` übergeben (z.B. als Job für den Leader)."""
+        self._forward = sink
+
+    def send_text(self, chat_id: str, text: str) -> None:
+        for part in split_text(text):
+            self.put(Outgoing(str(chat_id), "message", part))
+
+    def send_file(self, chat_id: str, kind: str, path: str, caption: str = "") -> None:
+        self.put(Outgoing(str(chat_id), kind, caption[:CAPTION_LIMIT], path))
+
+    def mirror(self, chat_id: str, user_text: str, reply: str, kind: Optional[str] = None, path: Optional[str] = None) -> None:
+        """Nutzernachricht (ggf. mit Anhang) und Antwort, als eine Nachricht, wenn es die Limits erlauben."""
+        reply_text = f"KI:\n{reply}"
+        combined = f"{user_text}\n\n{reply_text}"
+        if kind is None:
+            if len(combined) <= MESSAGE_LIMIT:
+                self.coalesced += 1
+                self.send_text(chat_id, combined)
+            else:
+                self.send_text(chat_id, user_text)
+                self.send_text(chat_id, reply_text)
+        elif len(combined) <= CAPTION_LIMIT:
+            self.coalesced += 1
+            self.send_file(chat_id, kind, path, combined)
+        else:
+            self.send_file(chat_id, kind, path, user_text)
+            self.send_text(chat_id, reply_text)
+
+    def put(self, item: Outgoing) -> None:
+        if self.bot is None:
+            if self._forward is not None:
+                task = asyncio.create_task(self._forward(item))
+                self._forwarding.add(task)
+                task.add_done_callback(self._forwarding.discard)
+            return
+        if self.pending >= self.limit:
+            self.dropped += 1
+            print(f"⚠️ Telegram-Warteschlange voll, Nachricht an {item.chat_id} verworfen.")
+            return
+        self._queues.setdefault(item.chat_id, deque()).append(item)
+        self.pending += 1
+        if item.chat_id not in self._workers:
+            self._workers[item.chat_id] = asyncio.create_task(
+                self._drain(item.chat_id), name=f"telegram-outbox-{item.chat_id}"
+            )
+
+    async def _drain(self, chat_id: str) -> None:
+        queue = self._queues[chat_id]
+        bucket = self._buckets.setdefault(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+        try:
+            while queue:
+                item = queue.popleft()
+                self.pending -= 1
+                if item.kind == "message":
+                    # Rückstau (Rate-Limit, 429): aufeinanderfolgende Texte zusammenlegen
+                    while (
+                        queue
+                        and queue[0].kind == "message"
+                        and len(item.text) + 2 + len(queue[0].text) <= MESSAGE_LIMIT
+                    ):
+                        item.text += "\n\n" + queue.popleft().text
+                        self.pending -= 1
+                        self.coalesced += 1
+                await self._deliver(item, bucket)
+        finally:
+            del self._workers[chat_id]
+
+    async def _deliver(self, item: Outgoing, bucket: TokenBucket) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                await self._send(item)
+                self.sent += 1
+                return
+            except RetryAfter as e:
+                delay = _seconds(e.retry_after)
+                bucket.pause(delay)
+                self.retried += 1
+                print(f"⏳ Telegram-Limit für {item.chat_id}, nächster Versuch in {delay:.0f}s.")
+            except (BadRequest, Forbidden) as e:
+                if item.kind == "voice":
+                    # z.B. Sprachnachrichten in den Privatsphäre-Einstellungen gesperrt
+                    item.kind = "document"
+                    continue
+                self.failed += 1
+                print(f"⚠️ Telegram-Versand an {item.chat_id} abgelehnt: {e}")
+                return
+            except NetworkError as e:
+                self.retried += 1
+                delay = TELEGRAM_BACKOFF_BASE * 2 ** (attempt - 1)
+                print(f"⚠️ Telegram-Versand fehlgeschlagen, Retry in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+            except Exception as e:
+                self.failed += 1
+                print(f"⚠️ Telegram-Versand an {item.chat_id} fehlgeschlagen: {e}")
+                return
+        self.failed += 1
+        print(f"❌ Telegram-Versand an {item.chat_id} nach {self.max_attempts} Versuchen aufgegeben.")
+
+    async def _send(self, item: Outgoing) -> None:
+        if item.kind == "message":
+            await self.bot.send_message(chat_id=item.chat_id, text=item.text)
+            return
+        with open(item.path, "rb") as f:
+            send = getattr(self.bot, f"send_{item.kind}")
+            await send(item.chat_id, f, caption=item.text or None)
+
+    async def stop(self, drain_timeout: float = TELEGRAM_DRAIN_TIMEOUT) -> None:
+        """Wartet bis zu `drain_timeout` Sekunden auf ausstehende Nachrichten."""
+        workers = list(self._workers.values()) + list(self._forwarding)
+        if workers:
+            done, pending = await asyncio.wait(workers, timeout=drain_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                print(f"⏹️ {self.pending} Telegram-Nachrichten beim Beenden verworfen.")
+        self._queues.clear()
+        self.pending = 0
+        self.bot = None
+
+    def stats(self) -> Dict:
+        return {
+            "running": self.running,
+            "forwarding": self.bot is None and self._forward is not None,
+            "pending": self.pending,
+            "chats": len(self._workers),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+outbox = TelegramOutbox()
@@ -0,0 +1,23 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Module liegen flach neben main.py; Tests laufen mit `python -m pytest` aus diesem Ordner
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """Leere Datenbank mit allen Tabellen; die Verbindungen werden danach wieder geschlossen."""
+    import database
+
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "test.db"))
+
+    async def init():
+        await database.init_db()
+        await database.close_db()
+
+    asyncio.run(init())
+    return database.DB_PATH
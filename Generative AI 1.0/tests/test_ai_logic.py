@@ -0,0 +1,68 @@
+import asyncio
+
+import ai_logic
+import database
+
+
+def test_memory_fragment_follows_memory_ready(temp_db, monkeypatch):
+    monkeypatch.setattr(ai_logic, "_prompt_fragments", {})
+    monkeypatch.setattr(ai_logic.memory, "ready", False)
+
+    async def scenario():
+        await database.init_db()
+        try:
+            await database.save_info("Name", "Alex")
+            await database.save_info(ai_logic.SUMMARY_KEY, "- mag Tee")
+            before = await ai_logic._cached_fragment("user_info", ai_logic._memory_fragment, ai_logic.memory.ready)
+            # Vektor-Gedächtnis wird bereit, ohne dass sich user_info ändert
+            ai_logic.memory.ready = True
+            after = await ai_logic._cached_fragment("user_info", ai_logic._memory_fragment, ai_logic.memory.ready)
+            return before, after
+        finally:
+            await database.close_db()
+
+    before, after = asyncio.run(scenario())
+    assert "mag Tee" in before and "Alex" in before
+    assert "mag Tee" not in after and "Alex" in after
+
+
+def _summary_runs(monkeypatch, prices):
+    async def summarize(prompt):
+        return "- mag Tee", "OpenAI", ai_logic.MODEL_OPENAI, 1_000_000, 500_000
+
+    monkeypatch.setattr(ai_logic, "client_openai", object())
+    monkeypatch.setattr(ai_logic, "_summarize", summarize)
+    monkeypatch.setattr(ai_logic, "MODEL_PRICES", prices)
+    monkeypatch.setattr(ai_logic.memory, "ready", False)
+
+    async def scenario():
+        await database.init_db()
+        try:
+            for i in range(3):
+                await database.save_message("user", f"Nachricht {i}")
+            assert await ai_logic.update_long_term_memory() == 3
+            return await database.get_summary_stats()
+        finally:
+            await database.close_db()
+
+    return asyncio.run(scenario())
+
+
+def test_summary_cost_stays_empty_without_price(temp_db, monkeypatch):
+    stats = _summary_runs(monkeypatch, {ai_logic.MODEL_OPENAI: None})
+    assert stats["tokens"] == 1_500_000
+    assert stats["cost_usd"] == 0 and stats["unpriced_runs"] == 1
+
+
+def test_summary_cost_uses_configured_price(temp_db, monkeypatch):
+    stats = _summary_runs(monkeypatch, {ai_logic.MODEL_OPENAI: (0.5, 2.0)})
+    assert stats["cost_usd"] == 1.5 and stats["unpriced_runs"] == 0
+
+
+def test_model_price_from_env(monkeypatch):
+    monkeypatch.setenv("LLM_PRICE_TEST", "0.25, 2")
+    assert ai_logic._model_price("LLM_PRICE_TEST") == (0.25, 2.0)
+    monkeypatch.setenv("LLM_PRICE_TEST", "teuer")
+    assert ai_logic._model_price("LLM_PRICE_TEST") is None
+    monkeypatch.delenv("LLM_PRICE_TEST")
+    assert ai_logic._model_price("LLM_PRICE_TEST") is None
@@ -0,0 +1,242 @@
+import datetime
+import json
+
+import httplib2
+import pytest
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence
+
+import calendar_mirror
+import calendar_utils
+import google_calendar
+
+BOUNDARY = "batch_test"
+
+
+class RecordingSequence(HttpMockSequence):
+    """HttpMockSequence, die die gesendeten Batch-Bodies mitschreibt und optional abbricht."""
+
+    def __init__(self, responses, fail_at: int = None):
+        super().__init__(responses)
+        self.bodies = []
+        self.fail_at = fail_at
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        if self.fail_at is not None and len(self.bodies) == self.fail_at:
+            self.bodies.append(body)
+            raise httplib2.ServerNotFoundError("Verbindung abgebrochen")
+        self.bodies.append(body)
+        return super().request(uri, method, body, headers, **kwargs)
+
+
+def batch_response(parts):
+    """parts: (request_id, status, body) -> multipart/mixed-Antwort des Batch-Endpunkts."""
+    chunks = []
+    for request_id, status, body in parts:
+        payload = json.dumps(body) if body is not None else ""
+        chunks.append(
+            f"--{BOUNDARY}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <response-test + {request_id}>\r\n\r\n"
+            f"HTTP/1.1 {status} {'OK' if status < 400 else 'Error'}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n"
+            f"{payload}\r\n"
+        )
+    headers = {"status": "200", "content-type": f'multipart/mixed; boundary="{BOUNDARY}"'}
+    return headers, "".join(chunks) + f"--{BOUNDARY}--"
+
+
+def event(event_id: str, summary: str, start: datetime.datetime) -> dict:
+    return {
+        "id": event_id,
+        "summary": summary,
+        "htmlLink": f"https://calendar.test/{event_id}",
+        "start": {"dateTime": start.isoformat() + "Z"},
+        "end": {"dateTime": (start + datetime.timedelta(hours=1)).isoformat() + "Z"},
+    }
+
+
+def error(status: int, message: str) -> dict:
+    return {"error": {"code": status, "message": message, "errors": [{"reason": message}]}}
+
+
+@pytest.fixture
+def calendar(temp_db, monkeypatch):
+    """Service gegen eine HttpMockSequence; Spiegel in der Test-DB, kein Sync mit Google."""
+    state = {}
+
+    def install(responses, fail_at=None):
+        http = RecordingSequence(responses, fail_at)
+        state["service"] = build("calendar", "v3", http=http, static_discovery=True, cache_discovery=False)
+        return http
+
+    monkeypatch.setattr(google_calendar, "get_calendar_service", lambda: state.get("service"))
+    monkeypatch.setattr(google_calendar, "_ensure_synced", lambda: None)
+    soon = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(days=2)
+    calendar_mirror.upsert_event(event("zahnarzt1", "Zahnarzt", soon), "UTC")
+    calendar_mirror.upsert_event(event("meeting1", "Meeting", soon), "UTC")
+    calendar_mirror.upsert_event(event("meeting2", "Meeting", soon + datetime.timedelta(hours=3)), "UTC")
+    return install
+
+
+def mirror_ids():
+    return {e["id"] for e in calendar_mirror.query_events("2000-01-01T00:00:00", "2100-01-01T00:00:00")}
+
+
+def add(title: str) -> tuple:
+    return ("add", {"summary": title, "start_time": "2030-01-01T10:00:00Z"})
+
+
+def test_mixed_batch_in_operation_order(calendar):
+    soon = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(days=2)
+    http = calendar([
+        batch_response([
+            # Antworten bewusst in anderer Reihenfolge als die Requests
+            (3, 204, None),
+            (0, 200, event("neu1", "Sport", soon)),
+            (2, 204, None),
+            (1, 200, event("zahnarzt1", "Zahnarzt (verschoben)", soon)),
+        ])
+    ])
+    results = google_calendar.execute_batch([
+        add("Sport"),
+        ("edit", {"old_summary": "Zahnarzt", "new_summary": "Zahnarzt (verschoben)"}),
+        ("delete", {"summary": "Meeting"}),
+    ])
+
+    assert len(http.bodies) == 1
+    assert results == [
+        "Erfolgreich hinzugefügt (Link: https://calendar.test/neu1)",
+        "Aktualisiert (Link: https://calendar.test/zahnarzt1)",
+        "Erfolgreich gelöscht: 2 Termin(e).",
+    ]
+    assert mirror_ids() == {"zahnarzt1", "neu1"}
+
+
+def test_per_item_errors(calendar):
+    soon = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(days=2)
+    calendar([
+        batch_response([
+            (0, 400, error(400, "badRequest")),
+            (1, 200, event("neu2", "Lesen", soon)),
+            (2, 404, error(404, "notFound")),
+            (3, 204, None),
+        ])
+    ])
+    results = google_calendar.execute_batch([
+        add("Kaputt"),
+        add("Lesen"),
+        ("delete", {"summary": "Meeting"}),
+        ("delete", {"summary": "Gibt es nicht"}),
+    ])
+
+    assert results[0].startswith("Google API Fehler (400)")
+    assert results[1] == "Erfolgreich hinzugefügt (Link: https://calendar.test/neu2)"
+    # Ein Löschfehler (z.B. schon gelöscht) zählt nicht mit
+    assert results[2] == "Erfolgreich gelöscht: 1 Termin(e)."
+    assert results[3] == "Fehler: Termin 'Gibt es nicht' nicht gefunden."
+
+
+def test_splits_into_chunks_of_batch_limit(calendar):
+    soon = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(days=2)
+    count = google_calendar.BATCH_LIMIT + 5
+    http = calendar([
+        batch_response([(n, 200, event(f"e{n}", f"T{n}", soon)) for n in range(google_calendar.BATCH_LIMIT)]),
+        batch_response([(n, 200, event(f"e{n}", f"T{n}", soon)) for n in range(google_calendar.BATCH_LIMIT, count)]),
+    ])
+    results = google_calendar.execute_batch([add(f"T{n}") for n in range(count)])
+
+    assert [body.count("Content-ID") for body in http.bodies] == [google_calendar.BATCH_LIMIT, 5]
+    assert results == [f"Erfolgreich hinzugefügt (Link: https://calendar.test/e{n})" for n in range(count)]
+
+
+def test_lost_chunk_is_reported_as_unknown(calendar):
+    soon = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(days=2)
+    limit = google_calendar.BATCH_LIMIT
+    http = calendar(
+        [batch_response([(n, 200, event(f"e{n}", f"T{n}", soon)) for n in range(limit)])],
+        fail_at=1,
+    )
+    results = google_calendar.execute_batch([add(f"T{n}") for n in range(limit + 2)])
+
+    assert len(http.bodies) == 2
+    assert all(r.startswith("Erfolgreich hinzugefügt") for r in results[:limit])
+    assert all(r.startswith("Status unbekannt") for r in results[limit:])
+
+
+def test_process_calendar_blocks_keeps_block_order(calendar):
+    soon = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(days=2)
+    calendar([
+        batch_response([
+            (1, 204, None),
+            (2, 204, None),
+            (0, 200, event("neu3", "Yoga", soon)),
+        ])
+    ])
+    blocks = [
+        "Action: add\nTitle: Yoga\nStart: 2030-01-01T10:00:00Z",
+        "Action: add\nTitle: Ohne Start",
+        "Action: delete\nTitle: Meeting",
+    ]
+    lines = calendar_utils.process_calendar_blocks(blocks).split("\n")
+
+    assert lines == [
+        "✅ Erfolgreich hinzugefügt (Link: https://calendar.test/neu3)",
+        "⚠️ Fehler: Für 'add' fehlen Titel oder Startzeit.",
+        "🗑️ Erfolgreich gelöscht: 2 Termin(e).",
+    ]
+
+
+def test_process_calendar_blocks_batch_exception_is_not_reported_as_failed(calendar, monkeypatch):
+    def broken(operations):
+        raise RuntimeError("Verbindung weg")
+
+    monkeypatch.setattr(google_calendar, "execute_batch", broken)
+    blocks = [
+        "Action: add\nTitle: Yoga\nStart: 2030-01-01T10:00:00Z",
+        "Action: delete\nTitle: Meeting",
+    ]
+    lines = calendar_utils.process_calendar_blocks(blocks).split("\n")
+
+    assert lines == ["⚠️ Status unbekannt (Verbindung weg), bitte im Kalender prüfen."] * 2
+
+
+def test_add_then_edit_sends_the_edit_after_the_add(calendar):
+    soon = datetime.datetime.utcnow().replace(microsecond=0) + datetime.timedelta(days=2)
+    http = calendar([
+        batch_response([
+            (0, 200, event("neu4", "Friseur", soon)),
+            (1, 200, event("neu5", "Sport", soon)),
+        ]),
+        batch_response([(2, 200, event("neu4", "Friseur (verschoben)", soon))]),
+    ])
+    results = google_calendar.execute_batch([
+        add("Friseur"),
+        add("Sport"),
+        ("edit", {"old_summary": "Friseur", "new_summary": "Friseur (verschoben)"}),
+    ])
+
+    # Die Suche für das edit sieht den gerade angelegten Termin
+    assert len(http.bodies) == 2
+    assert "events/neu4" in http.bodies[1]
+    assert results == [
+        "Erfolgreich hinzugefügt (Link: https://calendar.test/neu4)",
+        "Erfolgreich hinzugefügt (Link: https://calendar.test/neu5)",
+        "Aktualisiert (Link: https://calendar.test/neu4)",
+    ]
+
+
+def test_second_delete_of_same_title_sees_the_first(calendar):
+    http = calendar([batch_response([(0, 204, None)])])
+    results = google_calendar.execute_batch([
+        ("delete", {"summary": "Zahnarzt"}),
+        ("delete", {"summary": "Zahnarzt"}),
+    ])
+
+    assert len(http.bodies) == 1
+    assert results == [
+        "Erfolgreich gelöscht: 1 Termin(e).",
+        "Fehler: Termin 'Zahnarzt' nicht gefunden.",
+    ]
+    assert mirror_ids() == {"meeting1", "meeting2"}
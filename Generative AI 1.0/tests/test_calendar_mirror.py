@@ -0,0 +1,24 @@
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import calendar_mirror
+
+
+def test_close_closes_connections_of_all_threads(temp_db):
+    calendar_mirror.close()  # Verbindungen früherer Tests
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        connections = list(pool.map(lambda _: calendar_mirror._conn(), range(3)))
+        # Jeder Thread hält genau eine Verbindung
+        assert len(calendar_mirror._connections) == len({id(c) for c in connections}) > 0
+
+        calendar_mirror.close()
+        assert not calendar_mirror._connections
+        for conn in connections:
+            with pytest.raises(sqlite3.ProgrammingError):
+                conn.execute("SELECT 1")
+
+        # Danach verbinden sich die Threads neu, statt die geschlossene Verbindung zu nutzen
+        assert pool.submit(calendar_mirror.query_events, "2026-01-01T00:00:00", "2026-01-02T00:00:00").result() == []
+    calendar_mirror.close()
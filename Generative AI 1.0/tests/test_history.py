@@ -0,0 +1,43 @@
+import asyncio
+
+import httpx
+
+import database
+import main
+
+
+def test_etag_matches_rfc_9110_list():
+    etag = 'W/"7-0"'
+    assert main.etag_matches('W/"7-0"', etag)
+    assert main.etag_matches('"7-0"', etag)  # schwacher Vergleich
+    assert main.etag_matches('"1-0", W/"7-0"', etag)
+    assert main.etag_matches("*", etag)
+    assert not main.etag_matches('W/"7-3"', etag)
+    assert not main.etag_matches('W/"6-0", "8-0"', etag)
+    assert not main.etag_matches(None, etag)
+
+
+def test_history_etag_depends_on_since_id(temp_db):
+    async def scenario():
+        await database.init_db()
+        try:
+            for i in range(3):
+                await database.save_message("user", f"Nachricht {i}")
+            transport = httpx.ASGITransport(app=main.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                full = await client.get("/history")
+                etag = full.headers["etag"]
+                unchanged = await client.get("/history", headers={"If-None-Match": etag})
+                # Gleicher Verlaufsstand, aber andere Abfrage: keine 304 mit falschem Cache-Inhalt
+                newer = await client.get("/history", params={"since_id": 1}, headers={"If-None-Match": etag})
+                listed = await client.get("/history", headers={"If-None-Match": f'"x", {etag.removeprefix("W/")}'})
+            return full, unchanged, newer, listed
+        finally:
+            await database.close_db()
+
+    full, unchanged, newer, listed = asyncio.run(scenario())
+    assert full.status_code == 200 and len(full.json()) == 3
+    assert unchanged.status_code == 304
+    assert newer.status_code == 200 and len(newer.json()) == 2
+    assert newer.headers["etag"] != full.headers["etag"]
+    assert listed.status_code == 304
@@ -0,0 +1,73 @@
+import datetime
+
+import pytest
+
+from intent_router import ROUTER_MAX_LENGTH, _period_title, match_intent
+
+
+def _day(offset: int) -> str:
+    return (datetime.date.today() + datetime.timedelta(days=offset)).isoformat()
+
+
+ROUTED = [
+    # Notizblock
+    ("Zeig mir meine Notizen", "notes.list", {"action": "list"}),
+    ("Welche Notizen habe ich?", "notes.list", {"action": "list"}),
+    ("Lösche bitte Notiz 3!", "notes.delete", {"action": "delete", "id": "3"}),
+    ("Notiz Nr. 12 entfernen", "notes.delete", {"action": "delete", "id": "12"}),
+    ("Notiere: Brot und  Milch\nkaufen", "notes.add", {"action": "add", "content": "Brot und Milch kaufen"}),
+    ("/notiz Zahnarzt anrufen", "notes.add", {"action": "add", "content": "Zahnarzt anrufen"}),
+    ("/notizen", "notes.list", {"action": "list"}),
+    # Kalender
+    ("Was steht in den nächsten 3 Tagen an?", "calendar.list", {"action": "list", "title": "3"}),
+    ("Was steht morgen an?", "calendar.list", {"action": "list", "title": _day(1)}),
+    ("Welche Termine habe ich diese Woche?", "calendar.list", {"action": "list", "title": "7"}),
+    ("Zeig mir meine Termine", "calendar.list", {"action": "list", "title": "7"}),
+    ("/heute", "calendar.list", {"action": "list", "title": _day(0)}),
+    ("/woche@lumina_bot", "calendar.list", {"action": "list", "title": "7"}),
+]
+
+# Alles, was nicht eindeutig ist, muss an das LLM gehen (vor allem nichts löschen)
+NOT_ROUTED = [
+    "Lösche nicht Notiz 3",
+    "Lösche Notiz 3 und 4",
+    "Lösche die Notiz über den Urlaub",
+    "Was habe ich heute gemacht?",
+    "Termine",
+    "Zeig mir meine Notizen zum Urlaub",
+    "Was steht in den nächsten 400 Tagen an?",
+    "Notiere dir, dass ich Tee mag",
+    "Trag morgen um 10 Zahnarzt ein",
+    "/notiz",
+    "/unbekannt",
+    "",
+    "Zeig mir meine Notizen " + "x" * ROUTER_MAX_LENGTH,
+]
+
+
+@pytest.mark.parametrize("message, intent, fields", ROUTED)
+def test_routes_unambiguous_commands(message, intent, fields):
+    route = match_intent(message)
+    assert route is not None, message
+    assert (route.intent, route.fields) == (intent, fields)
+
+
+@pytest.mark.parametrize("message", NOT_ROUTED)
+def test_leaves_everything_else_to_the_llm(message):
+    assert match_intent(message) is None
+
+
+@pytest.mark.parametrize(
+    "period, title",
+    [
+        ("heute", _day(0)),
+        ("ubermorgen", _day(2)),
+        ("diese woche", "7"),
+        ("nachsten 1 tag", "1"),
+        ("nachsten 365 tage", "365"),
+        ("nachsten 0 tage", None),
+        ("nachsten 366 tage", None),
+    ],
+)
+def test_period_title_bounds(period, title):
+    assert _period_title(period) == title
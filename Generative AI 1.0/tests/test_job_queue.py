@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import pytest
+
+import database
+import pipeline
+from job_queue import JobQueue
+
+
+async def _until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Bedingung nicht erreicht"
+        await asyncio.sleep(0.01)
+
+
+def test_timeout_retries_bounded_jobs_only(temp_db):
+    queue = JobQueue(workers=1, timeout=0.05)
+    runs = {"bounded": 0, "unbounded": 0}
+
+    def slow(kind):
+        async def handler(payload, checkpoint):
+            runs[kind] += 1
+            await asyncio.sleep(0.15)
+
+        return handler
+
+    queue.register("bounded", slow("bounded"))
+    queue.register("unbounded", slow("unbounded"), bounded=False)
+
+    async def scenario():
+        await queue.start()
+        try:
+            await queue.enqueue("unbounded", {})
+            await _until(lambda: queue.completed == 1)
+            await queue.enqueue("bounded", {})
+            await _until(lambda: queue.retried == 1)
+        finally:
+            await queue.stop(drain_timeout=0)
+            await database.close_db()
+
+    asyncio.run(scenario())
+    assert runs == {"bounded": 1, "unbounded": 1}
+    assert queue.completed == 1 and queue.retried == 1
+
+
+def test_retry_after_timeout_does_not_repeat_actions(monkeypatch):
+    # Kalender-Aktionen laufen länger als das Job-Timeout, danach hängt persist
+    monkeypatch.setattr(pipeline.jobs, "timeout", 0.05)
+    calls = {"actions": 0, "persist": 0}
+
+    async def actions(ctx):
+        calls["actions"] += 1
+        await asyncio.sleep(0.15)
+        ctx.statuses.append("✅ Termin erstellt")
+
+    async def persist(ctx):
+        calls["persist"] += 1
+        if calls["persist"] == 1:
+            await asyncio.sleep(1)
+
+    flow = pipeline.MessagePipeline([], [("actions", actions), ("persist", persist)])
+    saved = []
+
+    async def checkpoint(payload):
+        saved.append(payload)
+
+    ctx = pipeline.MessageContext("", history_entry="", channel="test")
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(flow.finish(ctx, checkpoint))
+    assert saved[-1]["completed"] == ["actions"]
+
+    # Retry wie die Job-Queue: Kontext aus dem zuletzt gesicherten Payload
+    asyncio.run(flow.finish(pipeline.MessageContext.from_job(saved[-1]), checkpoint))
+    assert calls == {"actions": 1, "persist": 2}
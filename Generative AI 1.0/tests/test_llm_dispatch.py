@@ -0,0 +1,172 @@
+import asyncio
+import time
+
+import pytest
+
+from llm_dispatch import AllProvidersFailed, CircuitBreaker, LatencyTracker, ProviderHealth, dispatch
+
+
+def _reply(text: str, delay: float = 0.0, log: list = None):
+    async def call():
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if log is not None:
+                log.append(f"{text} abgebrochen")
+            raise
+        return text
+
+    return call
+
+
+def _failing(message: str = "kaputt"):
+    async def call():
+        raise RuntimeError(message)
+
+    return call
+
+
+def test_sequential_falls_back_to_next_provider():
+    first, second = ProviderHealth("A", timeout=1), ProviderHealth("B", timeout=1)
+    name, result = asyncio.run(dispatch([(first, _failing()), (second, _reply("b"))]))
+    assert (name, result) == ("B", "b")
+    assert first.breaker.failures == 1
+    assert second.breaker.failures == 0
+
+
+def test_sequential_timeout_counts_as_failure():
+    slow, fast = ProviderHealth("A", timeout=0.05), ProviderHealth("B", timeout=1)
+    name, _ = asyncio.run(dispatch([(slow, _reply("a", delay=1)), (fast, _reply("b"))]))
+    assert name == "B"
+    assert slow.breaker.failures == 1
+
+
+def test_sequential_all_failed():
+    providers = [(ProviderHealth(n, timeout=1), _failing()) for n in "AB"]
+    with pytest.raises(AllProvidersFailed):
+        asyncio.run(dispatch(providers))
+
+
+def test_hedged_returns_faster_provider_and_cancels_loser():
+    log = []
+    slow = ProviderHealth("A", timeout=5, default_hedge_delay=0.05)
+    fast = ProviderHealth("B", timeout=5)
+
+    async def run():
+        result = await dispatch(
+            [(slow, _reply("a", delay=2, log=log)), (fast, _reply("b", delay=0.01))], mode="hedged"
+        )
+        # Der Verlierer ist beim Zurückkehren bereits abgebrochen und abgewartet
+        assert log == ["a abgebrochen"]
+        assert not [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        return result
+
+    start = time.monotonic()
+    assert asyncio.run(run()) == ("B", "b")
+    assert time.monotonic() - start < 1
+    # Abgebrochener Aufruf ist kein Fehler
+    assert slow.breaker.failures == 0
+    assert len(fast.latency.samples) == 1
+
+
+def test_hedged_no_hedge_when_first_is_fast():
+    calls = []
+    first = ProviderHealth("A", timeout=5, default_hedge_delay=0.5)
+    second = ProviderHealth("B", timeout=5)
+
+    async def never():
+        calls.append("B")
+        return "b"
+
+    assert asyncio.run(dispatch([(first, _reply("a")), (second, never)], mode="hedged")) == ("A", "a")
+    assert calls == []
+
+
+def test_hedged_failure_starts_next_provider_immediately():
+    first = ProviderHealth("A", timeout=5, default_hedge_delay=10)
+    second = ProviderHealth("B", timeout=5)
+    start = time.monotonic()
+    assert asyncio.run(dispatch([(first, _failing()), (second, _reply("b"))], mode="hedged")) == ("B", "b")
+    assert time.monotonic() - start < 1
+
+
+def test_circuit_breaker_open_half_open_closed():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    time.sleep(0.06)
+    assert breaker.state == "half-open"
+    # Genau ein Probeaufruf
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.failures == 0
+
+
+def test_circuit_breaker_failed_trial_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_circuit_breaker_release_frees_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+
+
+def test_open_breaker_skips_provider():
+    skipped, used = ProviderHealth("A", timeout=1), ProviderHealth("B", timeout=1)
+    for _ in range(skipped.breaker.failure_threshold):
+        skipped.breaker.record_failure()
+    assert asyncio.run(dispatch([(skipped, _reply("a")), (used, _reply("b"))])) == ("B", "b")
+
+
+def test_latency_percentile_needs_minimum_samples():
+    tracker = LatencyTracker()
+    for s in (1.0, 2.0, 3.0, 4.0):
+        tracker.record(s)
+    assert tracker.percentile(0.95) is None
+    tracker.record(5.0)
+    assert tracker.percentile(0.95) == 5.0
+    assert tracker.percentile(0.5) == 3.0
+    assert tracker.percentile(0.0) == 1.0
+    # Nearest-Rank: bei 8 Werten liegen erst mit dem 8. mindestens 90 % darunter
+    for s in (6.0, 7.0, 8.0):
+        tracker.record(s)
+    assert tracker.percentile(0.9) == 8.0
+    assert tracker.percentile(0.5) == 4.0
+
+
+def test_latency_window_drops_old_samples():
+    tracker = LatencyTracker(window=5)
+    for s in (100.0, 1.0, 1.0, 1.0, 1.0, 1.0):
+        tracker.record(s)
+    assert tracker.percentile(0.95) == 1.0
+
+
+def test_hedge_delay_uses_default_then_percentile_capped_by_timeout():
+    health = ProviderHealth("A", timeout=3, default_hedge_delay=2)
+    assert health.hedge_delay(0.95) == 2
+    for s in (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8):
+        health.latency.record(s)
+    assert health.hedge_delay(0.95) == 0.8
+    assert health.hedge_delay(0.9) == 0.8
+    assert health.hedge_delay(0.5) == 0.4
+    for _ in range(8):
+        health.latency.record(10.0)
+    assert health.hedge_delay(0.95) == 3
@@ -0,0 +1,39 @@
+import asyncio
+
+import database
+import pipeline
+from pipeline import StageStats
+
+
+def _p95(samples) -> float:
+    stats = StageStats()
+    for seconds in samples:
+        stats.record(seconds, failed=False)
+    return stats.summary()["p95_ms"]
+
+
+def test_stage_p95_uses_nearest_rank():
+    # 10 Messungen: 95 % liegen erst mit dem langsamsten Wert darunter
+    assert _p95([i / 1000 for i in range(1, 11)]) == 10.0
+    assert _p95([i / 1000 for i in range(1, 21)]) == 19.0
+    assert _p95([i / 1000 for i in range(1, 101)]) == 95.0
+    assert _p95([0.005]) == 5.0
+    assert _p95([]) == 0.0
+
+
+def test_persist_after_save_reply_stores_only_statuses(temp_db):
+    async def scenario():
+        await database.init_db()
+        try:
+            ctx = pipeline.MessageContext("", history_entry="", channel="telegram")
+            ctx.display = "Termin ist eingetragen."
+            await pipeline.save_reply(ctx)
+            # Retry-Pfad: Hintergrund-Job mit Kontext aus dem Payload
+            job = pipeline.MessageContext.from_job(ctx.to_job())
+            job.statuses.append("✅ Termin erstellt")
+            await pipeline.persist(job)
+            return [row["content"] for row in await database.get_history_rows()]
+        finally:
+            await database.close_db()
+
+    assert asyncio.run(scenario()) == ["Termin ist eingetragen.", "✅ Termin erstellt"]
@@ -0,0 +1,139 @@
+import asyncio
+import re
+import socket
+import time
+from collections import defaultdict
+
+import uvicorn
+
+import database
+import fake_telegram
+import main
+import pipeline
+import telegram_bot
+
+CHATS = 3
+PER_CHAT = 5
+BASE_DELAY = 0.03
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _serve(app, port: int):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, lifespan="off", log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+# Nachricht -> Verlauf, den das LLM dafür bekommen hat
+seen_history = {}
+
+
+async def _fake_llm(system_instruction, history, message, image_bytes=None):
+    seen_history[message] = [entry["content"] for entry in history]
+    # Frühere Nachrichten eines Chats brauchen länger: ohne Reihenfolge je Chat kämen die Antworten vertauscht
+    number = int(re.search(r"\d+", message).group())
+    await asyncio.sleep(BASE_DELAY * (PER_CHAT - number // CHATS))
+    return {"content": f"Antwort auf {message}", "source": "Stub"}
+
+
+async def _history_only(ctx):
+    # Echter Verlauf aus der Datenbank, aber ohne System-Prompt (Gedächtnis, Kalender)
+    ctx.system_instruction, ctx.history = "", await database.get_chat_history(limit=100)
+
+
+def test_webhook_burst_keeps_per_chat_order(temp_db, monkeypatch):
+    fake_port, app_port = _free_port(), _free_port()
+    monkeypatch.setattr(telegram_bot, "TELEGRAM_API_URL", f"http://127.0.0.1:{fake_port}")
+    monkeypatch.setattr(telegram_bot, "TELEGRAM_WEBHOOK_URL", f"http://127.0.0.1:{app_port}/telegram/webhook")
+    monkeypatch.setattr(main, "TELEGRAM_WEBHOOK_URL", telegram_bot.TELEGRAM_WEBHOOK_URL)
+
+    async def allowed(update):
+        return True
+
+    monkeypatch.setattr(telegram_bot, "is_allowed", allowed)
+    monkeypatch.setattr(pipeline, "generate_response", _fake_llm)
+    # Kontext ohne Gedächtnis; Hintergrund-Stufen (persist) laufen ohne gestartete Queue direkt mit
+    stages = [(name, _history_only if name == "build" else stage) for name, stage in pipeline.pipeline.stages]
+    monkeypatch.setattr(pipeline.pipeline, "stages", stages)
+    seen_history.clear()
+
+    arrivals = defaultdict(list)
+    feed = main.feed_update
+
+    async def recording_feed(app, data):
+        # Reihenfolge, in der die Updates am Webhook eintreffen (der Burst ist nebenläufig)
+        arrivals[data["message"]["chat"]["id"]].append(data["message"]["text"])
+        await feed(app, data)
+
+    monkeypatch.setattr(main, "feed_update", recording_feed)
+    fake_telegram.calls.clear()
+
+    async def scenario():
+        await database.init_db()
+        fake, fake_task = await _serve(fake_telegram.fake, fake_port)
+        tg_app = telegram_bot.setup_telegram("123:fake")
+        monkeypatch.setattr(main, "tg_app", tg_app)
+        await telegram_bot.start_telegram(tg_app)
+        app, app_task = await _serve(main.app, app_port)
+        try:
+            assert fake_telegram.webhook["url"] == telegram_bot.TELEGRAM_WEBHOOK_URL
+            updates = [
+                fake_telegram.text_update(1000 + i, 100 + i % CHATS, f"Nachricht {i}")
+                for i in range(CHATS * PER_CHAT)
+            ]
+            start = time.monotonic()
+            assert await fake_telegram.send_burst(updates) == [200] * len(updates)
+
+            deadline = time.monotonic() + 20
+            while len([c for c in fake_telegram.calls if c["method"] == "sendMessage"]) < len(updates):
+                assert time.monotonic() < deadline, "nicht alle Antworten angekommen"
+                await asyncio.sleep(0.05)
+            elapsed = time.monotonic() - start
+            return elapsed, [row["content"] for row in await database.get_history_rows(limit=100)]
+        finally:
+            await telegram_bot.stop_telegram(tg_app)
+            app.should_exit = fake.should_exit = True
+            await asyncio.gather(app_task, fake_task)
+            await database.close_db()
+
+    elapsed, stored = asyncio.run(scenario())
+
+    replies = defaultdict(list)
+    for call in fake_telegram.calls:
+        if call["method"] == "sendMessage":
+            replies[int(call["params"]["chat_id"])].append(call["params"]["text"])
+
+    assert set(replies) == set(arrivals) == {100 + c for c in range(CHATS)}
+    for chat_id, texts in arrivals.items():
+        assert replies[chat_id] == [f"Antwort auf {t}" for t in texts]
+        for previous, text in zip(texts, texts[1:]):
+            # Jede Antwort sieht den vorherigen Austausch desselben Chats ...
+            assert f"Antwort auf {previous}" in seen_history[text]
+            # ... und im Verlauf steht sie vor der nächsten Nachricht
+            assert stored.index(f"Antwort auf {previous}") < stored.index(text)
+    # Chats laufen nebeneinander: deutlich schneller als alle Antworten nacheinander
+    sequential = sum(BASE_DELAY * (PER_CHAT - i // CHATS) for i in range(CHATS * PER_CHAT))
+    assert elapsed < sequential
+
+
+def test_webhook_rejects_wrong_secret(monkeypatch):
+    import httpx
+
+    tg_app = telegram_bot.setup_telegram("123:fake")
+    monkeypatch.setattr(main, "tg_app", tg_app)
+    monkeypatch.setattr(main, "TELEGRAM_WEBHOOK_URL", "http://127.0.0.1/telegram/webhook")
+
+    async def post(headers):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/telegram/webhook", json={"update_id": 1}, headers=headers)
+
+    assert asyncio.run(post({"X-Telegram-Bot-Api-Secret-Token": "falsch"})).status_code == 403
+    assert asyncio.run(post({})).status_code == 403
@@ -0,0 +1,185 @@
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+# Optionaler Server-Timing-Header mit den Spans der jeweiligen Anfrage
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "0") == "1"
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+# Spans der laufenden HTTP-Anfrage (name -> Sekunden); None = nicht erfasst
+_request_spans: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_spans", default=None
+)
+
+
+class Histogram:
+    """
+    Minimales Prometheus-Histogramm. Eine Beobachtung kostet einen Lock,
+    eine Binärsuche und drei Additionen, daher auch im Produktivbetrieb
+    dauerhaft aktivierbar. Beobachtungen kommen auch aus Worker-Threads
+    (Kalender, Whisper), deshalb der Lock.
+    """
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...], buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(s[0]), s[1], s[2]) for labels, s in self._series.items()]
+        for labels, counts, total, count in sorted(snapshot):
+            base = ",".join(
+                f'{k}="{self._escape(v)}"' for k, v in zip(self.labelnames, labels)
+            )
+            prefix = f"{base}," if base else ""
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{base}}} {total}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+SPAN_DURATION = Histogram(
+    "lumina_span_duration_seconds",
+    "Dauer einzelner Operationen (DB, LLM-Anbieter, Transkription, Google Calendar, Telegram).",
+    ("span", "status"),
+)
+HTTP_DURATION = Histogram(
+    "lumina_http_request_duration_seconds",
+    "Dauer der HTTP-Anfragen bis zum Start der Antwort.",
+    ("route", "method", "code"),
+)
+
+
+def observe(name: str, seconds: float, status: str = "ok") -> None:
+    SPAN_DURATION.observe(seconds, name, status)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + seconds
+
+
+class span:
+    """Misst einen Codeblock: `with span("db.save_message"): ...` (auch um awaits)."""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            status = "ok"
+        elif issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            status = "cancelled"
+        else:
+            status = "error"
+        observe(self.name, time.perf_counter() - self.start, status)
+
+
+def traced(name: str):
+    """Decorator-Variante von `span` für synchrone und async Funktionen."""
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def render_metrics() -> str:
+    return "\n".join(SPAN_DURATION.render() + HTTP_DURATION.render()) + "\n"
+
+
+def _server_timing(spans: Dict[str, float], total: float) -> bytes:
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in spans.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts).encode("latin-1")
+
+
+class TracingMiddleware:
+    """
+    ASGI-Middleware: misst jede HTTP-Anfrage bis zum Antwortstart und hängt
+    bei SERVER_TIMING_HEADER=1 einen Server-Timing-Header mit den Spans der
+    Anfrage an. Reine ASGI-Variante, damit Streams (SSE) nicht gepuffert werden.
+    """
+
+    def __init__(self, app, server_timing: bool = SERVER_TIMING_HEADER):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        spans: Dict[str, float] = {}
+        token = _request_spans.set(spans if self.server_timing else None)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - start
+                route = scope.get("route")
+                HTTP_DURATION.observe(
+                    elapsed,
+                    getattr(route, "path", "unmatched"),
+                    scope["method"],
+                    str(message["status"]),
+                )
+                if self.server_timing:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", _server_timing(spans, elapsed)))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_spans.reset(token)
@@ -0,0 +1,189 @@
+import asyncio
+import io
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Optional
+
+from tracing import span
+
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_WORKERS = int(os.getenv("WHISPER_WORKERS", "1"))
+WHISPER_QUEUE_SIZE = int(os.getenv("WHISPER_QUEUE_SIZE", "8"))
+WHISPER_WARMUP = os.getenv("WHISPER_WARMUP", "0") == "1"
+SAMPLING_RATE = 16000
+
+
+class TranscriptionQueueFull(Exception):
+    pass
+
+
+class TranscriptionEngine:
+    """
+    Hält das faster-whisper-Modell dauerhaft im Speicher und führt die
+    CPU-lastige Inferenz in einem begrenzten Thread-Pool aus, damit der
+    Event-Loop frei bleibt. Mehr als `max_queue` wartende Aufträge werden
+    abgelehnt, sodass der Aufrufer auf eine API ausweichen kann.
+    """
+
+    def __init__(
+        self,
+        model_size: str = WHISPER_MODEL,
+        workers: int = WHISPER_WORKERS,
+        max_queue: int = WHISPER_QUEUE_SIZE,
+    ):
+        self.model_size = model_size
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="whisper"
+        )
+        self.pending = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._latencies = deque(maxlen=200)
+
+    def _get_model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from faster_whisper import WhisperModel
+
+                    start = time.perf_counter()
+                    # Beim ersten Aufruf wird das Modell heruntergeladen (~75MB für "base")
+                    self._model = WhisperModel(
+                        self.model_size,
+                        device="cpu",
+                        compute_type="int8",
+                        num_workers=self.workers,
+                    )
+                    print(
+                        f"🎙️ Whisper-Modell '{self.model_size}' geladen "
+                        f"({time.perf_counter() - start:.1f}s)."
+                    )
+        return self._model
+
+    @property
+    def model_loaded(self) -> bool:
+        return self._model is not None
+
+    async def warm_up(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._get_model)
+        except Exception as e:
+            print(f"⚠️ Whisper-Vorladen fehlgeschlagen: {e}")
+
+    def _decode(self, data: bytes):
+        # PyAV dekodiert direkt aus dem Speicher zu 16-kHz-Mono-float32 (kein ffmpeg-Binary, keine Temp-Datei)
+        from faster_whisper.audio import decode_audio
+
+        return decode_audio(io.BytesIO(data), sampling_rate=SAMPLING_RATE)
+
+    def _run(
+        self,
+        audio: Any,
+        language: str,
+        on_segment: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        with self._stats_lock:
+            self.active += 1
+        try:
+            model = self._get_model()
+            if isinstance(audio, (bytes, bytearray)):
+                audio = self._decode(bytes(audio))
+            segments, _info = model.transcribe(audio, language=language)
+            # segments ist ein Generator: die eigentliche Dekodierung passiert hier im Worker
+            texts = []
+            for seg in segments:
+                text = seg.text.strip()
+                if text:
+                    texts.append(text)
+                    if on_segment:
+                        on_segment(text)
+            return " ".join(texts)
+        finally:
+            with self._stats_lock:
+                self.active -= 1
+
+    async def _submit(
+        self,
+        audio: Any,
+        language: str,
+        on_segment: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        if self.pending >= self.max_queue:
+            self.rejected += 1
+            raise TranscriptionQueueFull(
+                f"{self.pending} Transkriptionen in der Warteschlange"
+            )
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            with span("transcription.whisper"):
+                text = await loop.run_in_executor(
+                    self._executor, self._run, audio, language, on_segment
+                )
+            self.completed += 1
+            return text
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.pending -= 1
+            self._latencies.append(time.perf_counter() - start)
+
+    async def transcribe(self, audio: Any, language: str = "de") -> str:
+        """`audio` sind rohe Audio-Bytes (ogg/webm/...), ein Dateipfad oder ein float32-Array (16 kHz)."""
+        return await self._submit(audio, language)
+
+    async def stream(self, audio: Any, language: str = "de") -> AsyncIterator[str]:
+        """Liefert die Segmente, sobald der Worker sie erkannt hat."""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def on_segment(text: str) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, text)
+
+        job = asyncio.ensure_future(self._submit(audio, language, on_segment))
+        # Läuft nach allen zuvor aus dem Worker eingereihten Segmenten
+        job.add_done_callback(lambda _: queue.put_nowait(None))
+
+        while True:
+            text = await queue.get()
+            if text is None:
+                break
+            yield text
+        await job
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        p95 = latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)] if latencies else 0.0
+        avg = sum(latencies) / len(latencies) if latencies else 0.0
+        return {
+            "model": self.model_size,
+            "model_loaded": self.model_loaded,
+            "workers": self.workers,
+            "queue_depth": max(0, self.pending - self.active),
+            "active": self.active,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_latency_ms": round(avg * 1000, 1),
+            "p95_latency_ms": round(p95 * 1000, 1),
+        }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+engine = TranscriptionEngine()